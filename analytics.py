@@ -0,0 +1,474 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+
+import archive
+import http_cache
+
+
+# Columnar copy of the sales table for ad-hoc breakdowns.
+# Each sales column is a NumPy array in id order, appended to incrementally
+# (sales is insert-only), so hour-of-week, per-cashier, per-category and
+# period-over-period figures are a few vectorised passes over memory instead
+# of a GROUP BY over the table. Commits can land out of id order, so ids a
+# load skipped over are looked up again until GAP_TIMEOUT, after which they
+# are taken to be rolled back inserts.
+# Rows are only roughly in time order. time_high holds the running maximum
+# of sale_time, which is sorted, and meta['lag'] the furthest any row falls
+# behind it; together they narrow a date range to one contiguous slice by
+# binary search, and only that slice is masked.
+# With a directory the columns live in memory-mapped files shared by every
+# worker: whoever holds the flock appends rows and publishes a new meta.json,
+# the others remap when it changes. Growing or rebuilding writes a new
+# generation of files, so readers never see a half-copied column.
+
+COLUMNS = (
+    ('id', np.int64),
+    ('product_id', np.int32),
+    ('user_id', np.int32),  # -1 once the cashier has been deleted
+    ('quantity', np.int32),
+    ('amount', np.int64),  # cents, so sums stay exact
+    ('sale_time', np.int64),  # seconds since 1970-01-01 on the till's wall clock
+    ('time_high', np.int64)
+)
+DTYPES = dict(COLUMNS)
+
+SALE_COLUMNS = "id, product_id, user_id, quantity_sold, total_amount, sale_time"
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+UNCATEGORISED = 'Uncategorised'
+
+EPOCH = date(1970, 1, 1)
+DAY = 86400
+MIN_CAPACITY = 1 << 16
+GAP_TIMEOUT = 120  # seconds a skipped id is looked for before it is given up
+MAX_GAPS = 10000
+
+def day_seconds(day):
+    return (day - EPOCH).days * DAY
+
+def percent_change(current, previous):
+    if not previous:
+        return None
+    return round((current - previous) / previous * 100, 1)
+
+def _rows_to_columns(rows):
+    return {
+        'id': np.array([row['id'] for row in rows], np.int64),
+        'product_id': np.array([row['product_id'] for row in rows], np.int32),
+        'user_id': np.array([-1 if row['user_id'] is None else row['user_id'] for row in rows], np.int32),
+        'quantity': np.array([row['quantity_sold'] for row in rows], np.int32),
+        'amount': np.array([int(row['total_amount'] * 100) for row in rows], np.int64),
+        'sale_time': np.array([row['sale_time'] for row in rows], 'datetime64[s]').astype(np.int64)
+    }
+
+def _concat(chunks):
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.empty(0, dtype)
+            for name, dtype in COLUMNS if name != 'time_high'}
+
+def _category_codes(product_ids, categories, uncategorised):
+    codes = np.full(len(product_ids), uncategorised, np.int64)
+    known = product_ids < len(categories)
+    codes[known] = categories[product_ids[known]]
+    return codes
+
+class SalesColumns:
+    def __init__(self, directory=None, refresh_interval=5, batch_size=50000):
+        self.directory = directory or None
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self._arrays = {}
+        self._meta = self._new_meta(0)
+        self._meta_stamp = None
+        self._categories = np.empty(0, np.int64)
+        self._category_names = [UNCATEGORISED]
+        self._products_version = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._last_check = 0
+        self._stats = {'loads': 0, 'rows_loaded': 0, 'last_load_seconds': 0.0}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def _new_meta(generation):
+        return {'generation': generation, 'capacity': 0, 'count': 0, 'last_id': 0, 'lag': 0,
+                'loaded': False, 'gaps': []}
+
+    def _path(self, name, generation=None):
+        if generation is not None:
+            name = f'{name}.{generation}.col'
+        return os.path.join(self.directory, name)
+
+    def _allocate(self, generation, capacity):
+        if not self.directory:
+            return {name: np.empty(capacity, dtype) for name, dtype in COLUMNS}
+        return {name: np.memmap(self._path(name, generation), dtype, 'w+', shape=(capacity,))
+                for name, dtype in COLUMNS}
+
+    def _sync(self):
+        # Map whatever another worker has published since we last looked
+        if not self.directory:
+            return
+        try:
+            stat = os.stat(self._path('meta.json'))
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+            if stamp == self._meta_stamp:
+                return
+            with open(self._path('meta.json')) as f:
+                meta = json.load(f)
+            arrays = self._arrays
+            if meta['generation'] != self._meta['generation'] or not arrays:
+                arrays = {name: np.memmap(self._path(name, meta['generation']), dtype, 'r+',
+                                          shape=(meta['capacity'],))
+                          for name, dtype in COLUMNS} if meta['capacity'] else {}
+        except FileNotFoundError:
+            # Nothing published yet, or a rebuild replaced the generation
+            # between the two reads; the next call tries again
+            return
+        with self._lock:
+            self._arrays = arrays
+            self._meta = meta
+            self._meta_stamp = stamp
+
+    def _publish(self, arrays, meta):
+        stamp = None
+        previous = self._meta['generation']
+        if self.directory:
+            for array in arrays.values():
+                array.flush()
+            temp_path = self._path('meta.json.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(temp_path, self._path('meta.json'))
+            stat = os.stat(self._path('meta.json'))
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            self._arrays = arrays
+            self._meta = meta
+            self._meta_stamp = stamp
+        if self.directory and meta['generation'] != previous:
+            # Workers still mapping the old files keep reading them until
+            # they remap; unlinking does not pull the pages from under them
+            for name, _dtype in COLUMNS:
+                try:
+                    os.remove(self._path(name, previous))
+                except FileNotFoundError:
+                    pass
+
+    @contextmanager
+    def _writer(self, blocking):
+        # Only one process appends at a time; the rest just remap
+        if not self.directory:
+            yield True
+            return
+        with open(self._path('lock'), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                owner = True
+            except BlockingIOError:
+                owner = False
+            yield owner
+
+    def _append(self, columns, meta, arrays):
+        count = meta['count']
+        n = len(columns['id'])
+        if count + n > meta['capacity']:
+            capacity = max(MIN_CAPACITY, meta['capacity'] * 2, count + n)
+            meta['generation'] += 1
+            grown = self._allocate(meta['generation'], capacity)
+            for name, _dtype in COLUMNS:
+                if count:
+                    grown[name][:count] = arrays[name][:count]
+            arrays = grown
+            meta['capacity'] = capacity
+
+        if n:
+            time_high = np.maximum.accumulate(columns['sale_time'])
+            if count:
+                time_high = np.maximum(time_high, arrays['time_high'][count - 1])
+            for name, column in columns.items():
+                arrays[name][count:count + n] = column
+            arrays['time_high'][count:count + n] = time_high
+            meta['count'] = count + n
+            meta['last_id'] = max(meta['last_id'], int(columns['id'].max()))
+            meta['lag'] = max(meta['lag'], int((time_high - columns['sale_time']).max()))
+
+        self._publish(arrays, meta)
+        return n
+
+    def _fetch_after(self, cur, table, last_id):
+        cur.execute(f"""
+            SELECT {SALE_COLUMNS}
+            FROM {table}
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, self.batch_size))
+        return cur.fetchall()
+
+    def _load_all(self, cur):
+        # The hot table is read before the archive: a row archived mid-load
+        # then shows up twice, and is deduplicated, rather than not at all
+        chunks = []
+        for table in reversed(archive.tables_for_range(cur, 'sales', None)):
+            last_id = 0
+            while True:
+                rows = self._fetch_after(cur, table, last_id)
+                if not rows:
+                    break
+                chunks.append(_rows_to_columns(rows))
+                last_id = rows[-1]['id']
+
+        columns = _concat(chunks)
+        _ids, first = np.unique(columns['id'], return_index=True)
+        columns = {name: column[first] for name, column in columns.items()}
+
+        meta = self._new_meta(self._meta['generation'])
+        meta['loaded'] = True
+        if len(first):
+            # Recent ids missing from the load may still be committing
+            last_id = int(columns['id'][-1])
+            recent = np.arange(max(last_id - MAX_GAPS, 0) + 1, last_id + 1)
+            now = time.time()
+            meta['gaps'] = [[int(gap_id), now] for gap_id in np.setdiff1d(recent, columns['id'])]
+        return self._append(columns, meta, {})
+
+    def _load_new(self, cur):
+        meta = dict(self._meta)
+        now = time.time()
+        gaps = {gap_id: seen for gap_id, seen in meta['gaps'] if now - seen < GAP_TIMEOUT}
+        chunks = []
+        if gaps:
+            # A late commit may already have been archived by the time the
+            # gap is rechecked
+            placeholders = ', '.join(['%s'] * len(gaps))
+            cur.execute(*archive.union_all(f"SELECT {SALE_COLUMNS} FROM {{table}} WHERE id IN ({placeholders})",
+                                           archive.tables_for_range(cur, 'sales', None), tuple(gaps)))
+            rows = cur.fetchall()
+            if rows:
+                chunks.append(_rows_to_columns(rows))
+                for row in rows:
+                    gaps.pop(row['id'], None)
+
+        last_id = meta['last_id']
+        while True:
+            rows = self._fetch_after(cur, 'sales', last_id)
+            if not rows:
+                break
+            columns = _rows_to_columns(rows)
+            chunks.append(columns)
+            first_id = max(last_id, rows[-1]['id'] - len(rows) - MAX_GAPS) + 1
+            skipped = np.setdiff1d(np.arange(first_id, rows[-1]['id'] + 1), columns['id'])
+            gaps.update((int(gap_id), now) for gap_id in skipped[-MAX_GAPS:])
+            last_id = rows[-1]['id']
+            if len(rows) < self.batch_size:
+                break
+
+        meta['gaps'] = [[gap_id, seen] for gap_id, seen in sorted(gaps.items())[-MAX_GAPS:]]
+        if not chunks and meta['gaps'] == self._meta['gaps']:
+            return 0
+        return self._append(_concat(chunks), meta, self._arrays)
+
+    def _load_categories(self, cur):
+        version = http_cache.data_versions(cur, ('products',))
+        if version == self._products_version:
+            return
+        cur.execute("""
+            SELECT p.id, c.name as category_name
+            FROM products p
+            LEFT JOIN categories c ON p.category = c.id
+        """)
+        rows = cur.fetchall()
+        names = sorted({row['category_name'] for row in rows if row['category_name']})
+        index = {name: code for code, name in enumerate(names)}
+        categories = np.full(max((row['id'] for row in rows), default=-1) + 1, len(names), np.int64)
+        for row in rows:
+            if row['category_name']:
+                categories[row['id']] = index[row['category_name']]
+        with self._lock:
+            self._categories = categories
+            self._category_names = names + [UNCATEGORISED]
+            self._products_version = version
+
+    def _load(self, cur, rebuild):
+        started = time.perf_counter()
+        with self._writer(blocking=rebuild or not self._meta['loaded']) as owner:
+            if owner:
+                # Another worker may have appended while we waited
+                self._sync()
+                loaded = self._load_new(cur) if self._meta['loaded'] and not rebuild else self._load_all(cur)
+                if loaded:
+                    self._stats['loads'] += 1
+                    self._stats['rows_loaded'] += loaded
+                    self._stats['last_load_seconds'] = time.perf_counter() - started
+        self._load_categories(cur)
+
+    def refresh(self, cur, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_check < self.refresh_interval:
+            return
+        # One load at a time; other callers keep reading the current columns
+        if not self._refresh_lock.acquire(blocking=force or not self._meta['loaded']):
+            return
+        try:
+            self._last_check = now
+            self._sync()
+            self._load(cur, rebuild=False)
+        finally:
+            self._refresh_lock.release()
+
+    def rebuild(self, cur):
+        # Full reload, e.g. after correcting sales by hand; also restores
+        # near time order if a journal replay appended very old rows
+        with self._refresh_lock:
+            self._sync()
+            self._load(cur, rebuild=True)
+            self._last_check = time.monotonic()
+
+    def watermark(self):
+        with self._lock:
+            return self._meta['generation'], self._meta['count'], self._products_version
+
+    def _select(self, start, end, *names):
+        # start and end are dates, end inclusive
+        with self._lock:
+            count = self._meta['count']
+            lag = self._meta['lag']
+            arrays = self._arrays
+        if not count:
+            return {name: np.empty(0, DTYPES[name]) for name in names}
+
+        low = day_seconds(start)
+        high = day_seconds(end + timedelta(days=1))
+        # Rows before lo have time_high < low, and rows from hi on have
+        # sale_time >= time_high - lag >= high. Between inner_lo and inner_hi
+        # every row is in range, so only the two edges (at most lag seconds
+        # of sales each) need masking and the middle is used without a copy.
+        time_high = arrays['time_high'][:count]
+        lo, inner_lo, inner_hi, hi = (int(bound) for bound in np.searchsorted(
+            time_high, (low, low + lag, high, high + lag), 'left'))
+        inner_lo = min(inner_lo, inner_hi)
+        edges = []
+        for edge_lo, edge_hi in ((lo, inner_lo), (max(inner_hi, inner_lo), hi)):
+            sale_time = arrays['sale_time'][edge_lo:edge_hi]
+            edges.append((edge_lo, edge_hi, (sale_time >= low) & (sale_time < high)))
+
+        columns = {}
+        for name in names:
+            parts = [np.asarray(arrays[name][edge_lo:edge_hi][mask]) for edge_lo, edge_hi, mask in edges]
+            middle = np.asarray(arrays[name][inner_lo:inner_hi])
+            if len(parts[0]) or len(parts[1]):
+                middle = np.concatenate((parts[0], middle, parts[1]))
+            columns[name] = middle
+        return columns
+
+    def _category_map(self):
+        with self._lock:
+            return self._categories, self._category_names
+
+    def hour_of_week(self, start, end):
+        rows = self._select(start, end, 'amount', 'sale_time')
+        # Hour of the week counted from Monday 00:00; 1970-01-01 was a Thursday
+        slots = (rows['sale_time'] + 3 * DAY) % (7 * DAY) // 3600
+        revenue = np.bincount(slots, weights=rows['amount'], minlength=7 * 24) / 100
+        transactions = np.bincount(slots, minlength=7 * 24)
+        return {
+            'revenue': revenue.reshape(7, 24).round(2).tolist(),
+            'transactions': transactions.reshape(7, 24).tolist()
+        }
+
+    def cashiers(self, start, end):
+        rows = self._select(start, end, 'user_id', 'quantity', 'amount', 'sale_time')
+        if not len(rows['user_id']):
+            return []
+        users, inverse = np.unique(rows['user_id'], return_inverse=True)
+        inverse = inverse.astype(np.int64)
+        sales = np.bincount(inverse, minlength=len(users))
+        units = np.bincount(inverse, weights=rows['quantity'], minlength=len(users))
+        revenue = np.bincount(inverse, weights=rows['amount'], minlength=len(users)) / 100
+
+        # Clock hours in which the cashier rang up at least one sale
+        hours = rows['sale_time'] // 3600
+        hours -= hours.min()
+        span = int(hours.max()) + 1
+        active_hours = np.bincount(np.unique(inverse * span + hours) // span, minlength=len(users))
+
+        return [{
+            'user_id': None if users[i] < 0 else int(users[i]),
+            'sales': int(sales[i]),
+            'units': int(units[i]),
+            'revenue': round(float(revenue[i]), 2),
+            'active_hours': int(active_hours[i]),
+            'sales_per_hour': round(float(sales[i] / active_hours[i]), 2),
+            'revenue_per_hour': round(float(revenue[i] / active_hours[i]), 2)
+        } for i in np.argsort(-revenue, kind='stable')]
+
+    def category_trend(self, start, end, bucket_days=1):
+        rows = self._select(start, end, 'product_id', 'amount', 'sale_time')
+        categories, names = self._category_map()
+        buckets = (end - start).days // bucket_days + 1
+        codes = _category_codes(rows['product_id'], categories, len(names) - 1)
+        offsets = (rows['sale_time'] - day_seconds(start)) // (DAY * bucket_days)
+        revenue = np.bincount(codes * buckets + offsets, weights=rows['amount'],
+                              minlength=len(names) * buckets).reshape(len(names), buckets) / 100
+        totals = revenue.sum(axis=1)
+        return {
+            'labels': [start + timedelta(days=bucket * bucket_days) for bucket in range(buckets)],
+            'series': [{
+                'category': names[code],
+                'total': round(float(totals[code]), 2),
+                'revenue': revenue[code].round(2).tolist()
+            } for code in np.argsort(-totals, kind='stable') if totals[code]]
+        }
+
+    def _summary(self, start, end, categories, names):
+        rows = self._select(start, end, 'product_id', 'quantity', 'amount')
+        codes = _category_codes(rows['product_id'], categories, len(names) - 1)
+        return {
+            'date_from': start,
+            'date_to': end,
+            'transactions': len(rows['amount']),
+            'units': int(rows['quantity'].sum()),
+            'revenue': round(int(rows['amount'].sum()) / 100, 2)
+        }, np.bincount(codes, weights=rows['amount'], minlength=len(names)) / 100
+
+    def compare(self, start, end):
+        # Against the period of the same length that ends the day before
+        days = (end - start).days + 1
+        categories, names = self._category_map()
+        current, current_categories = self._summary(start, end, categories, names)
+        previous, previous_categories = self._summary(start - timedelta(days=days), start - timedelta(days=1),
+                                                      categories, names)
+        return {
+            'current': current,
+            'previous': previous,
+            'change': {metric: percent_change(current[metric], previous[metric])
+                       for metric in ('transactions', 'units', 'revenue')},
+            'categories': [{
+                'category': names[code],
+                'current': round(float(current_categories[code]), 2),
+                'previous': round(float(previous_categories[code]), 2),
+                'change': percent_change(current_categories[code], previous_categories[code])
+            } for code in np.argsort(-current_categories, kind='stable')
+                if current_categories[code] or previous_categories[code]]
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'rows': self._meta['count'],
+                'last_id': self._meta['last_id'],
+                'lag_seconds': self._meta['lag'],
+                'pending_gaps': len(self._meta['gaps']),
+                'bytes': self._meta['capacity'] * sum(np.dtype(dtype).itemsize for _name, dtype in COLUMNS),
+                'shared': self.directory is not None
+            })
+            return stats
@@ -1,17 +1,113 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from flask_mysqldb import MySQL
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, send_file, stream_with_context, g, has_request_context, before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache
+import MySQLdb
+from MySQLdb.cursors import SSCursor
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+import atexit
+import csv
+import io
+import os
 import re
+import tempfile
+import threading
+import time
+import click
+import xlsxwriter
+
+import archive
+import http_cache
+import product_import
+import rollup
+from analytics import WEEKDAYS, SalesColumns
+from audit import AuditWriter
+from barcodes import BARCODE_COLUMNS, BarcodeMap
+from documents import JOB_ID_RE, DocumentRenderer, RenderQueueFull
+from feed import ChangeFeed, FeedFull
+from journal import SaleJournal
+from leaderboard import WINDOWS as LEADERBOARD_WINDOWS, Leaderboard
+from reorder import LOW_STOCK_COLUMNS, LowStockTracker, draft_purchase_orders, forecast_reorder_levels, save_forecasts
+from db import ER_LOCK_DEADLOCK, PooledMySQL, backoff_delay, is_transient
+from metrics import InstrumentedCursor, Metrics, gauge_lines
+from cache import TTLCache, VersionedCache
+from pagination import decode_cursor, encode_cursor, keyset_page, page_tokens
+from search import PRODUCT_DOCUMENT_QUERY, ProductSearchIndex
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
 app.secret_key = app.config['SECRET_KEY']  # Move to config file
 
-# Initialize MySQL connection with DictCursor
+# Initialize the pooled MySQL connections with DictCursor
 app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
-mysql = MySQL(app)
+mysql = PooledMySQL(app)
+
+# Audit events are written to audit_log in batches by a background thread;
+# the queue is drained on graceful shutdown
+audit_log = AuditWriter(mysql.pool, app.config['AUDIT_QUEUE_SIZE'], app.config['AUDIT_BATCH_SIZE'],
+                        app.config['AUDIT_FLUSH_INTERVAL'], app.config['AUDIT_ENQUEUE_TIMEOUT'])
+atexit.register(audit_log.stop)
+
+# Request and query timing, exposed in Prometheus format at /metrics
+metrics = Metrics(app.config['SLOW_QUERY_THRESHOLD_MS'] / 1000.0, app.config['SLOW_QUERY_LOG_SIZE'])
+
+# Shared dashboard figures, invalidated whenever a sale or product change commits
+dashboard_cache = TTLCache(app.config['DASHBOARD_CACHE_TTL'])
+
+# Approximate row counts for pagination, refreshed at most once per TTL
+count_cache = TTLCache(app.config['COUNT_CACHE_TTL'])
+
+STOCK_SORT_COLUMNS = ('id', 'product_name', 'price', 'quantity')
+
+# Catalog data is read far more often than it changes; writes bump the
+# namespace version instead of deleting entries
+catalog_cache = VersionedCache(app.config['CATALOG_CACHE_SIZE'], app.config['CATALOG_CACHE_TTL'])
+
+# Compiled templates are shared between workers and survive restarts; the
+# cache key includes a checksum of the template source, so edits recompile
+os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+# Rendered row markup keyed on the row's version; entries never go stale,
+# superseded versions are evicted in LRU order
+fragment_cache = VersionedCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+# Ranked product search over name, barcode and category
+product_index = ProductSearchIndex(app.config['SEARCH_INDEX_REFRESH'])
+
+# Committed changes pushed to open dashboards over /api/stream; other
+# workers' commits are noticed through the data versions
+def committed_versions():
+    with app.app_context():
+        cur = get_db_cursor()
+        try:
+            return http_cache.data_versions(cur, ('products', 'sales'))
+        finally:
+            cur.close()
+
+change_feed = ChangeFeed(app.config['STREAM_HISTORY'], app.config['STREAM_HEARTBEAT'],
+                         app.config['STREAM_MAX_SUBSCRIBERS'], committed_versions)
+
+# Best sellers per window, kept current as sales commit
+leaderboard = Leaderboard(app.config['LEADERBOARD_SIZE'], app.config['LEADERBOARD_RECONCILE_INTERVAL'])
+
+# Products at or below their min_stock_level
+low_stock_tracker = LowStockTracker(app.config['LOW_STOCK_REFRESH_INTERVAL'], app.config['LOW_STOCK_RELOAD_INTERVAL'])
+
+# Barcode -> (id, name, price, stock) for scanning tills, loaded in the
+# background by each worker's first request
+barcode_map = BarcodeMap(app.config['BARCODE_REFRESH_INTERVAL'])
+
+# Columnar copy of sales behind /api/analytics
+sales_columns = SalesColumns(app.config['ANALYTICS_DIR'], app.config['ANALYTICS_REFRESH_INTERVAL'],
+                             app.config['ANALYTICS_LOAD_BATCH'])
+
+# Receipt and report PDFs, rendered by a small process pool and cached on
+# disk under a hash of their content
+documents = DocumentRenderer(app.config['DOCUMENT_CACHE_DIR'], app.config['DOCUMENT_WORKERS'],
+                             app.config['DOCUMENT_MAX_PENDING'], app.config['DOCUMENT_CACHE_MAX_BYTES'],
+                             app.config['DOCUMENT_JOB_TIMEOUT'])
+atexit.register(documents.stop)
 
 # Login required decorator
 def login_required(f):
@@ -23,9 +119,120 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Conditional GET: the ETag covers the data versions of `tables`, the URL
+# and the user, plus any extra key the response depends on
+def conditional(*tables, key=None):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # A pending flash message has to be rendered, not revalidated
+            if '_flashes' in session:
+                return f(*args, **kwargs)
+
+            cur = get_db_cursor(read_only=True)
+            try:
+                versions = http_cache.data_versions(cur, tables)
+            finally:
+                cur.close()
+            etag = http_cache.make_etag(versions, request.full_path, session.get('user_id'),
+                                        key() if key else None)
+
+            matched = http_cache.matching_etag(request.if_none_match, etag)
+            if matched:
+                response = Response(status=304)
+                response.set_etag(matched)
+                response.headers['Cache-Control'] = 'private, no-cache'
+                response.vary.add('Accept-Encoding')
+                return response
+
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# Request timing
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe_request(request.endpoint, request.method, response.status_code,
+                                time.perf_counter() - started)
+    return response
+
+def load_barcode_map():
+    with app.app_context():
+        cur = get_db_cursor()
+        try:
+            barcode_map.refresh(cur)
+        except Exception as e:
+            app.logger.error(f"Barcode map warmup error: {str(e)}")
+        finally:
+            cur.close()
+
+@app.before_request
+def warm_barcode_map():
+    if barcode_map.claim_warmup():
+        threading.Thread(target=load_barcode_map, name='barcode-warmup', daemon=True).start()
+
+# Registered after the timing hook so it runs first and is included in the
+# request duration
+@app.after_request
+def compress_response(response):
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+            or 'Content-Encoding' in response.headers or not http_cache.compressible(response.mimetype):
+        return response
+    body = response.get_data()
+    if len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = http_cache.choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    compressed = http_cache.compress(body, encoding, app.config['COMPRESS_LEVEL'], app.config['BROTLI_QUALITY'])
+    metrics.observe_compression(encoding, len(body), len(compressed))
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+# Template render timing
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_render_timing(sender, template, context, **extra):
+    started = g.get('render_started')
+    if started:
+        metrics.observe_render(template.name, time.perf_counter() - started.pop())
+
+@app.template_global()
+def cached_fragment(name, key, macro, *args):
+    return fragment_cache.get_or_set(name, key, lambda: macro(*args))
+
 # Utility functions
-def get_db_cursor():
-    return mysql.connection.cursor()
+def get_db_cursor(cursorclass=None, read_only=False):
+    # Read-only work may go to a replica, except right after the session
+    # wrote something, so users always see their own changes
+    endpoint = request.endpoint if has_request_context() else 'cli'
+    replica_ok = read_only and has_request_context() and session.get('primary_until', 0) < time.time()
+    conn = mysql.read_connection if replica_ok else mysql.connection
+    return InstrumentedCursor(conn.cursor(cursorclass), metrics, endpoint)
+
+def stick_to_primary():
+    if has_request_context() and mysql.replicas:
+        session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
 
 def validate_email(email):
     # Fix: Remove UGX suffix and use a more standard email regex pattern
@@ -35,6 +242,320 @@ def validate_email(email):
 def validate_password(password):
     return len(password) >= 8
 
+def audit(action, table_name, record_id=None, old_values=None, new_values=None, user_id=None, block=False):
+    # user_id names the acting user where there is no request to take it
+    # from, e.g. sales committed by the journal's flusher thread; bulk jobs
+    # pass block=True so a burst of events waits instead of being dropped
+    context = {'user_id': user_id, 'block': block}
+    if has_request_context():
+        context = {
+            'user_id': user_id if user_id is not None else session.get('user_id'),
+            'ip_address': request.remote_addr,
+            'user_agent': request.user_agent.string,
+            'block': block
+        }
+    audit_log.record(action, table_name, record_id, old_values, new_values, **context)
+
+# Post-commit hooks
+def sales_committed(sale_rows):
+    stick_to_primary()
+    dashboard_cache.clear()
+    catalog_cache.bump('products')
+    leaderboard.record(sale_rows)
+
+    product_ids = sorted({row[0] for row in sale_rows})
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cur = get_db_cursor()
+    try:
+        cur.execute(f"SELECT {LOW_STOCK_COLUMNS} FROM products WHERE id IN ({placeholders})", tuple(product_ids))
+        products = {row['id']: row for row in cur.fetchall()}
+    finally:
+        cur.close()
+    entered = low_stock_tracker.update(products.values())
+    barcode_map.update_stock(products.values())
+
+    publish_sales(sale_rows, products, entered)
+    for product_id, user_id, quantity, unit_price, total_amount, _sale_time in sale_rows:
+        audit('SALE', 'products', product_id, new_values={
+            'quantity_sold': quantity,
+            'unit_price': unit_price,
+            'total_amount': total_amount
+        }, user_id=user_id)
+
+def products_changed(product_id=None, deleted=False):
+    stick_to_primary()
+    dashboard_cache.clear()
+    count_cache.clear()
+    catalog_cache.bump('products')
+    # Counts and lists may all have moved; dashboards reload the snapshot
+    change_feed.publish('refresh', {'reason': 'products'})
+
+    cur = get_db_cursor()
+    try:
+        http_cache.bump_data_version(cur, 'products')
+        mysql.connection.commit()
+    finally:
+        cur.close()
+
+    if product_id is None:
+        low_stock_tracker.expire()
+        barcode_map.expire()
+        return
+    leaderboard.forget_name(product_id)
+    if deleted:
+        product_index.remove(product_id)
+        low_stock_tracker.remove(product_id)
+        barcode_map.remove(product_id)
+        return
+
+    cur = get_db_cursor()
+    try:
+        cur.execute(PRODUCT_DOCUMENT_QUERY + " WHERE p.id = %s", (product_id,))
+        row = cur.fetchone()
+        if row:
+            product_index.add_or_update(row['id'], row['product_name'], row['barcode'], row['category_name'])
+
+        cur.execute(f"SELECT {LOW_STOCK_COLUMNS} FROM products WHERE id = %s", (product_id,))
+        low_stock_tracker.update(cur.fetchall())
+
+        cur.execute(f"SELECT {BARCODE_COLUMNS} FROM products WHERE id = %s", (product_id,))
+        row = cur.fetchone()
+        if row:
+            barcode_map.add_or_update(row)
+    finally:
+        cur.close()
+
+def publish_sales(sale_rows, products, entered):
+    for product_id, _user_id, quantity, _unit_price, total_amount, sale_time in sale_rows:
+        product = products.get(product_id)
+        change_feed.publish('sale', {
+            'product_id': product_id,
+            'product': product['product_name'] if product else None,
+            'quantity': quantity,
+            'amount': float(total_amount),
+            'time': sale_time.isoformat()
+        })
+
+    change_feed.publish('totals', {
+        'date': sale_rows[0][5].date().isoformat(),
+        'sales_count': len(sale_rows),
+        'sales_total': float(sum(row[4] for row in sale_rows))
+    })
+
+    # Only products this sale took down to their reorder level
+    for product in entered:
+        change_feed.publish('low_stock', {
+            'id': product['id'],
+            'product': product['product_name'],
+            'stock': product['quantity']
+        })
+
+def get_sellable_products():
+    def load():
+        cur = get_db_cursor()
+        try:
+            cur.execute("""
+                SELECT id, product_name, price, quantity, updated_at
+                FROM products 
+                WHERE quantity > 0 AND is_active = TRUE
+                ORDER BY product_name
+            """)
+            return tuple(cur.fetchall())
+        finally:
+            cur.close()
+    return catalog_cache.get_or_set('products', 'sellable', load)
+
+def get_categories():
+    def load():
+        cur = get_db_cursor()
+        try:
+            cur.execute("SELECT * FROM categories ORDER BY name")
+            return tuple(cur.fetchall())
+        finally:
+            cur.close()
+    return catalog_cache.get_or_set('categories', 'all', load)
+
+def search_product_ids(query):
+    cur = get_db_cursor()
+    try:
+        product_index.refresh(cur)
+        return product_index.matches(query)
+    finally:
+        cur.close()
+
+def search_products(query, page, per_page):
+    cur = get_db_cursor()
+    try:
+        product_index.refresh(cur)
+        product_ids, total = product_index.search(query, page, per_page)
+        if not product_ids:
+            return [], total
+
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        cur.execute(f"""
+            SELECT p.*, c.name as category_name 
+            FROM products p 
+            LEFT JOIN categories c ON p.category = c.id 
+            WHERE p.id IN ({placeholders})
+        """, tuple(product_ids))
+        rows = {row['id']: row for row in cur.fetchall()}
+        return [rows[pid] for pid in product_ids if pid in rows], total
+    finally:
+        cur.close()
+
+def get_top_products(window, limit):
+    # Only touches the database to (re)load the leaderboard or to name
+    # products first sold since the last load
+    if leaderboard.needs_refresh():
+        cur = get_db_cursor()
+        try:
+            leaderboard.refresh(cur)
+        finally:
+            cur.close()
+
+    entries = leaderboard.top(window, limit)
+    missing = tuple(product_id for product_id, _count in entries if product_id not in leaderboard.names)
+    if missing:
+        placeholders = ', '.join(['%s'] * len(missing))
+        cur = get_db_cursor()
+        try:
+            cur.execute(f"SELECT id, product_name FROM products WHERE id IN ({placeholders})", missing)
+            leaderboard.set_names({row['id']: row['product_name'] for row in cur.fetchall()})
+        finally:
+            cur.close()
+
+    return [{
+        'product_id': product_id,
+        'product_name': leaderboard.names.get(product_id),
+        'total_sold': count
+    } for product_id, count in entries]
+
+def get_low_stock(limit=5):
+    cur = get_db_cursor()
+    try:
+        low_stock_tracker.refresh(cur)
+    finally:
+        cur.close()
+    return len(low_stock_tracker), low_stock_tracker.lowest(limit)
+
+def find_by_barcode(barcode):
+    # Returns (product_id, product_name, price, quantity) or None. Until the
+    # map has loaded, scans fall back to the barcode index.
+    if barcode_map.loaded:
+        if barcode_map.needs_refresh():
+            cur = get_db_cursor()
+            try:
+                barcode_map.refresh(cur)
+            finally:
+                cur.close()
+        return barcode_map.lookup(barcode)
+
+    cur = get_db_cursor()
+    try:
+        cur.execute(f"SELECT {BARCODE_COLUMNS} FROM products WHERE barcode = %s", (barcode.strip(),))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if not row or not row['is_active']:
+        return None
+    return row['id'], row['product_name'], row['price'], row['quantity']
+
+def get_sales_columns():
+    cur = get_db_cursor(read_only=True)
+    try:
+        sales_columns.refresh(cur)
+    finally:
+        cur.close()
+    return sales_columns
+
+def analytics_range(default_days=30):
+    # date_from/date_to query arguments, both inclusive; defaults to the
+    # last default_days days
+    today = datetime.now().date()
+    start = rollup.parse_date(request.args.get('date_from'), today - timedelta(days=default_days - 1))
+    end = rollup.parse_date(request.args.get('date_to'), today)
+    if start > end:
+        raise ValueError('date_from must not be after date_to')
+    return start, end
+
+def cached_count(key, query, params=()):
+    def count():
+        cur = get_db_cursor()
+        try:
+            cur.execute(query, params)
+            return cur.fetchone()['count']
+        finally:
+            cur.close()
+    return count_cache.get_or_set(key, count)
+
+def build_dashboard_snapshot():
+    # Taken before the queries: every event up to this id is reflected in
+    # the figures below, and the dashboard streams from here
+    last_event_id = change_feed.last_event_id()
+
+    cur = get_db_cursor(read_only=True)
+    try:
+        cur.execute("SELECT COUNT(*) as total_products FROM products")
+        counts = cur.fetchone()
+
+        today_date = datetime.now().date()
+        today = rollup.range_summary(cur, today_date, today_date)
+
+        # The week series is a suffix of the month series, so fetch it once
+        month = rollup.daily_totals(cur, today_date - timedelta(days=30), today_date)
+        week_start = today_date - timedelta(days=7)
+        week = [row for row in month if row['date'] >= week_start]
+
+        cur.execute("""
+            SELECT p.product_name as product,
+                   s.quantity_sold as quantity,
+                   s.total_amount as amount,
+                   s.sale_time as time
+            FROM sales s
+            JOIN products p ON s.product_id = p.id
+            ORDER BY s.sale_time DESC
+            LIMIT 5
+        """)
+        recent = cur.fetchall()
+    finally:
+        cur.close()
+
+    top = get_top_products('all', 5)
+    low_stock_count, low_items = get_low_stock(5)
+
+    return {
+        'total_products': counts['total_products'],
+        'low_stock': low_stock_count,
+        'daily_sales_count': int(today['count']),
+        'daily_sales_total': float(today['total']),
+        'sales_data': {
+            period: {
+                'labels': [row['date'].strftime('%Y-%m-%d') for row in rows],
+                'values': [float(row['total']) for row in rows]
+            } for period, rows in (('week', week), ('month', month))
+        },
+        'top_products': {
+            'labels': [row['product_name'] for row in top],
+            'values': [int(row['total_sold']) for row in top]
+        },
+        'recent_sales': [{
+            'product': sale['product'],
+            'quantity': sale['quantity'],
+            'amount': float(sale['amount']),
+            'time': sale['time'].isoformat()
+        } for sale in recent],
+        'low_stock_items': [{
+            'id': item['id'],
+            'product': item['product_name'],
+            'stock': item['quantity']
+        } for item in low_items],
+        'last_event_id': last_event_id,
+        'generated_at': datetime.now().isoformat()
+    }
+
+def get_dashboard_snapshot():
+    return dashboard_cache.get_or_set('snapshot', build_dashboard_snapshot)
+
 # Home Page
 @app.route('/')
 def index():
@@ -47,36 +568,17 @@ def index():
 @login_required
 def dashboard():
     try:
-        cur = get_db_cursor()
-        
-        # Get total products
-        cur.execute("SELECT COUNT(*) as count FROM products")
-        total_products = cur.fetchone()['count']
-        
-        # Get low stock products
-        cur.execute("SELECT COUNT(*) as count FROM products WHERE quantity < 10")
-        low_stock = cur.fetchone()['count']
-        
-        # Get today's sales
-        cur.execute("""
-            SELECT COUNT(*) as count, 
-                   COALESCE(SUM(total_amount), 0) as total
-            FROM sales
-            WHERE DATE(sale_time) = CURDATE()
-        """)
-        sales_data = cur.fetchone()
+        snapshot = get_dashboard_snapshot()
         
         return render_template('dashboard.html',
-                             total_products=total_products,
-                             low_stock=low_stock,
-                             daily_sales_count=sales_data['count'],
-                             daily_sales_total=float(sales_data['total']))
+                             total_products=snapshot['total_products'],
+                             low_stock=snapshot['low_stock'],
+                             daily_sales_count=snapshot['daily_sales_count'],
+                             daily_sales_total=snapshot['daily_sales_total'])
     except Exception as e:
         flash('An error occurred while loading the dashboard.', 'danger')
         app.logger.error(f"Dashboard error: {str(e)}")
         return render_template('dashboard.html', error=True)
-    finally:
-        cur.close()
 
 # User Registration
 @app.route('/register', methods=['GET', 'POST'])
@@ -185,7 +687,7 @@ def add_product():
                 flash('All fields are required.', 'danger')
                 return redirect(url_for('add_product'))
 
-            cur = mysql.connection.cursor()
+            cur = get_db_cursor()
             cur.execute("""
                 INSERT INTO products 
                 (product_name, price, quantity, user_id) 
@@ -193,6 +695,12 @@ def add_product():
             """, (product_name, price, quantity, user_id))
             
             mysql.connection.commit()
+            products_changed(cur.lastrowid)
+            audit('INSERT', 'products', cur.lastrowid, new_values={
+                'product_name': product_name,
+                'price': price,
+                'quantity': quantity
+            })
             flash('Product added successfully!', 'success')
             return redirect(url_for('stock'))
 
@@ -225,6 +733,13 @@ def edit_product(id):
                 return redirect(url_for('edit_product', id=id))
 
             try:
+                cur.execute("""
+                    SELECT product_name, price, quantity, category, description
+                    FROM products
+                    WHERE id = %s
+                """, (id,))
+                old_values = cur.fetchone()
+
                 # Update product
                 cur.execute("""
                     UPDATE products 
@@ -237,6 +752,14 @@ def edit_product(id):
                 """, (product_name, price, quantity, category, description, id))
                 
                 mysql.connection.commit()
+                products_changed(id)
+                audit('UPDATE', 'products', id, old_values=old_values, new_values={
+                    'product_name': product_name,
+                    'price': price,
+                    'quantity': quantity,
+                    'category': category,
+                    'description': description
+                })
                 flash('Product updated successfully!', 'success')
                 return redirect(url_for('stock'))
             except Exception as e:
@@ -259,9 +782,7 @@ def edit_product(id):
             flash('Product not found.', 'danger')
             return redirect(url_for('stock'))
 
-        # Fetch categories
-        cur.execute("SELECT * FROM categories ORDER BY name")
-        categories = cur.fetchall()
+        categories = get_categories()
 
         return render_template('edit_product.html', 
                              product=product, 
@@ -293,6 +814,12 @@ def delete_product(id):
         # Delete product
         cur.execute("DELETE FROM products WHERE id = %s", (id,))
         mysql.connection.commit()
+        products_changed(id, deleted=True)
+        audit('DELETE', 'products', id, old_values={
+            'product_name': product['product_name'],
+            'price': product['price'],
+            'quantity': product['quantity']
+        })
         
         flash('Product deleted successfully!', 'success')
         return redirect(url_for('stock'))
@@ -304,57 +831,126 @@ def delete_product(id):
     finally:
         cur.close()
 
+# Bulk Product Import
+def run_product_import(stream, filename, user_id, max_errors):
+    def audit_chunk(changes):
+        for product_id, old_values, new_values in changes:
+            audit('UPDATE' if old_values else 'INSERT', 'products', product_id, old_values=old_values,
+                  new_values=new_values, user_id=user_id, block=True)
+
+    cur = get_db_cursor()
+    try:
+        rows = product_import.read_rows(stream, filename)
+        result = product_import.import_products(mysql.connection, cur, rows, user_id, get_categories(),
+                                                app.config['IMPORT_CHUNK_SIZE'], max_errors, audit_chunk)
+    except Exception as e:
+        # Chunks committed before the failure are already in the table
+        if not isinstance(e, product_import.ImportFileError):
+            products_changed()
+            product_index.expire()
+        raise
+    finally:
+        cur.close()
+
+    if result.inserted or result.updated:
+        products_changed()
+        product_index.expire()
+        audit('IMPORT', 'products', new_values={
+            'file': os.path.basename(filename),
+            'rows': result.rows,
+            'inserted': result.inserted,
+            'updated': result.updated,
+            'failed': result.error_count
+        })
+    return result
+
+@app.route('/import_products', methods=['GET', 'POST'])
+@login_required
+def import_products():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or Excel file to import.', 'danger')
+            return redirect(url_for('import_products'))
+
+        try:
+            result = run_product_import(upload.stream, upload.filename, session.get('user_id'),
+                                        app.config['IMPORT_MAX_ERRORS'])
+        except product_import.ImportFileError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('import_products'))
+        except Exception as e:
+            app.logger.error(f"Product import error: {str(e)}")
+            flash('An error occurred while importing products.', 'danger')
+            return redirect(url_for('import_products'))
+
+        flash(f'Imported {result.inserted} new and {result.updated} existing products.',
+              'warning' if result.error_count or result.aborted else 'success')
+        return render_template('import_products.html', result=result.as_dict())
+
+    return render_template('import_products.html', result=None)
+
 # View Stock
 @app.route('/stock')
 @login_required
+@conditional('products', 'sales')
 def stock():
     search = request.args.get('search', '')
-    sort = request.args.get('sort', 'id')
+    sort = request.args.get('sort')
     order = request.args.get('order', 'asc')
-    page = request.args.get('page', 1, type=int)
+    cursor = decode_cursor(request.args.get('cursor'))
     per_page = 10
 
+    # Searches rank by relevance unless a sort column was asked for
+    if sort not in STOCK_SORT_COLUMNS:
+        sort = None if search else 'id'
+    if order not in ('asc', 'desc'):
+        order = 'asc'
+
     try:
         cur = get_db_cursor()
-        
-        # Build the query
-        query = """
-            SELECT p.*, c.name as category_name 
-            FROM products p 
-            LEFT JOIN categories c ON p.category = c.id 
-            WHERE 1=1
-        """
-        params = []
-
-        if search:
-            query += " AND p.product_name LIKE %s"
-            params.append(f'%{search}%')
-
-        # Add sorting
-        query += f" ORDER BY p.{sort} {order}"
-        
-        # Add pagination
-        query += " LIMIT %s OFFSET %s"
-        params.extend([per_page, (page - 1) * per_page])
 
-        cur.execute(query, tuple(params))
-        products = cur.fetchall()
-
-        # Get total count for pagination
-        cur.execute("""
-            SELECT COUNT(*) as count 
-            FROM products p 
-            WHERE 1=1
-        """ + (" AND p.product_name LIKE %s" if search else ""),
-        (f'%{search}%',) if search else ())
-        
-        total = cur.fetchone()['count']
-        pages = (total + per_page - 1) // per_page
+        if search and sort is None:
+            # Search results are ranked by relevance and paged in memory
+            page = cursor['p'] if cursor else 1
+            products, total = search_products(search, page, per_page)
+            pages = (total + per_page - 1) // per_page
+            prev_cursor = encode_cursor(None, None, 'next', page - 1) if page > 1 else None
+            next_cursor = encode_cursor(None, None, 'next', page + 1) if page < pages else None
+        elif search:
+            # Sorted search pages the matching ids with the usual keyset
+            product_ids = search_product_ids(search)
+            products, page, prev_cursor, next_cursor = [], 1, None, None
+            if product_ids:
+                placeholders = ', '.join(['%s'] * len(product_ids))
+                products, page, has_prev, has_next = keyset_page(cur, f"""
+                    SELECT p.*, c.name as category_name 
+                    FROM products p 
+                    LEFT JOIN categories c ON p.category = c.id 
+                    WHERE p.id IN ({placeholders})
+                """, product_ids, f'p.{sort}', 'p.id', order, cursor, per_page)
+                prev_cursor, next_cursor = page_tokens(products, page, has_prev, has_next, sort)
+            total = len(product_ids)
+            pages = (total + per_page - 1) // per_page
+        else:
+            products, page, has_prev, has_next = keyset_page(cur, """
+                SELECT p.*, c.name as category_name 
+                FROM products p 
+                LEFT JOIN categories c ON p.category = c.id 
+                WHERE 1=1
+            """, [], f'p.{sort}', 'p.id', order, cursor, per_page)
+            prev_cursor, next_cursor = page_tokens(products, page, has_prev, has_next, sort)
+
+            # Approximate total for display; refreshed at most once per TTL
+            total = cached_count('products', "SELECT COUNT(*) as count FROM products")
+            pages = (total + per_page - 1) // per_page
         
         return render_template('stock.html',
                              products=products,
                              page=page,
                              pages=pages,
+                             prev_cursor=prev_cursor,
+                             next_cursor=next_cursor,
                              search=search,
                              sort=sort,
                              order=order)
@@ -366,6 +962,204 @@ def stock():
     finally:
         cur.close()
 
+# Basket checkout helpers
+def parse_basket_lines(raw_lines):
+    lines = []
+    errors = []
+    if not isinstance(raw_lines, list) or not raw_lines:
+        return lines, ['Basket must contain at least one line.']
+
+    for index, raw in enumerate(raw_lines):
+        try:
+            # Scanning tills may send the barcode instead of the product id
+            if isinstance(raw, dict) and 'product_id' not in raw and 'barcode' in raw:
+                product = find_by_barcode(str(raw['barcode']))
+                if product is None:
+                    errors.append(f"Line {index}: no product with barcode {raw['barcode']}.")
+                    continue
+                product_id = product[0]
+            else:
+                product_id = int(raw['product_id'])
+            quantity = int(raw['quantity'])
+        except (KeyError, TypeError, ValueError):
+            errors.append(f'Line {index}: product_id (or barcode) and quantity must be integers.')
+            continue
+        if quantity <= 0:
+            errors.append(f'Line {index}: quantity must be greater than zero.')
+            continue
+        lines.append({'product_id': product_id, 'quantity': quantity})
+
+    return lines, errors
+
+def allocate_basket(products, user_id, lines):
+    # Check each line against the stock left by the lines before it
+    remaining = {pid: product['stock'] for pid, product in products.items()}
+    decrements = {}
+    sale_rows = []
+    results = []
+    # sale_time is stored to the second; dropping microseconds here keeps the
+    # receipt printed at checkout identical to one rebuilt from the table
+    sale_time = datetime.now().replace(microsecond=0)
+
+    for index, line in enumerate(lines):
+        product_id = line['product_id']
+        quantity = line['quantity']
+        product = products.get(product_id)
+
+        if not product:
+            results.append({'line': index, 'product_id': product_id, 'quantity': quantity,
+                            'status': 'error', 'error': 'Product not found.'})
+            continue
+
+        if remaining[product_id] < quantity:
+            results.append({'line': index, 'product_id': product_id, 'quantity': quantity,
+                            'status': 'error', 'available': remaining[product_id],
+                            'error': f'Insufficient stock. Only {remaining[product_id]} available.'})
+            continue
+
+        remaining[product_id] -= quantity
+        decrements[product_id] = decrements.get(product_id, 0) + quantity
+        total_amount = product['price'] * quantity
+        sale_rows.append((product_id, user_id, quantity, product['price'], total_amount, sale_time))
+        results.append({'line': index, 'product_id': product_id, 'quantity': quantity,
+                        'status': 'ok', 'product_name': product['product_name'],
+                        'unit_price': float(product['price']),
+                        'total_amount': float(total_amount)})
+
+    return results, sale_rows, decrements
+
+def record_sale_rows(cur, sale_rows, rollups=True):
+    cur.executemany("""
+        INSERT INTO sales
+        (product_id, user_id, quantity_sold, unit_price, total_amount, sale_time)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, sale_rows)
+
+    cur.executemany("""
+        INSERT INTO stock_movements
+        (product_id, user_id, movement_type, quantity, reason, movement_time)
+        VALUES (%s, %s, 'out', %s, 'Sale', %s)
+    """, [(row[0], row[1], row[2], row[5]) for row in sale_rows])
+
+    if rollups:
+        rollup.apply_sales(cur, sale_rows)
+
+def fetch_basket_products(cur, lines, lock):
+    product_ids = sorted({line['product_id'] for line in lines})
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cur.execute(f"""
+        SELECT id, product_name, price, quantity as stock
+        FROM products
+        WHERE id IN ({placeholders})
+        ORDER BY id
+        {'FOR UPDATE' if lock else ''}
+    """, tuple(product_ids))
+    return {row['id']: row for row in cur.fetchall()}
+
+def process_basket(cur, user_id, lines):
+    # Lock every product in the basket in ascending id order so that
+    # concurrent tills always acquire row locks in the same sequence.
+    products = fetch_basket_products(cur, lines, lock=True)
+    results, sale_rows, decrements = allocate_basket(products, user_id, lines)
+
+    if sale_rows:
+        cur.executemany("""
+            UPDATE products
+            SET quantity = quantity - %s
+            WHERE id = %s
+        """, [(quantity, product_id) for product_id, quantity in sorted(decrements.items())])
+
+        record_sale_rows(cur, sale_rows)
+
+    return results, sale_rows
+
+class StockConflict(Exception):
+    pass
+
+def process_basket_atomic(cur, user_id, lines):
+    # Optimistic variant: stock is checked against a plain read, and the
+    # hot rows are written last, so they stay locked for a few statements
+    # plus the commit instead of the whole transaction. A decrement that
+    # matches no row means stock moved since the read. The rollup upserts
+    # come after the decrements: their (day, product) rows are as contended
+    # as the product's, and a basket that loses the race never locks them.
+    products = fetch_basket_products(cur, lines, lock=False)
+    results, sale_rows, decrements = allocate_basket(products, user_id, lines)
+
+    if sale_rows:
+        record_sale_rows(cur, sale_rows, rollups=False)
+
+        for product_id, quantity in sorted(decrements.items()):
+            cur.execute("""
+                UPDATE products
+                SET quantity = quantity - %s
+                WHERE id = %s AND quantity >= %s
+            """, (quantity, product_id, quantity))
+            if cur.rowcount != 1:
+                raise StockConflict(product_id)
+
+        rollup.apply_sales(cur, sale_rows)
+
+    return results, sale_rows
+
+def load_basket_products(lines):
+    cur = get_db_cursor()
+    try:
+        return fetch_basket_products(cur, lines, lock=False)
+    finally:
+        cur.close()
+
+def journal_committed(sale_rows):
+    # Runs on the journal's flusher thread, outside any request
+    with app.app_context():
+        sales_committed(sale_rows)
+
+# Journaled mode: sales are acknowledged once they are in the local journal
+# and reach MySQL in group commits; post-commit hooks run when they do
+sale_journal = None
+if app.config['SALE_JOURNAL_DIR']:
+    sale_journal = SaleJournal(app.config['SALE_JOURNAL_DIR'], mysql.pool, record_sale_rows, journal_committed,
+                               app.config['SALE_JOURNAL_BATCH_SIZE'], app.config['SALE_JOURNAL_FLUSH_INTERVAL'],
+                               app.config['SALE_JOURNAL_MAX_BYTES'])
+    atexit.register(sale_journal.stop)
+
+def commit_basket(user_id, lines):
+    # Run the basket in its own transaction, retrying deadlocks, lock wait
+    # timeouts and lost optimistic races. A basket that keeps losing the race
+    # takes the locking path on its last attempt. Post-commit hooks run here,
+    # or on the journal's flusher in journaled mode.
+    if sale_journal is not None:
+        return sale_journal.submit(user_id, lines, load_basket_products, allocate_basket)
+
+    attempts = max(app.config['SALE_RETRY_ATTEMPTS'], 1)
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        atomic = app.config['SALE_ATOMIC_DECREMENT'] and not last_attempt
+        cur = get_db_cursor()
+        try:
+            mysql.connection.begin()
+            results, sale_rows = (process_basket_atomic if atomic else process_basket)(cur, user_id, lines)
+            if not sale_rows:
+                mysql.connection.rollback()
+                return results, sale_rows
+            mysql.connection.commit()
+        except StockConflict:
+            mysql.connection.rollback()
+            metrics.observe_retry('sale', 'stock_conflict')
+            continue
+        except MySQLdb.OperationalError as e:
+            mysql.connection.rollback()
+            if last_attempt or not is_transient(e):
+                raise
+            metrics.observe_retry('sale', 'deadlock' if e.args[0] == ER_LOCK_DEADLOCK else 'lock_wait_timeout')
+        else:
+            sales_committed(sale_rows)
+            return results, sale_rows
+        finally:
+            cur.close()
+
+        time.sleep(backoff_delay(attempt, app.config['SALE_RETRY_BACKOFF']))
+
 # Process Sales
 @app.route('/sales', methods=['GET', 'POST'])
 @login_required
@@ -385,59 +1179,17 @@ def sales():
                 flash('Please enter a valid quantity.', 'danger')
                 return redirect(url_for('sales'))
 
-            cur = get_db_cursor()
-            
-            # Start transaction
-            mysql.connection.begin()
-
-            # Get product details and lock the row
-            cur.execute("""
-                SELECT id, product_name, price, quantity as stock
-                FROM products 
-                WHERE id = %s 
-                FOR UPDATE
-            """, (product_id,))
-            
-            product = cur.fetchone()
-            
-            if not product:
-                mysql.connection.rollback()
-                flash('Product not found.', 'danger')
-                return redirect(url_for('sales'))
+            # A single-line basket shares the transaction and write path with checkout
+            results, sale_rows = commit_basket(
+                session['user_id'], [{'product_id': int(product_id), 'quantity': quantity}])
+            result = results[0]
 
-            if product['stock'] < quantity:
-                mysql.connection.rollback()
-                flash(f'Insufficient stock. Only {product["stock"]} available.', 'danger')
+            if result['status'] != 'ok':
+                flash(result['error'], 'danger')
                 return redirect(url_for('sales'))
 
-            # Calculate total amount
-            total_amount = product['price'] * quantity
-
-            # Update product stock
-            cur.execute("""
-                UPDATE products 
-                SET quantity = quantity - %s 
-                WHERE id = %s
-            """, (quantity, product_id))
-
-            # Record the sale
-            cur.execute("""
-                INSERT INTO sales 
-                (product_id, user_id, quantity_sold, unit_price, total_amount, sale_time) 
-                VALUES (%s, %s, %s, %s, %s, NOW())
-            """, (product_id, session['user_id'], quantity, product['price'], total_amount))
-
-            # Record stock movement
-            cur.execute("""
-                INSERT INTO stock_movements 
-                (product_id, user_id, movement_type, quantity, reason, movement_time) 
-                VALUES (%s, %s, 'out', %s, 'Sale', NOW())
-            """, (product_id, session['user_id'], quantity))
-
-            # Commit transaction
-            mysql.connection.commit()
-            
-            flash(f'Sale of {quantity} {product["product_name"]} processed successfully!', 'success')
+            flash(f'Sale of {quantity} {result["product_name"]} processed successfully!', 'success')
+            session['receipt_job'] = submit_receipt(results, sale_rows)
 
         except ValueError:
             mysql.connection.rollback()
@@ -446,29 +1198,74 @@ def sales():
             mysql.connection.rollback()
             app.logger.error(f"Sales error: {str(e)}")
             flash('An error occurred while processing the sale.', 'danger')
-        finally:
-            cur.close()
 
         return redirect(url_for('sales'))
 
     # GET request - show sales form
     try:
-        cur = get_db_cursor()
-        cur.execute("""
-            SELECT id, product_name, price, quantity 
-            FROM products 
-            WHERE quantity > 0 AND is_active = TRUE
-            ORDER BY product_name
-        """)
-        products = cur.fetchall()
+        products = get_sellable_products()
         
-        return render_template('sales.html', products=products)
+        return render_template('sales.html', products=products, receipt_job=session.pop('receipt_job', None))
     except Exception as e:
         app.logger.error(f"Sales page error: {str(e)}")
         flash('Error loading products.', 'danger')
         return redirect(url_for('dashboard'))
-    finally:
-        cur.close()
+
+# Basket Checkout
+@app.route('/api/checkout', methods=['POST'])
+@login_required
+def checkout():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'errors': ['Request body must be a JSON object.']}), 400
+    lines, errors = parse_basket_lines(payload.get('lines'))
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+
+    try:
+        results, sale_rows = commit_basket(session['user_id'], lines)
+
+        if not sale_rows:
+            return jsonify({'success': False, 'committed': 0, 'lines': results}), 409
+
+        receipt_job = submit_receipt(results, sale_rows)
+        return jsonify({
+            'success': True,
+            'committed': len(sale_rows),
+            'failed': len(results) - len(sale_rows),
+            'total_amount': float(sum(row[4] for row in sale_rows)),
+            'lines': results,
+            'receipt': document_status(receipt_job) if receipt_job else None
+        })
+    except Exception as e:
+        mysql.connection.rollback()
+        app.logger.error(f"Checkout error: {str(e)}")
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
+# Barcode Scanning
+@app.route('/api/scan/<barcode>')
+@login_required
+def scan(barcode):
+    try:
+        product = find_by_barcode(barcode)
+        if product is None:
+            return jsonify({'error': 'Unknown barcode', 'barcode': barcode}), 404
+        product_id, product_name, price, quantity = product
+        return jsonify({
+            'id': product_id,
+            'barcode': barcode.strip(),
+            'product_name': product_name,
+            'price': float(price),
+            'stock': quantity
+        })
+    except Exception as e:
+        app.logger.error(f"Scan error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/scan_stats')
+@login_required
+def scan_stats():
+    return jsonify(barcode_map.stats())
 
 # Sales Report
 @app.route('/report')
@@ -478,30 +1275,36 @@ def report():
     date_to = request.args.get('date_to', datetime.now().date().isoformat())
 
     try:
-        cur = get_db_cursor()
-        cur.execute("""
-            SELECT s.id, p.product_name, s.quantity_sold, p.price, 
+        cur = get_db_cursor(read_only=True)
+        start = rollup.parse_date(date_from)
+        end = rollup.parse_date(date_to)
+
+        # Half-open range on the raw column so idx_sale_time can be used.
+        # The page only previews the latest rows; full ranges go through export.
+        # Ranges reaching back past the archive horizon also read the archive.
+        limit = app.config['REPORT_PREVIEW_ROWS']
+        query, params = archive.union_all("""
+            SELECT s.id, s.product_id, p.product_name, s.quantity_sold, p.price, 
                    (p.price * s.quantity_sold) as total, s.sale_time
-            FROM sales s
+            FROM {table} s
             JOIN products p ON s.product_id = p.id
-            WHERE DATE(s.sale_time) BETWEEN %s AND %s
+            WHERE s.sale_time >= %s AND s.sale_time < %s
             ORDER BY s.sale_time DESC
-        """, (date_from, date_to))
+            LIMIT %s
+        """, archive.tables_for_range(cur, 'sales', start), (start, end + timedelta(days=1), limit))
+        cur.execute(f"""
+            SELECT * FROM ({query}) preview
+            ORDER BY sale_time DESC
+            LIMIT %s
+        """, params + (limit,))
         sales = cur.fetchall()
 
         # Calculate totals
-        cur.execute("""
-            SELECT COUNT(*) as count, 
-                   SUM(p.price * s.quantity_sold) as total_amount,
-                   SUM(s.quantity_sold) as total_quantity
-            FROM sales s
-            JOIN products p ON s.product_id = p.id
-            WHERE DATE(s.sale_time) BETWEEN %s AND %s
-        """, (date_from, date_to))
-        summary = cur.fetchone()
+        summary = rollup.range_summary(cur, start, end)
 
         return render_template('report.html',
                              sales=sales,
+                             truncated=len(sales) >= app.config['REPORT_PREVIEW_ROWS'],
                              summary=summary,
                              date_from=date_from,
                              date_to=date_to)
@@ -513,35 +1316,141 @@ def report():
     finally:
         cur.close()
 
+# Sales Report Export
+EXPORT_COLUMNS = ['Sale ID', 'Sale Time', 'Product', 'Quantity', 'Unit Price', 'Total Amount', 'Sold By']
+
+def stream_sales_rows(start, end, batch_size=1000):
+    lookup = get_db_cursor(read_only=True)
+    try:
+        tables = archive.tables_for_range(lookup, 'sales', start)
+    finally:
+        lookup.close()
+
+    # Unbuffered server-side cursor: rows are pulled from MySQL in batches as
+    # the response is written instead of being loaded into worker memory.
+    # Archived rows are older than the hot table's, so the archive goes first.
+    for table in tables:
+        cur = get_db_cursor(SSCursor, read_only=True)
+        try:
+            cur.execute(f"""
+                SELECT s.id, s.sale_time, p.product_name, s.quantity_sold,
+                       s.unit_price, s.total_amount, u.email
+                FROM {table} s
+                JOIN products p ON s.product_id = p.id
+                LEFT JOIN users u ON s.user_id = u.id
+                WHERE s.sale_time >= %s AND s.sale_time < %s
+                ORDER BY s.sale_time
+            """, (start, end + timedelta(days=1)))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+
+def generate_sales_csv(start, end):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    # Send the header before running the query so the first byte goes out immediately
+    yield buffer.getvalue()
+
+    for rows in stream_sales_rows(start, end):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def generate_sales_xlsx(start, end, chunk_size=64 * 1024):
+    # constant_memory flushes each row to disk as soon as the next one starts,
+    # so memory stays flat; the zip container can only be streamed once closed
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+        worksheet = workbook.add_worksheet('Sales')
+        worksheet.write_row(0, 0, EXPORT_COLUMNS)
+        row_number = 1
+        for rows in stream_sales_rows(start, end):
+            for row in rows:
+                sale_id, sale_time, product_name, quantity, unit_price, total_amount, email = row
+                worksheet.write_number(row_number, 0, sale_id)
+                worksheet.write_datetime(row_number, 1, sale_time)
+                worksheet.write_string(row_number, 2, product_name)
+                worksheet.write_number(row_number, 3, quantity)
+                worksheet.write_number(row_number, 4, float(unit_price))
+                worksheet.write_number(row_number, 5, float(total_amount))
+                worksheet.write_string(row_number, 6, email or '')
+                row_number += 1
+        workbook.close()
+
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+@app.route('/report/export/<fmt>')
+@login_required
+def export_report(fmt):
+    generators = {
+        'csv': (generate_sales_csv, 'text/csv'),
+        'xlsx': (generate_sales_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    }
+    if fmt not in generators:
+        flash('Unsupported export format.', 'danger')
+        return redirect(url_for('report'))
+
+    try:
+        start = rollup.parse_date(request.args.get('date_from'), datetime.now().date())
+        end = rollup.parse_date(request.args.get('date_to'), datetime.now().date())
+    except ValueError:
+        flash('Please enter valid report dates.', 'danger')
+        return redirect(url_for('report'))
+    if end < start:
+        flash('The report end date is before its start date.', 'danger')
+        return redirect(url_for('report', date_from=start.isoformat(), date_to=end.isoformat()))
+
+    generate, mimetype = generators[fmt]
+    filename = f'sales_report_{start.isoformat()}_{end.isoformat()}.{fmt}'
+    return Response(stream_with_context(generate(start, end)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 # Sales History
 @app.route('/sales_history')
 @login_required
 def sales_history():
-    page = request.args.get('page', 1, type=int)
+    cursor = decode_cursor(request.args.get('cursor'))
     per_page = 10
 
     try:
-        cur = get_db_cursor()
-        cur.execute("""
-            SELECT s.id, p.product_name, s.quantity_sold, 
+        cur = get_db_cursor(read_only=True)
+        sales, page, has_prev, has_next = keyset_page(cur, """
+            SELECT s.id, s.product_id, p.product_name, s.quantity_sold, 
                    p.price, s.sale_time, u.email as sold_by
             FROM sales s
             JOIN products p ON s.product_id = p.id
             JOIN users u ON s.user_id = u.id
-            ORDER BY s.sale_time DESC
-            LIMIT %s OFFSET %s
-        """, (per_page, (page - 1) * per_page))
-        sales = cur.fetchall()
+            WHERE 1=1
+        """, [], 's.sale_time', 's.id', 'desc', cursor, per_page)
+        prev_cursor, next_cursor = page_tokens(sales, page, has_prev, has_next, 'sale_time')
 
-        # Get total count for pagination
-        cur.execute("SELECT COUNT(*) FROM sales")
-        total = cur.fetchone()[0]
+        # Approximate total for display; refreshed at most once per TTL
+        total = cached_count('sales', "SELECT COUNT(*) as count FROM sales")
         pages = (total + per_page - 1) // per_page
 
         return render_template('sales_history.html',
                              sales=sales,
                              page=page,
-                             pages=pages)
+                             pages=pages,
+                             archived_before=archive.archived_before(cur, 'sales'),
+                             prev_cursor=prev_cursor,
+                             next_cursor=next_cursor)
 
     except Exception as e:
         flash('An error occurred while fetching sales history.', 'danger')
@@ -551,31 +1460,113 @@ def sales_history():
         cur.close()
 
 # API Routes
+@app.route('/api/dashboard_snapshot')
+@login_required
+@conditional('products', 'sales', key=change_feed.last_event_id)
+def dashboard_snapshot():
+    try:
+        return jsonify(get_dashboard_snapshot())
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/stream')
+@login_required
+def stream():
+    # EventSource sends Last-Event-ID itself when it reconnects; the first
+    # connection passes the id carried by the dashboard snapshot
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        events = change_feed.subscribe(last_event_id)
+    except FeedFull as e:
+        app.logger.warning(f"Stream rejected: {str(e)}")
+        return Response('retry: 30000\n\n', status=503, mimetype='text/event-stream')
+
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/products/search')
+@login_required
+@conditional('products', 'sales')
+def product_search():
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
+
+    try:
+        products, total = search_products(query, page, per_page)
+        return jsonify({
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'results': [{
+                'id': product['id'],
+                'product_name': product['product_name'],
+                'barcode': product['barcode'],
+                'category': product['category_name'],
+                'price': float(product['price']),
+                'quantity': product['quantity']
+            } for product in products]
+        })
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/products/import', methods=['POST'])
+@login_required
+def api_import_products():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'Upload a CSV or Excel file in the "file" field'}), 400
+
+    try:
+        result = run_product_import(upload.stream, upload.filename, session.get('user_id'),
+                                    app.config['IMPORT_MAX_ERRORS'])
+        return jsonify(result.as_dict())
+    except product_import.ImportFileError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/cache_stats')
+@login_required
+def cache_stats():
+    return jsonify({'catalog': catalog_cache.stats(), 'fragments': fragment_cache.stats()})
+
+@app.route('/api/pool_stats')
+@login_required
+def pool_stats():
+    stats = mysql.pool.stats()
+    stats['replicas'] = [replica.stats() for replica in mysql.replicas]
+    return jsonify(stats)
+
+@app.route('/api/slow_queries')
+@login_required
+def slow_queries():
+    return jsonify(list(metrics.slow_queries))
+
 @app.route('/api/sales_data/<period>')
 @login_required
+@conditional('sales')
 def sales_data(period):
+    periods = {'week': 7, 'month': 30, 'year': 365}
+    if period != 'day' and period not in periods:
+        return jsonify({'error': 'Unknown period'}), 404
+
     try:
-        cur = get_db_cursor()
-        if period == 'week':
-            cur.execute("""
-                SELECT DATE(sale_time) as date,
-                       SUM(total_amount) as total
-                FROM sales
-                WHERE sale_time >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
-                GROUP BY DATE(sale_time)
-                ORDER BY date
-            """)
-        elif period == 'month':
-            cur.execute("""
-                SELECT DATE(sale_time) as date,
-                       SUM(total_amount) as total
-                FROM sales
-                WHERE sale_time >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-                GROUP BY DATE(sale_time)
-                ORDER BY date
-            """)
-        
-        data = cur.fetchall()
+        cur = get_db_cursor(read_only=True)
+        today = datetime.now().date()
+        if period == 'day':
+            data = rollup.hourly_totals(cur, today)
+            return jsonify({
+                'labels': [row['hour'].strftime('%H:00') for row in data],
+                'values': [float(row['total']) for row in data]
+            })
+
+        data = rollup.daily_totals(cur, today - timedelta(days=periods[period]), today)
         return jsonify({
             'labels': [row['date'].strftime('%Y-%m-%d') for row in data],
             'values': [float(row['total']) for row in data]
@@ -588,34 +1579,43 @@ def sales_data(period):
 
 @app.route('/api/top_products')
 @login_required
+@conditional('products', 'sales')
 def top_products():
+    window = request.args.get('window', 'all')
+    if window not in LEADERBOARD_WINDOWS:
+        return jsonify({'error': f"window must be one of {', '.join(LEADERBOARD_WINDOWS)}"}), 400
+    limit = min(max(request.args.get('limit', 5, type=int), 1), app.config['LEADERBOARD_SIZE'])
+
     try:
-        cur = get_db_cursor()
-        cur.execute("""
-            SELECT p.product_name,
-                   SUM(s.quantity_sold) as total_sold
-            FROM products p
-            JOIN sales s ON p.id = s.product_id
-            GROUP BY p.id, p.product_name
-            ORDER BY total_sold DESC
-            LIMIT 5
-        """)
-        data = cur.fetchall()
+        data = get_top_products(window, limit)
         return jsonify({
+            'window': window,
             'labels': [row['product_name'] for row in data],
             'values': [row['total_sold'] for row in data]
         })
     except Exception as e:
         app.logger.error(f"API error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/top_products/rebuild', methods=['POST'])
+@login_required
+def rebuild_top_products():
+    try:
+        cur = get_db_cursor()
+        leaderboard.refresh(cur, force=True)
+        return jsonify(leaderboard.stats())
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
     finally:
         cur.close()
 
 @app.route('/api/recent_sales')
 @login_required
+@conditional('products', 'sales')
 def recent_sales():
     try:
-        cur = get_db_cursor()
+        cur = get_db_cursor(read_only=True)
         cur.execute("""
             SELECT p.product_name as product,
                    s.quantity_sold as quantity,
@@ -641,27 +1641,710 @@ def recent_sales():
 
 @app.route('/api/low_stock')
 @login_required
+@conditional('products', 'sales')
 def low_stock():
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 100)
     try:
-        cur = get_db_cursor()
-        cur.execute("""
-            SELECT id, product_name, quantity
-            FROM products
-            WHERE quantity < 10
-            ORDER BY quantity ASC
-            LIMIT 5
-        """)
-        items = cur.fetchall()
+        _count, items = get_low_stock(limit)
         return jsonify([{
             'id': item['id'],
             'product': item['product_name'],
-            'stock': item['quantity']
+            'stock': item['quantity'],
+            'min_stock_level': item['min_stock_level']
         } for item in items])
     except Exception as e:
         app.logger.error(f"API error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/analytics/hour_of_week')
+@login_required
+@conditional('sales', key=sales_columns.watermark)
+def analytics_hour_of_week():
+    try:
+        start, end = analytics_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        data = get_sales_columns().hour_of_week(start, end)
+        return jsonify({
+            'date_from': start.isoformat(),
+            'date_to': end.isoformat(),
+            'weekdays': WEEKDAYS,
+            'hours': [f'{hour:02d}:00' for hour in range(24)],
+            'revenue': data['revenue'],
+            'transactions': data['transactions']
+        })
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/analytics/cashiers')
+@login_required
+@conditional('sales', key=sales_columns.watermark)
+def analytics_cashiers():
+    try:
+        start, end = analytics_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        cashiers = get_sales_columns().cashiers(start, end)
+        user_ids = tuple(row['user_id'] for row in cashiers if row['user_id'] is not None)
+        names = {}
+        if user_ids:
+            placeholders = ', '.join(['%s'] * len(user_ids))
+            cur = get_db_cursor(read_only=True)
+            try:
+                cur.execute(f"SELECT id, first_name, last_name, email FROM users WHERE id IN ({placeholders})",
+                            user_ids)
+                names = {row['id']: ' '.join(filter(None, (row['first_name'], row['last_name']))) or row['email']
+                         for row in cur.fetchall()}
+            finally:
+                cur.close()
+        for row in cashiers:
+            row['name'] = names.get(row['user_id'])
+        return jsonify({'date_from': start.isoformat(), 'date_to': end.isoformat(), 'cashiers': cashiers})
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/analytics/categories')
+@login_required
+@conditional('products', 'sales', key=sales_columns.watermark)
+def analytics_categories():
+    buckets = {'day': 1, 'week': 7}
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in buckets:
+        return jsonify({'error': f"bucket must be one of {', '.join(buckets)}"}), 400
+    try:
+        start, end = analytics_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        data = get_sales_columns().category_trend(start, end, buckets[bucket])
+        return jsonify({
+            'date_from': start.isoformat(),
+            'date_to': end.isoformat(),
+            'bucket': bucket,
+            'labels': [label.isoformat() for label in data['labels']],
+            'series': data['series']
+        })
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/analytics/compare')
+@login_required
+@conditional('products', 'sales', key=sales_columns.watermark)
+def analytics_compare():
+    try:
+        start, end = analytics_range(7)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        data = get_sales_columns().compare(start, end)
+        for period in ('current', 'previous'):
+            data[period]['date_from'] = data[period]['date_from'].isoformat()
+            data[period]['date_to'] = data[period]['date_to'].isoformat()
+        return jsonify(data)
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/analytics/rebuild', methods=['POST'])
+@login_required
+def rebuild_analytics():
+    try:
+        cur = get_db_cursor()
+        sales_columns.rebuild(cur)
+        return jsonify(sales_columns.stats())
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
     finally:
         cur.close()
 
+FORECAST_SORTS = {
+    # sort -> (expression, default order); products without demand have no
+    # days of cover and sort last
+    'days_of_cover': ('COALESCE(f.days_of_cover, 1000000000)', 'asc'),
+    'demand_rate': ('f.demand_rate', 'desc'),
+    'product_id': ('f.product_id', 'asc')
+}
+
+def forecast_json(row):
+    return {
+        'product_id': row['product_id'],
+        'product_name': row['product_name'],
+        'quantity': row['quantity'],
+        'min_stock_level': row['min_stock_level'],
+        'max_stock_level': row['max_stock_level'],
+        'history_days': row['history_days'],
+        'demand_rate': float(row['demand_rate']),
+        'demand_std': float(row['demand_std']),
+        'lead_time_days': float(row['lead_time_days']),
+        'lead_time_std': float(row['lead_time_std']),
+        'safety_stock': float(row['safety_stock']),
+        'reorder_point': row['reorder_point'],
+        'order_up_to': row['order_up_to'],
+        'days_of_cover': None if row['days_of_cover'] is None else float(row['days_of_cover']),
+        'applied': bool(row['applied']),
+        'computed_at': row['computed_at'].isoformat()
+    }
+
+@app.route('/api/forecasts')
+@login_required
+@conditional('products')
+def forecasts():
+    sort = request.args.get('sort', 'days_of_cover')
+    if sort not in FORECAST_SORTS:
+        return jsonify({'error': f"sort must be one of {', '.join(FORECAST_SORTS)}"}), 400
+    sort_column, order = FORECAST_SORTS[sort]
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+    cursor = decode_cursor(request.args.get('cursor'))
+
+    try:
+        cur = get_db_cursor(read_only=True)
+        rows, page, has_prev, has_next = keyset_page(cur, f"""
+            SELECT {sort_column} as sort_value, f.*,
+                   p.product_name, p.quantity, p.min_stock_level, p.max_stock_level
+            FROM product_forecasts f
+            JOIN products p ON p.id = f.product_id
+            WHERE p.is_active = TRUE
+        """, [], sort_column, 'f.product_id', order, cursor, per_page)
+        prev_cursor, next_cursor = page_tokens(rows, page, has_prev, has_next, 'sort_value', 'product_id')
+        return jsonify({
+            'sort': sort,
+            'page': page,
+            'prev_cursor': prev_cursor,
+            'next_cursor': next_cursor,
+            'forecasts': [forecast_json(row) for row in rows]
+        })
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        cur.close()
+
+@app.route('/api/forecasts/<int:product_id>')
+@login_required
+@conditional('products')
+def product_forecast(product_id):
+    try:
+        cur = get_db_cursor(read_only=True)
+        cur.execute("""
+            SELECT f.*, p.product_name, p.quantity, p.min_stock_level, p.max_stock_level
+            FROM product_forecasts f
+            JOIN products p ON p.id = f.product_id
+            WHERE f.product_id = %s
+        """, (product_id,))
+        row = cur.fetchone()
+        if not row:
+            return jsonify({'error': 'No forecast for this product'}), 404
+        return jsonify(forecast_json(row))
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        cur.close()
+
+
+# Printable Documents
+def cashier_name(cur, user_id):
+    cur.execute("SELECT first_name, last_name, email FROM users WHERE id = %s", (user_id,))
+    user = cur.fetchone()
+    if not user:
+        return None
+    return ' '.join(part for part in (user['first_name'], user['last_name']) if part) or user['email']
+
+def receipt_document(cur, user_id, sale_time, lines):
+    # lines are (product_name, quantity, unit_price, total_amount). Checkout
+    # and reprints both build receipts here, so they share one cached PDF.
+    return {
+        'store': app.config['STORE_NAME'],
+        'currency': app.config['CURRENCY'],
+        'reference': f"{user_id or 0}-{sale_time:%Y%m%d%H%M%S}",
+        'sale_time': sale_time.strftime('%Y-%m-%d %H:%M:%S'),
+        'cashier': cashier_name(cur, user_id),
+        'lines': [[name, quantity, f'{unit_price:.2f}', f'{total:.2f}'] for name, quantity, unit_price, total in lines],
+        'total': f'{sum(line[3] for line in lines):.2f}'
+    }
+
+def submit_receipt(results, sale_rows):
+    # Runs after the basket has committed, so a receipt that cannot be
+    # queued is logged rather than failing the sale; it can be reprinted
+    names = {result['product_id']: result['product_name'] for result in results if result['status'] == 'ok'}
+    user_id, sale_time = sale_rows[0][1], sale_rows[0][5]
+    try:
+        cur = get_db_cursor(read_only=True)
+        try:
+            data = receipt_document(cur, user_id, sale_time,
+                                    [(names[row[0]], row[2], row[3], row[4]) for row in sale_rows])
+        finally:
+            cur.close()
+        return documents.submit('receipt', data)
+    except Exception as e:
+        app.logger.error(f"Receipt error: {str(e)}")
+        return None
+
+def sale_receipt(cur, sale_id):
+    # A basket's rows share its cashier and sale_time, so they sit on the
+    # same side of the archive horizon; the hot table is tried first
+    for table in reversed(archive.tables_for_range(cur, 'sales', None)):
+        cur.execute(f"""
+            SELECT s.user_id, s.sale_time, p.product_name, s.quantity_sold, s.unit_price, s.total_amount
+            FROM {table} anchor
+            JOIN {table} s ON s.sale_time = anchor.sale_time AND s.user_id <=> anchor.user_id
+            JOIN products p ON p.id = s.product_id
+            WHERE anchor.id = %s
+            ORDER BY s.id
+        """, (sale_id,))
+        rows = cur.fetchall()
+        if rows:
+            break
+    else:
+        return None
+    return receipt_document(cur, rows[0]['user_id'], rows[0]['sale_time'],
+                            [(row['product_name'], row['quantity_sold'], row['unit_price'], row['total_amount'])
+                             for row in rows])
+
+def report_document(cur, start, end):
+    summary = rollup.range_summary(cur, start, end)
+    days = rollup.daily_totals(cur, start, end)
+    cur.execute("""
+        SELECT p.product_name,
+               SUM(r.transactions) as transactions,
+               SUM(r.quantity_sold) as quantity,
+               SUM(r.total_amount) as revenue
+        FROM sales_daily_rollup r
+        JOIN products p ON p.id = r.product_id
+        WHERE r.sale_date BETWEEN %s AND %s
+        GROUP BY r.product_id, p.product_name
+        ORDER BY revenue DESC, r.product_id
+    """, (start, end))
+    products = cur.fetchall()
+    # No generation time: an unchanged range must hash to the same document
+    return {
+        'store': app.config['STORE_NAME'],
+        'currency': app.config['CURRENCY'],
+        'date_from': start.isoformat(),
+        'date_to': end.isoformat(),
+        'summary': {'transactions': int(summary['count']), 'quantity': int(summary['total_quantity']),
+                    'revenue': f"{summary['total_amount']:.2f}"},
+        'days': [[row['date'].isoformat(), f"{row['total']:.2f}"] for row in days],
+        'products': [[row['product_name'], int(row['transactions']), int(row['quantity']), f"{row['revenue']:.2f}"]
+                     for row in products]
+    }
+
+def document_status(job_id):
+    status, error = documents.status(job_id)
+    body = {'job_id': job_id, 'status': status or 'unknown',
+            'status_url': url_for('document_job', job_id=job_id)}
+    if status == 'done':
+        body['download_url'] = url_for('download_document', job_id=job_id)
+    elif status == 'failed':
+        body['error'] = error
+    return body
+
+def queue_document(kind, data):
+    try:
+        job_id = documents.submit(kind, data)
+    except RenderQueueFull:
+        return jsonify({'error': 'Too many documents are being rendered, try again shortly'}), 503, \
+            {'Retry-After': '5'}
+    body = document_status(job_id)
+    return jsonify(body), 200 if body['status'] == 'done' else 202
+
+@app.route('/api/documents/receipts', methods=['POST'])
+@login_required
+def print_receipt():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = request.form
+    try:
+        sale_id = int(payload.get('sale_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'sale_id is required'}), 400
+
+    try:
+        cur = get_db_cursor(read_only=True)
+        data = sale_receipt(cur, sale_id)
+        if data is None:
+            return jsonify({'error': 'Sale not found'}), 404
+        return queue_document('receipt', data)
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        cur.close()
+
+@app.route('/api/documents/reports', methods=['POST'])
+@login_required
+def print_report():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = request.form
+    try:
+        start = rollup.parse_date(payload.get('date_from'), datetime.now().date())
+        end = rollup.parse_date(payload.get('date_to'), datetime.now().date())
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    if end < start:
+        return jsonify({'error': 'date_to is before date_from'}), 400
+
+    try:
+        cur = get_db_cursor(read_only=True)
+        return queue_document('report', report_document(cur, start, end))
+    except Exception as e:
+        app.logger.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        cur.close()
+
+@app.route('/api/documents/<job_id>')
+@login_required
+def document_job(job_id):
+    if not JOB_ID_RE.fullmatch(job_id):
+        return jsonify({'error': 'Unknown document'}), 404
+    body = document_status(job_id)
+    if body['status'] == 'unknown':
+        # Never submitted, or evicted from the cache; submit it again
+        return jsonify(body), 404
+    return jsonify(body)
+
+@app.route('/api/documents/<job_id>/download')
+@login_required
+def download_document(job_id):
+    if not JOB_ID_RE.fullmatch(job_id):
+        return jsonify({'error': 'Unknown document'}), 404
+    path = documents.path(job_id)
+    if path is None:
+        body = document_status(job_id)
+        return jsonify(body), 409 if body['status'] == 'pending' else 404
+
+    # Job ids are content hashes, so a given URL always serves the same bytes
+    response = send_file(path, mimetype='application/pdf', download_name=f'{job_id}.pdf',
+                         as_attachment=job_id.startswith('report-'), etag=job_id)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+# Metrics
+def pool_metrics():
+    stats = mysql.pool.stats()
+    return gauge_lines('db_pool_connections', 'Pooled database connections by state.',
+                       [(state, stats[state]) for state in ('size', 'in_use', 'idle', 'waiting')], 'state') + \
+        gauge_lines('db_pool_events_total', 'Cumulative connection pool events.',
+                    [(event, stats[event]) for event in ('created', 'recycled', 'ping_failures',
+                                                          'checkouts', 'waits', 'timeouts')], 'event', 'counter') + \
+        gauge_lines('db_pool_wait_seconds', 'Time spent waiting for a pooled connection.',
+                    [('total', stats['wait_time_total']), ('max', stats['wait_time_max'])], 'stat')
+
+def replica_metrics():
+    replicas = [replica.stats() for replica in mysql.replicas]
+    if not replicas:
+        return []
+    return gauge_lines('db_replica_lag_seconds', 'Last sampled replication lag; -1 when unknown.',
+                       [(replica['name'], -1 if replica['lag'] is None else replica['lag']) for replica in replicas],
+                       'replica') + \
+        gauge_lines('db_replica_usable', 'Whether reads are currently routed to the replica.',
+                    [(replica['name'], int(replica['usable'])) for replica in replicas], 'replica') + \
+        gauge_lines('db_replica_reads_total', 'Requests whose read-only queries ran on the replica.',
+                    [(replica['name'], replica['reads']) for replica in replicas], 'replica', 'counter')
+
+def cache_metrics():
+    stats = catalog_cache.stats()
+    fragments = fragment_cache.stats()
+    return gauge_lines('catalog_cache_events_total', 'Catalog cache lookups and evictions.',
+                       [(event, stats[event]) for event in ('hits', 'misses', 'evictions')], 'event', 'counter') + \
+        gauge_lines('catalog_cache_entries', 'Entries currently held in the catalog cache.', [(None, stats['size'])]) + \
+        gauge_lines('fragment_cache_events_total', 'Template fragment cache lookups and evictions.',
+                    [(event, fragments[event]) for event in ('hits', 'misses', 'evictions')], 'event', 'counter') + \
+        gauge_lines('fragment_cache_entries', 'Rendered fragments currently cached.', [(None, fragments['size'])])
+
+def journal_metrics():
+    if sale_journal is None:
+        return []
+    stats = sale_journal.stats()
+    return gauge_lines('sale_journal_entries_total', 'Journaled sale entries by outcome.',
+                       [(event, stats[event]) for event in ('appended', 'applied', 'replayed', 'rejected')],
+                       'event', 'counter') + \
+        gauge_lines('sale_journal_pending', 'Journaled sale entries not yet committed to MySQL.',
+                    [(None, stats['pending'])]) + \
+        gauge_lines('sale_journal_out_of_stock_total', 'Journaled sale lines not recorded because other workers sold the stock first.',
+                    [(None, stats['out_of_stock'])], metric_type='counter')
+
+def audit_metrics():
+    stats = audit_log.stats()
+    return gauge_lines('audit_events_total', 'Audit events by outcome.',
+                       [(event, stats[event]) for event in ('queued', 'written', 'dropped')], 'event', 'counter') + \
+        gauge_lines('audit_queue_depth', 'Audit events waiting to be written.', [(None, stats['pending'])])
+
+def stream_metrics():
+    stats = change_feed.stats()
+    return gauge_lines('stream_subscribers', 'Open /api/stream connections.', [(None, stats['subscribers'])]) + \
+        gauge_lines('stream_events_total', 'Change feed events published.', [(None, stats['published'])],
+                    metric_type='counter') + \
+        gauge_lines('stream_remote_refreshes_total', 'Refreshes sent for commits seen through the probe.',
+                    [(None, stats['remote_refreshes'])], metric_type='counter')
+
+def leaderboard_metrics():
+    stats = leaderboard.stats()
+    return gauge_lines('leaderboard_products', 'Products with sales held in the leaderboard.',
+                       [(None, stats['products'])]) + \
+        gauge_lines('leaderboard_reconcile_drift', 'Units the last reconcile corrected against the database.',
+                    [(None, stats['last_drift'])])
+
+def barcode_metrics():
+    stats = barcode_map.stats()
+    return gauge_lines('barcode_map_entries', 'Scannable products held in the barcode map.',
+                       [(None, stats['entries'])]) + \
+        gauge_lines('barcode_map_bytes', 'Approximate memory held by the barcode map.', [(None, stats['bytes'])]) + \
+        gauge_lines('barcode_lookups_total', 'Barcode scans by outcome.',
+                    [('hit', stats['hits']), ('miss', stats['misses'])], 'outcome', 'counter')
+
+def analytics_metrics():
+    stats = sales_columns.stats()
+    return gauge_lines('analytics_sales_rows', 'Sales rows held in the columnar analytics store.',
+                       [(None, stats['rows'])]) + \
+        gauge_lines('analytics_order_lag_seconds', 'Furthest a loaded sale trails an earlier one in sale_time.',
+                    [(None, stats['lag_seconds'])]) + \
+        gauge_lines('analytics_pending_gaps', 'Skipped sale ids still being looked for.',
+                    [(None, stats['pending_gaps'])])
+
+def document_metrics():
+    stats = documents.stats()
+    return gauge_lines('document_jobs_total', 'Printable document requests by outcome.',
+                       [(event, stats[event]) for event in ('submitted', 'cache_hits', 'rendered', 'failed', 'rejected')],
+                       'event', 'counter') + \
+        gauge_lines('document_jobs_pending', 'Documents queued or rendering in this worker.',
+                    [(None, stats['pending'])]) + \
+        gauge_lines('document_cache_evictions_total', 'Cached PDFs evicted to stay under the size limit.',
+                    [(None, stats['evicted'])], metric_type='counter')
+
+metrics.add_collector(pool_metrics)
+metrics.add_collector(replica_metrics)
+metrics.add_collector(cache_metrics)
+metrics.add_collector(audit_metrics)
+metrics.add_collector(stream_metrics)
+metrics.add_collector(leaderboard_metrics)
+metrics.add_collector(journal_metrics)
+metrics.add_collector(analytics_metrics)
+metrics.add_collector(barcode_metrics)
+metrics.add_collector(document_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.expose(), mimetype='text/plain; version=0.0.4')
+
+# CLI Commands
+@app.cli.command('rebuild-rollups')
+@click.option('--date-from', help='First day to rebuild (YYYY-MM-DD). Defaults to the first sale.')
+@click.option('--date-to', help='Last day to rebuild (YYYY-MM-DD). Defaults to the last sale.')
+def rebuild_rollups(date_from, date_to):
+    cur = get_db_cursor()
+    try:
+        # Archived days are rebuilt from the archive table
+        first_sale, last_sale = rollup.sales_history_bounds(cur, archive.tables_for_range(cur, 'sales', None))
+        start = rollup.parse_date(date_from, first_sale)
+        end = rollup.parse_date(date_to, last_sale)
+        if not start or not end:
+            click.echo('No sales to roll up.')
+            return
+
+        for day in rollup.rebuild(cur, start, end, archive.tables_for_range(cur, 'sales', start)):
+            mysql.connection.commit()
+            click.echo(f'Rebuilt {day.isoformat()}')
+        http_cache.bump_data_version(cur, 'sales')
+        mysql.connection.commit()
+    finally:
+        cur.close()
+    dashboard_cache.clear()
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user-id', type=int, help='User recorded against new products and stock movements.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help='Write rejected rows to this CSV file.')
+def import_products_command(path, user_id, errors_path):
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        try:
+            result = run_product_import(f, path, user_id, max_errors=None)
+        except product_import.ImportFileError as e:
+            raise click.ClickException(str(e))
+
+    click.echo(f'Read {result.rows} rows in {time.perf_counter() - started:.1f}s: '
+               f'{result.inserted} inserted, {result.updated} updated, '
+               f'{result.movements} stock movements, {result.error_count} rejected.')
+    if result.aborted:
+        click.echo(f'Stopped early: {result.aborted}', err=True)
+
+    if errors_path and result.errors:
+        with open(errors_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=('row', 'barcode', 'error'))
+            writer.writeheader()
+            writer.writerows(result.errors)
+        click.echo(f'Rejected rows written to {errors_path}')
+    elif result.errors:
+        for error in result.errors[:20]:
+            click.echo(f"Row {error['row']}: {error['error']}", err=True)
+        if len(result.errors) > 20:
+            click.echo(f'... and {len(result.errors) - 20} more; use --errors to save them all.', err=True)
+
+@app.cli.command('archive-history')
+@click.option('--before', help='Archive rows older than this date, rounded down to the first of its month. '
+                               'Defaults to ARCHIVE_AFTER_DAYS ago.')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(sorted(archive.ARCHIVES)),
+              help='Table to archive (repeatable). Defaults to all.')
+@click.option('--batch-size', type=int, help='Rows moved per transaction. Defaults to ARCHIVE_BATCH_SIZE.')
+def archive_history(before, tables, batch_size):
+    horizon = archive.month_start(rollup.parse_date(before) or
+                                  archive.default_horizon(app.config['ARCHIVE_AFTER_DAYS']))
+    batch_size = batch_size or app.config['ARCHIVE_BATCH_SIZE']
+
+    cur = get_db_cursor()
+    try:
+        for table in tables or archive.ARCHIVES:
+            for partition in archive.ensure_partitions(cur, table, horizon):
+                click.echo(f"Added partition {partition} to {archive.ARCHIVES[table]['archive']}")
+            archive.mark_archived_before(cur, table, horizon)
+            mysql.connection.commit()
+
+            started = time.perf_counter()
+            moved = 0
+            for count in archive.move_batches(cur, table, horizon, batch_size, app.config['ARCHIVE_BATCH_PAUSE']):
+                mysql.connection.commit()
+                moved += count
+            click.echo(f'Archived {moved} {table} rows older than {horizon.isoformat()} '
+                       f'in {time.perf_counter() - started:.1f}s')
+    finally:
+        cur.close()
+    count_cache.clear()
+
+@app.cli.command('draft-purchase-orders')
+@click.option('--user-id', type=int, help='User recorded against the draft orders.')
+def draft_purchase_orders_command(user_id):
+    cur = get_db_cursor()
+    try:
+        # Serialise runs so two jobs cannot both draft the same shortfall
+        cur.execute("SELECT GET_LOCK('draft_purchase_orders', 0) as acquired")
+        if not cur.fetchone()['acquired']:
+            raise click.ClickException('Another draft-purchase-orders run is in progress.')
+        try:
+            orders, unassigned = draft_purchase_orders(cur, user_id)
+            mysql.connection.commit()
+        finally:
+            cur.execute("SELECT RELEASE_LOCK('draft_purchase_orders')")
+    finally:
+        cur.close()
+
+    for order in orders:
+        audit('INSERT', 'purchase_orders', order['id'], new_values=order)
+        click.echo(f"Drafted order {order['id']} for supplier {order['supplier_id']}: "
+                   f"{order['items']} items, {order['total_amount']:.2f}")
+    if not orders:
+        click.echo('Nothing to reorder.')
+    if unassigned:
+        click.echo(f'{len(unassigned)} products need reordering but have no supplier: '
+                   f"{', '.join(str(product_id) for product_id in unassigned[:20])}"
+                   f"{' ...' if len(unassigned) > 20 else ''}", err=True)
+
+@app.cli.command('forecast-reorder-levels')
+def forecast_reorder_levels_command():
+    # Meant to run nightly: recomputes every active product's demand forecast
+    # and moves min/max_stock_level to the forecast reorder levels
+    started = time.perf_counter()
+    cur = get_db_cursor()
+    try:
+        cur.execute("SELECT GET_LOCK('forecast_reorder_levels', 0) as acquired")
+        if not cur.fetchone()['acquired']:
+            raise click.ClickException('Another forecast-reorder-levels run is in progress.')
+        try:
+            forecasts = forecast_reorder_levels(
+                cur,
+                history_days=app.config['FORECAST_HISTORY_DAYS'],
+                half_life_days=app.config['FORECAST_HALF_LIFE_DAYS'],
+                min_history_days=app.config['FORECAST_MIN_HISTORY_DAYS'],
+                service_level=app.config['REORDER_SERVICE_LEVEL'],
+                lead_time_days=app.config['REORDER_LEAD_TIME_DAYS'],
+                review_days=app.config['REORDER_REVIEW_DAYS'])
+            computed = time.perf_counter() - started
+
+            written = updated = 0
+            for batch_written, changes in save_forecasts(cur, forecasts, app.config['FORECAST_BATCH_SIZE']):
+                mysql.connection.commit()
+                written += batch_written
+                updated += len(changes)
+                for change in changes:
+                    audit('UPDATE', 'products', change['id'], old_values={
+                        'min_stock_level': change['min_stock_level'],
+                        'max_stock_level': change['max_stock_level']
+                    }, new_values={
+                        'min_stock_level': change['reorder_point'],
+                        'max_stock_level': change['order_up_to']
+                    }, block=True)
+        finally:
+            cur.execute("SELECT RELEASE_LOCK('forecast_reorder_levels')")
+    finally:
+        cur.close()
+
+    products_changed()
+    click.echo(f'Forecast {written} products in {computed:.1f}s; '
+               f'{updated} had their stock levels changed ({time.perf_counter() - started:.1f}s total)')
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    # With ANALYTICS_DIR set, run once after deploying so workers start by
+    # mapping the columns instead of loading the whole sales history
+    started = time.perf_counter()
+    cur = get_db_cursor()
+    try:
+        sales_columns.rebuild(cur)
+    finally:
+        cur.close()
+    stats = sales_columns.stats()
+    click.echo(f"Loaded {stats['rows']} sales into the analytics columns in {time.perf_counter() - started:.1f}s")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+def migration_statements(path):
+    # Migrations are plain statements ending in ';' at the end of a line,
+    # with whole-line '--' comments and no DELIMITER blocks
+    with open(path, encoding='utf-8') as f:
+        lines = [line for line in f if not line.lstrip().startswith('--')]
+    statements = (statement.strip().rstrip(';') for statement in ''.join(lines).split(';\n'))
+    return [statement for statement in statements if statement]
+
+@app.cli.command('upgrade-schema')
+def upgrade_schema():
+    # Brings a database created by an older mysql_database_script.txt up to
+    # date. Each migration checks before it changes anything, so every file
+    # is applied on every run, in name order.
+    names = sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith('.sql'))
+    cur = get_db_cursor()
+    try:
+        for name in names:
+            for statement in migration_statements(os.path.join(MIGRATIONS_DIR, name)):
+                cur.execute(statement)
+            mysql.connection.commit()
+            click.echo(f'Applied {name}')
+    finally:
+        cur.close()
+
+@app.cli.command('compile-templates')
+def compile_templates():
+    # Run after a deploy so the first request in each worker loads bytecode
+    # instead of compiling
+    names = app.jinja_env.list_templates(extensions=('html',))
+    for name in names:
+        app.jinja_env.get_template(name)
+    click.echo(f"Compiled {len(names)} templates into {app.config['TEMPLATE_CACHE_DIR']}")
+
 if __name__ == "__main__":
     app.run(debug=True)
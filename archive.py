@@ -0,0 +1,132 @@
+import time
+from datetime import date, datetime, timedelta
+
+
+# Archival of old sales and stock movement history.
+# Rows older than the horizon are copied into a monthly-partitioned archive
+# table and deleted from the hot table in small primary-key batches, each in
+# its own short transaction, so a row is always in exactly one of the two
+# tables and no statement holds locks for long. archive_state records the
+# horizon; reads whose range starts before it also query the archive.
+
+ARCHIVES = {
+    'sales': {
+        'archive': 'sales_archive',
+        'time_column': 'sale_time',
+        'columns': ('id', 'product_id', 'user_id', 'quantity_sold', 'unit_price', 'total_amount',
+                    'payment_method', 'sale_time', 'created_at')
+    },
+    'stock_movements': {
+        'archive': 'stock_movements_archive',
+        'time_column': 'movement_time',
+        'columns': ('id', 'product_id', 'user_id', 'movement_type', 'quantity', 'reason',
+                    'movement_time', 'created_at')
+    }
+}
+
+def archived_before(cur, table):
+    cur.execute("SELECT archived_before FROM archive_state WHERE table_name = %s", (table,))
+    row = cur.fetchone()
+    return row['archived_before'] if row else None
+
+def tables_for_range(cur, table, start):
+    # Oldest first, so callers that read the tables in turn keep time order
+    horizon = archived_before(cur, table)
+    if horizon is not None and (start is None or _as_datetime(start) < horizon):
+        return [ARCHIVES[table]['archive'], table]
+    return [table]
+
+def union_all(template, tables, params):
+    # template holds a {table} placeholder; every branch takes the same params
+    if len(tables) == 1:
+        return template.format(table=tables[0]), tuple(params)
+    query = '\nUNION ALL\n'.join(f'({template.format(table=table)})' for table in tables)
+    return query, tuple(params) * len(tables)
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, datetime.min.time())
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+def _next_month(value):
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+def ensure_partitions(cur, table, until):
+    # Split one partition per month below `until` (a month start) off the
+    # catch-all p_future partition. Only rows older than the horizon are
+    # ever archived, so p_future is empty and each split is cheap.
+    spec = ARCHIVES[table]
+    cur.execute(f"""
+        SELECT MIN({spec['time_column']}) as oldest
+        FROM {table}
+        WHERE {spec['time_column']} < %s
+    """, (until,))
+    oldest = cur.fetchone()['oldest']
+    if oldest is None:
+        return []
+
+    cur.execute("""
+        SELECT PARTITION_NAME as name
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (spec['archive'],))
+    existing = {row['name'] for row in cur.fetchall()}
+
+    added = []
+    month = month_start(oldest)
+    while month < until:
+        name = f'p{month:%Y%m}'
+        if name not in existing:
+            cur.execute(f"""
+                ALTER TABLE {spec['archive']} REORGANIZE PARTITION p_future INTO (
+                    PARTITION {name} VALUES LESS THAN (TO_DAYS('{_next_month(month).isoformat()}')),
+                    PARTITION p_future VALUES LESS THAN MAXVALUE
+                )
+            """)
+            added.append(name)
+        month = _next_month(month)
+    return added
+
+def mark_archived_before(cur, table, horizon):
+    # Recorded before any rows move so reads start consulting the archive
+    # for the whole range that is about to be archived
+    cur.execute("""
+        INSERT INTO archive_state (table_name, archived_before)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE archived_before = GREATEST(archived_before, VALUES(archived_before))
+    """, (table, horizon))
+
+def move_batches(cur, table, horizon, batch_size=5000, pause=0.0):
+    # Yields the number of rows moved by each batch; the caller commits
+    # between batches
+    spec = ARCHIVES[table]
+    columns = ', '.join(spec['columns'])
+    while True:
+        cur.execute(f"""
+            SELECT id
+            FROM {table}
+            WHERE {spec['time_column']} < %s
+            ORDER BY {spec['time_column']}, id
+            LIMIT %s
+        """, (horizon, batch_size))
+        ids = tuple(row['id'] for row in cur.fetchall())
+        if not ids:
+            return
+
+        placeholders = ', '.join(['%s'] * len(ids))
+        cur.execute(f"""
+            INSERT INTO {spec['archive']} ({columns})
+            SELECT {columns} FROM {table} WHERE id IN ({placeholders})
+        """, ids)
+        cur.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+        yield len(ids)
+
+        if pause:
+            time.sleep(pause)
+
+def default_horizon(days):
+    # Always a month boundary, so whole months move together
+    return month_start(date.today() - timedelta(days=days))
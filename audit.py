@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import MySQLdb
+
+from db import PoolTimeout, backoff_delay
+
+
+# Application-side audit trail.
+# Events are queued in memory and a background thread writes them to
+# audit_log with multi-row inserts on a pooled connection, so auditing costs
+# the request path a queue put instead of an extra insert inside its
+# transaction. stop() drains the queue; it runs at interpreter exit so a
+# graceful shutdown does not lose buffered events.
+
+logger = logging.getLogger(__name__)
+
+INSERT_AUDIT_ROWS = """
+    INSERT INTO audit_log
+    (user_id, action, table_name, record_id, old_values, new_values, ip_address, user_agent, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+_STOP = object()
+
+def _json(values):
+    return None if values is None else json.dumps(values, default=str)
+
+class AuditWriter:
+    def __init__(self, pool, queue_size=10000, batch_size=500, flush_interval=1.0, enqueue_timeout=0.5,
+                 retry_backoff=0.5):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._stats = {
+            'queued': 0,
+            'written': 0,
+            'dropped': 0,
+            'batches': 0,
+            'failed_batches': 0
+        }
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so a pre-forking server gets one
+        # writer per worker, started on first use
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def record(self, action, table_name, record_id=None, old_values=None, new_values=None,
+               user_id=None, ip_address=None, user_agent=None, block=False):
+        if self._stopping:
+            self._write([self._row(action, table_name, record_id, old_values, new_values,
+                                   user_id, ip_address, user_agent)])
+            return
+        self._ensure_started()
+
+        row = self._row(action, table_name, record_id, old_values, new_values, user_id, ip_address, user_agent)
+        # Block briefly when the writer falls behind so bursts are absorbed,
+        # but never stall a request indefinitely on auditing. Bulk jobs pass
+        # block=True and wait for the writer instead of dropping events.
+        try:
+            self._queue.put(row, timeout=None if block else self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            logger.error('Audit queue full, dropped %s event for %s %s', action, table_name, record_id)
+            return
+        with self._lock:
+            self._stats['queued'] += 1
+
+    def _row(self, action, table_name, record_id, old_values, new_values, user_id, ip_address, user_agent):
+        return (user_id, action, table_name, record_id, _json(old_values), _json(new_values),
+                ip_address, (user_agent or '')[:255] or None, datetime.now().replace(microsecond=0))
+
+    def _next_batch(self):
+        # Wait for the first event, then take whatever else is already queued
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return [], False
+        batch = []
+        stop = first is _STOP
+        if not stop:
+            batch.append(first)
+        while len(batch) < self.batch_size:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is _STOP:
+                stop = True
+                continue
+            batch.append(row)
+        return batch, stop
+
+    def _run(self):
+        stop = False
+        while not stop or not self._queue.empty():
+            batch, stopped = self._next_batch()
+            stop = stop or stopped
+            if not batch:
+                continue
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+        # Account for the stop marker itself
+        self._queue.task_done()
+
+    def _write(self, batch):
+        attempt = 0
+        while True:
+            conn = None
+            try:
+                conn = self.pool.acquire()
+                cur = conn.cursor()
+                try:
+                    cur.executemany(INSERT_AUDIT_ROWS, batch)
+                finally:
+                    cur.close()
+                conn.commit()
+                self.pool.release(conn)
+                with self._lock:
+                    self._stats['written'] += len(batch)
+                    self._stats['batches'] += 1
+                return
+            except Exception as e:
+                if conn is not None:
+                    self.pool.release(conn, discard=isinstance(e, MySQLdb.OperationalError))
+                with self._lock:
+                    self._stats['failed_batches'] += 1
+                # Keep the batch while the database is unreachable; the
+                # bounded queue pushes back on producers meanwhile. Rows the
+                # server rejects outright are logged and skipped.
+                transient = isinstance(e, (MySQLdb.OperationalError, PoolTimeout))
+                if not transient or (self._stopping and attempt >= 3):
+                    with self._lock:
+                        self._stats['dropped'] += len(batch)
+                    logger.error('Failed to write %d audit events: %s', len(batch), str(e))
+                    return
+                logger.warning('Audit write failed, retrying: %s', str(e))
+                time.sleep(backoff_delay(attempt, self.retry_backoff, cap=10.0))
+                attempt += 1
+
+    def flush(self, timeout=10.0):
+        # Wait until everything queued so far has been written
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline or self._thread is None or not self._thread.is_alive():
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout=30.0):
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._stopping = True
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error('Audit writer did not drain within %ss; %d events pending',
+                         timeout, self._queue.qsize())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['capacity'] = self._queue.maxsize
+        return stats
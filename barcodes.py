@@ -0,0 +1,178 @@
+import sys
+import threading
+import time
+
+
+# Barcode lookup for scanner-driven tills.
+# Every active product with a barcode is held in a dict from barcode to a
+# small (id, name, price, stock) tuple, so a scan is one hash lookup with no
+# database round trip and no lock. Post-commit hooks apply this worker's
+# edits and sales as they happen. A periodic probe on products.updated_at
+# pulls in other workers' changes; stock moves with every sale, so
+# updated_at does too. Deleted products do not show up in that delta, so a
+# count mismatch forces a full reload.
+# Entry sizes are tallied as entries come and go, so stats() can report the
+# footprint without walking 100k+ entries.
+
+BARCODE_COLUMNS = "id, barcode, product_name, price, quantity, is_active"
+
+def normalize_barcode(barcode):
+    return (barcode or '').strip()
+
+def _entry_bytes(barcode, entry):
+    return sys.getsizeof(barcode) + sys.getsizeof(entry) + sum(sys.getsizeof(value) for value in entry)
+
+class BarcodeMap:
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        # barcode -> (product_id, product_name, price, quantity)
+        self._entries = {}
+        # product_id -> barcode, and ids of products that are not scannable
+        # (inactive or without a barcode), so deletes can be detected by count
+        self._barcodes = {}
+        self._unscannable = set()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._warmup_claimed = None
+        self._last_check = 0
+        self._last_updated_at = None
+        # Plain counters bumped outside the lock; close enough for metrics
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def claim_warmup(self, retry_after=60):
+        # True for one caller, which is expected to load the map; if that
+        # load has not finished after retry_after seconds another may try
+        if self._loaded:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self._warmup_claimed is not None and now - self._warmup_claimed < retry_after:
+                return False
+            self._warmup_claimed = now
+            return True
+
+    def needs_refresh(self):
+        return not self._loaded or time.monotonic() - self._last_check >= self.refresh_interval
+
+    def lookup(self, barcode):
+        entry = self._entries.get(normalize_barcode(barcode))
+        if entry is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return entry
+
+    def _drop(self, product_id):
+        self._unscannable.discard(product_id)
+        barcode = self._barcodes.pop(product_id, None)
+        # The barcode may already have been handed to another product
+        entry = self._entries.get(barcode)
+        if entry is not None and entry[0] == product_id:
+            del self._entries[barcode]
+            self._bytes -= _entry_bytes(barcode, entry)
+
+    def _put(self, row):
+        product_id = row['id']
+        self._drop(product_id)
+        barcode = normalize_barcode(row['barcode'])
+        if not barcode or not row['is_active']:
+            self._unscannable.add(product_id)
+            return
+        entry = (product_id, row['product_name'], row['price'], row['quantity'])
+        previous = self._entries.get(barcode)
+        if previous is not None:
+            self._bytes -= _entry_bytes(barcode, previous)
+        self._entries[barcode] = entry
+        self._barcodes[product_id] = barcode
+        self._bytes += _entry_bytes(barcode, entry)
+
+    def add_or_update(self, row):
+        # row carries BARCODE_COLUMNS
+        with self._lock:
+            self._put(row)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._drop(product_id)
+
+    def update_stock(self, rows):
+        # rows only need id and quantity; sales use this after they commit
+        with self._lock:
+            for row in rows:
+                barcode = self._barcodes.get(row['id'])
+                entry = self._entries.get(barcode)
+                if entry is None or entry[0] != row['id'] or entry[3] == row['quantity']:
+                    continue
+                updated = entry[:3] + (row['quantity'],)
+                self._entries[barcode] = updated
+                self._bytes += _entry_bytes(barcode, updated) - _entry_bytes(barcode, entry)
+
+    def load(self, rows):
+        # Built aside and swapped in, so scans keep hitting the old map
+        # until the new one is complete
+        fresh = BarcodeMap()
+        for row in rows:
+            fresh._put(row)
+        with self._lock:
+            self._entries = fresh._entries
+            self._barcodes = fresh._barcodes
+            self._unscannable = fresh._unscannable
+            self._bytes = fresh._bytes
+            self._loaded = True
+            self._reloads += 1
+
+    def expire(self):
+        # Probe the database on the next refresh(), e.g. after a bulk import
+        self._last_check = 0
+
+    def refresh(self, cur, force=False):
+        now = time.monotonic()
+        if not force and not self.needs_refresh():
+            return
+
+        with self._lock:
+            self._last_check = now
+            cur.execute("SELECT COUNT(*) as count, MAX(updated_at) as last_update FROM products")
+            state = cur.fetchone()
+            known = len(self._barcodes) + len(self._unscannable)
+
+            if self._loaded and not force and state['last_update'] == self._last_updated_at \
+                    and state['count'] == known:
+                return
+
+            if self._loaded and not force and self._last_updated_at is not None:
+                cur.execute(f"SELECT {BARCODE_COLUMNS} FROM products WHERE updated_at >= %s",
+                            (self._last_updated_at,))
+                for row in cur.fetchall():
+                    self._put(row)
+                known = len(self._barcodes) + len(self._unscannable)
+
+            if force or not self._loaded or state['count'] != known:
+                cur.execute(f"SELECT {BARCODE_COLUMNS} FROM products")
+                self.load(cur.fetchall())
+
+            self._last_updated_at = state['last_update']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'unscannable': len(self._unscannable),
+                # Entry objects plus the hash tables that index them
+                'bytes': self._bytes + sys.getsizeof(self._entries) + sys.getsizeof(self._barcodes)
+                + sys.getsizeof(self._unscannable),
+                'hits': self._hits,
+                'misses': self._misses,
+                'reloads': self._reloads,
+                'loaded': self._loaded
+            }
@@ -0,0 +1,259 @@
+"""Run load scenarios against the app and record throughput, latency and memory.
+
+Requests go through Flask's test client inside this process, against the
+MySQL/MariaDB database named by --db (seed it first with benchmarks.seed).
+Results are written as JSON so runs can be compared:
+
+    python -m benchmarks.run --db City_Star_Supermarket_bench --threads 16 \
+        --duration 30 --output bench.json --compare previous.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+SEARCH_TERMS = ['milk', 'bread', 'sug', 'rice 5kg', 'cooking oil', 'soap', 'mukwano', 'airtime', '600000000']
+STOCK_SORTS = [('id', 'asc'), ('product_name', 'asc'), ('price', 'desc'), ('quantity', 'asc')]
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def prepare(flask_app, mysql, hot_skus):
+    # Hot SKUs are the best sellers; give them effectively unlimited stock so
+    # contention, not stock-outs, is what the sales scenarios measure
+    with flask_app.app_context():
+        cur = mysql.connection.cursor()
+        cur.execute("""
+            SELECT product_id, SUM(quantity_sold) as sold
+            FROM sales_daily_rollup
+            GROUP BY product_id
+            ORDER BY sold DESC
+            LIMIT %s
+        """, (hot_skus,))
+        hot = [row['product_id'] for row in cur.fetchall()]
+        if not hot:
+            cur.execute("SELECT id FROM products ORDER BY id LIMIT %s", (hot_skus,))
+            hot = [row['id'] for row in cur.fetchall()]
+        placeholders = ', '.join(['%s'] * len(hot))
+        cur.execute(f"UPDATE products SET quantity = 1000000000, is_active = TRUE WHERE id IN ({placeholders})",
+                    tuple(hot))
+
+        cur.execute("SELECT id FROM users ORDER BY id")
+        user_ids = [row['id'] for row in cur.fetchall()]
+        cur.execute("SELECT MIN(sale_date) as first_day, MAX(sale_date) as last_day FROM sales_daily_rollup")
+        bounds = cur.fetchone()
+        mysql.connection.commit()
+        cur.close()
+
+    return {
+        'hot_skus': hot,
+        'user_ids': user_ids,
+        'first_day': bounds['first_day'] or date.today(),
+        'last_day': bounds['last_day'] or date.today()
+    }
+
+# Each scenario returns the response for one simulated user action
+def sales_hot_skus(client, rng, ctx):
+    return client.post('/sales', data={'product_id': rng.choice(ctx['hot_skus']), 'quantity': 1})
+
+def checkout_hot_skus(client, rng, ctx):
+    lines = [{'product_id': rng.choice(ctx['hot_skus']), 'quantity': rng.randint(1, 3)}
+             for _ in range(rng.randint(3, 30))]
+    return client.post('/api/checkout', json={'lines': lines})
+
+def stock_browse(client, rng, ctx):
+    if rng.random() < 0.5:
+        return client.get('/stock', query_string={'search': rng.choice(SEARCH_TERMS)})
+    sort, order = rng.choice(STOCK_SORTS)
+    return client.get('/stock', query_string={'sort': sort, 'order': order})
+
+def report_wide(client, rng, ctx):
+    span = (ctx['last_day'] - ctx['first_day']).days
+    start = ctx['first_day'] + timedelta(days=rng.randint(0, max(span - 90, 0)))
+    end = min(start + timedelta(days=rng.choice((30, 90, 365))), ctx['last_day'])
+    if rng.random() < 0.5:
+        return client.get('/api/sales_data/year')
+    return client.get('/report', query_string={'date_from': start.isoformat(), 'date_to': end.isoformat()})
+
+def dashboard_poll(client, rng, ctx):
+    if rng.random() < 0.2:
+        return client.get('/dashboard')
+    return client.get('/api/dashboard_snapshot')
+
+SCENARIOS = {
+    'sales_hot_skus': sales_hot_skus,
+    'checkout_hot_skus': checkout_hot_skus,
+    'stock_browse': stock_browse,
+    'report_wide': report_wide,
+    'dashboard_poll': dashboard_poll
+}
+
+def run_scenario(flask_app, scenario, ctx, threads, duration, seed):
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+    statuses = [dict() for _ in range(threads)]
+    start_barrier = threading.Barrier(threads + 1)
+    deadline = [0.0]
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = rng.choice(ctx['user_ids'])
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            started = time.perf_counter()
+            try:
+                response = scenario(client, rng, ctx)
+                status = response.status_code
+                response.close()
+            except Exception:
+                status = 'exception'
+            latencies[index].append(time.perf_counter() - started)
+            statuses[index][status] = statuses[index].get(status, 0) + 1
+            if status == 'exception' or status >= 400:
+                errors[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+
+    rss_start = rss_mb()
+    deadline[0] = time.perf_counter() + duration
+    started = time.perf_counter()
+    start_barrier.wait()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(latency for per_thread in latencies for latency in per_thread)
+    status_counts = {}
+    for per_thread in statuses:
+        for status, count in per_thread.items():
+            status_counts[str(status)] = status_counts.get(str(status), 0) + count
+
+    return {
+        'requests': len(samples),
+        'errors': sum(errors),
+        'statuses': status_counts,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(samples, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'max_ms': round((samples[-1] if samples else 0.0) * 1000, 3),
+        'rss_start_mb': round(rss_start, 1),
+        'rss_end_mb': round(rss_mb(), 1),
+        'rss_peak_mb': round(peak_rss_mb(), 1)
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current, previous_path, max_regression):
+    with open(previous_path) as f:
+        previous = json.load(f)
+
+    regressions = []
+    print(f"{'scenario':<20} {'rps':>18} {'p50 ms':>20} {'p99 ms':>20}")
+    for name, result in current['scenarios'].items():
+        before = previous.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        cells = []
+        for key, higher_is_better in (('throughput_rps', True), ('p50_ms', False), ('p99_ms', False)):
+            old, new = before[key], result[key]
+            change = (new - old) / old * 100 if old else 0.0
+            cells.append(f'{old:>8.1f}->{new:<8.1f}({change:+.0f}%)')
+            worse = -change if higher_is_better else change
+            if max_regression is not None and worse > max_regression:
+                regressions.append(f'{name} {key} {change:+.1f}%')
+        print(f'{name:<20} ' + ' '.join(cells))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='City_Star_Supermarket_bench')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable); defaults to all')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='seconds per scenario')
+    parser.add_argument('--hot-skus', type=int, default=3, help='number of contended products')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    parser.add_argument('--max-regression', type=float,
+                        help='exit non-zero if any metric is this many percent worse than --compare')
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time
+    os.environ['MYSQL_DB'] = args.db
+    os.environ.setdefault('FLASK_DEBUG', 'False')
+    import app as app_module
+
+    flask_app = app_module.app
+    flask_app.config['TESTING'] = True
+    ctx = prepare(flask_app, app_module.mysql, args.hot_skus)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'db': args.db,
+            'threads': args.threads,
+            'duration_s': args.duration,
+            'hot_skus': ctx['hot_skus']
+        },
+        'scenarios': {}
+    }
+
+    for name in args.scenario or list(SCENARIOS):
+        print(f'running {name} ({args.threads} threads, {args.duration:g}s)', file=sys.stderr)
+        results['scenarios'][name] = run_scenario(flask_app, SCENARIOS[name], ctx,
+                                                  args.threads, args.duration, args.seed)
+        results['scenarios'][name]['pool'] = app_module.mysql.pool.stats()
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.max_regression)
+        if regressions:
+            print('regressions: ' + ', '.join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
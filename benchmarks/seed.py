@@ -0,0 +1,183 @@
+"""Seed a benchmark database with realistic data volumes.
+
+Creates the schema from mysql_database_script.txt in a separate database and
+fills it with products, cashiers, sales and matching stock movements, then
+rebuilds the sales rollups.
+
+    python -m benchmarks.seed --db City_Star_Supermarket_bench --reset \
+        --products 100000 --sales 10000000 --days 730
+"""
+import argparse
+import itertools
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+import MySQLdb
+import MySQLdb.cursors
+from werkzeug.security import generate_password_hash
+
+from config import Config
+import rollup
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'mysql_database_script.txt')
+SCHEMA_DB_NAME = 'City_Star_Supermarket'
+ER_SP_ALREADY_EXISTS = 1304
+
+BRANDS = ['Mukwano', 'Nile', 'Kakira', 'Fresh Dairy', 'Rwenzori', 'Tilda', 'Colgate', 'Omo',
+          'Blue Band', 'Jesa', 'Riham', 'Highland', 'Star', 'Kabalega', 'Sunseed', 'Nice']
+ITEMS = ['Milk', 'Bread', 'Sugar', 'Rice', 'Soap', 'Juice', 'Tea', 'Coffee', 'Flour', 'Cooking Oil',
+         'Salt', 'Beans', 'Maize Meal', 'Soda', 'Water', 'Biscuits', 'Butter', 'Yoghurt', 'Toothpaste',
+         'Detergent', 'Tissue', 'Eggs', 'Margarine', 'Airtime']
+SIZES = ['100g', '250g', '500g', '1kg', '2kg', '5kg', '300ml', '500ml', '1L', '2L', '5L', 'Pack of 6']
+
+def schema_statements(path, db_name):
+    with open(path, encoding='utf-8') as f:
+        script = f.read().replace(SCHEMA_DB_NAME, db_name)
+
+    delimiter = ';'
+    statement = []
+    for line in script.splitlines():
+        stripped = line.strip()
+        match = re.match(r'DELIMITER\s+(\S+)', stripped, re.IGNORECASE)
+        if match:
+            delimiter = match.group(1)
+            continue
+        if stripped.startswith('--') or not stripped:
+            continue
+        statement.append(line)
+        if stripped.endswith(delimiter):
+            text = '\n'.join(statement).rstrip()[:-len(delimiter)].strip()
+            statement = []
+            # The script contains an ad-hoc query that is not part of the schema
+            if text and not text.lower().startswith('select'):
+                yield text
+
+def connect(db=None):
+    return MySQLdb.connect(host=Config.MYSQL_HOST, user=Config.MYSQL_USER, passwd=Config.MYSQL_PASSWORD,
+                           port=Config.MYSQL_PORT, db=db or '', charset='utf8mb4',
+                           cursorclass=MySQLdb.cursors.DictCursor)
+
+def create_schema(db_name, reset):
+    conn = connect()
+    cur = conn.cursor()
+    if reset:
+        cur.execute(f'DROP DATABASE IF EXISTS `{db_name}`')
+    for statement in schema_statements(SCHEMA_PATH, db_name):
+        try:
+            cur.execute(statement)
+        except MySQLdb.OperationalError as e:
+            # Procedures have no IF NOT EXISTS form
+            if e.args[0] != ER_SP_ALREADY_EXISTS:
+                raise
+    conn.commit()
+    conn.close()
+
+def insert_chunks(conn, cur, query, rows, chunk_size):
+    for start in range(0, len(rows), chunk_size):
+        cur.executemany(query, rows[start:start + chunk_size])
+        conn.commit()
+
+def seed_users(conn, cur, cashiers):
+    password = generate_password_hash('benchmark123')
+    rows = [(f'cashier{n}@citystar.test', password, 'Cashier', str(n)) for n in range(1, cashiers + 1)]
+    cur.executemany("""
+        INSERT IGNORE INTO users (email, password, first_name, last_name)
+        VALUES (%s, %s, %s, %s)
+    """, rows)
+    conn.commit()
+    cur.execute("SELECT id FROM users ORDER BY id")
+    return [row['id'] for row in cur.fetchall()]
+
+def seed_products(conn, cur, count, chunk_size):
+    cur.execute("SELECT id FROM categories ORDER BY id")
+    categories = [row['id'] for row in cur.fetchall()]
+    rows = []
+    for n in range(1, count + 1):
+        name = f'{random.choice(BRANDS)} {random.choice(ITEMS)} {random.choice(SIZES)} #{n}'
+        price = round(random.uniform(500, 50000), 2)
+        min_stock = random.choice((5, 10, 20, 50))
+        rows.append((name, price, random.randint(0, 5000), str(random.choice(categories)),
+                     f'{6000000000000 + n}', min_stock, min_stock * 10))
+    insert_chunks(conn, cur, """
+        INSERT INTO products
+        (product_name, price, quantity, category, barcode, min_stock_level, max_stock_level)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, rows, chunk_size)
+
+    cur.execute("SELECT id, price FROM products ORDER BY id")
+    return [(row['id'], row['price']) for row in cur.fetchall()]
+
+def seed_sales(conn, cur, products, user_ids, count, days, chunk_size):
+    # Product popularity follows a Pareto curve so a handful of SKUs are hot
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** 1.1 for rank in range(len(products))))
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=days)
+    span = int((end - start).total_seconds())
+
+    written = 0
+    started = time.perf_counter()
+    while written < count:
+        batch = min(chunk_size, count - written)
+        chosen = random.choices(products, cum_weights=cum_weights, k=batch)
+        sales = []
+        movements = []
+        for product_id, price in chosen:
+            quantity = random.randint(1, 5)
+            user_id = random.choice(user_ids)
+            sale_time = start + timedelta(seconds=random.randrange(span))
+            sales.append((product_id, user_id, quantity, price, price * quantity, sale_time))
+            movements.append((product_id, user_id, quantity, sale_time))
+
+        cur.executemany("""
+            INSERT INTO sales
+            (product_id, user_id, quantity_sold, unit_price, total_amount, sale_time)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, sales)
+        cur.executemany("""
+            INSERT INTO stock_movements
+            (product_id, user_id, movement_type, quantity, reason, movement_time)
+            VALUES (%s, %s, 'out', %s, 'Sale', %s)
+        """, movements)
+        conn.commit()
+
+        written += batch
+        rate = written / (time.perf_counter() - started)
+        print(f'\rsales: {written}/{count} ({rate:,.0f} rows/s)', end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='City_Star_Supermarket_bench', help='database to create and fill')
+    parser.add_argument('--reset', action='store_true', help='drop the database first')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--sales', type=int, default=10000000)
+    parser.add_argument('--days', type=int, default=730, help='days of sales history to spread sales over')
+    parser.add_argument('--cashiers', type=int, default=25)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42, help='random seed for reproducible data')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    create_schema(args.db, args.reset)
+
+    conn = connect(args.db)
+    cur = conn.cursor()
+    user_ids = seed_users(conn, cur, args.cashiers)
+    products = seed_products(conn, cur, args.products, args.chunk_size)
+    print(f'products: {len(products)}', file=sys.stderr)
+    seed_sales(conn, cur, products, user_ids, args.sales, args.days, args.chunk_size)
+
+    first_sale, last_sale = rollup.sales_history_bounds(cur)
+    if first_sale:
+        for _day in rollup.rebuild(cur, first_sale, last_sale):
+            conn.commit()
+        print(f'rollups: {first_sale} to {last_sale}', file=sys.stderr)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
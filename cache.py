@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Small thread-safe in-process cache with per-entry expiry.
+# Lookups that miss are computed under a lock so concurrent requests for the
+# same key wait for one computation instead of all hitting the database.
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            # Drop values computed before the last clear() so an invalidation
+            # racing with a slow computation is not undone
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._compute_lock:
+            # Another thread may have filled the entry while we waited
+            value = self.get(key)
+            if value is None:
+                generation = self._generation
+                value = factory()
+                self.set(key, value, generation)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+# Bounded LRU cache whose entries are stamped with the version of their
+# namespace at fill time. bump() makes every entry in a namespace stale at
+# once without walking the cache; stale entries are dropped lazily on lookup
+# or evicted by LRU order. max_age bounds staleness for changes made in
+# other worker processes, which cannot bump this process's versions.
+class VersionedCache:
+    def __init__(self, maxsize=256, max_age=None):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None:
+                value, version, created_at = entry
+                fresh = self.max_age is None or time.monotonic() - created_at < self.max_age
+                if version == self._versions.get(namespace, 0) and fresh:
+                    self._entries.move_to_end((namespace, key))
+                    self.hits += 1
+                    return value
+                del self._entries[(namespace, key)]
+            self.misses += 1
+            return None
+
+    def set(self, namespace, key, value, version):
+        with self._lock:
+            # A bump while the value was being computed makes it stale already
+            if version != self._versions.get(namespace, 0):
+                return
+            self._entries[(namespace, key)] = (value, version, time.monotonic())
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, namespace, key, factory):
+        value = self.get(namespace, key)
+        if value is None:
+            version = self.version(namespace)
+            value = factory()
+            self.set(namespace, key, value, version)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'versions': dict(self._versions)
+            }
@@ -1,5 +1,6 @@
 from datetime import timedelta
 import os
+import tempfile
 
 class Config:
     # Basic Configuration
@@ -18,3 +19,106 @@ class Config:
     MYSQL_USER = os.environ.get('MYSQL_USER', 'root')
     MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD', '752002')
     MYSQL_DB = os.environ.get('MYSQL_DB', 'City_Star_Supermarket')
+    MYSQL_PORT = int(os.environ.get('MYSQL_PORT', 3306))
+
+    # Connection Pool Configuration
+    MYSQL_POOL_MIN_SIZE = int(os.environ.get('MYSQL_POOL_MIN_SIZE', 2))
+    MYSQL_POOL_MAX_SIZE = int(os.environ.get('MYSQL_POOL_MAX_SIZE', 20))
+    MYSQL_POOL_TIMEOUT = float(os.environ.get('MYSQL_POOL_TIMEOUT', 5))  # seconds to wait for a free connection
+    MYSQL_POOL_RECYCLE = int(os.environ.get('MYSQL_POOL_RECYCLE', 3600))  # replace connections older than this
+    MYSQL_POOL_PRE_PING = int(os.environ.get('MYSQL_POOL_PRE_PING', 30))  # ping connections idle longer than this
+
+    # Read Replica Configuration
+    MYSQL_REPLICA_HOSTS = os.environ.get('MYSQL_REPLICA_HOSTS', '')  # comma-separated host[:port]; empty reads from the primary
+    MYSQL_REPLICA_MAX_LAG = int(os.environ.get('MYSQL_REPLICA_MAX_LAG', 5))  # seconds; lagging replicas are skipped
+    MYSQL_REPLICA_CHECK_INTERVAL = int(os.environ.get('MYSQL_REPLICA_CHECK_INTERVAL', 5))  # seconds between lag samples
+    MYSQL_REPLICA_CONNECT_TIMEOUT = int(os.environ.get('MYSQL_REPLICA_CONNECT_TIMEOUT', 2))
+    MYSQL_REPLICA_POOL_TIMEOUT = int(os.environ.get('MYSQL_REPLICA_POOL_TIMEOUT', 1))
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))  # reads stay on the primary after a write
+
+    # Sales Configuration
+    # Check stock with a guarded UPDATE ... WHERE quantity >= n issued last in
+    # the transaction instead of locking the product rows up front
+    SALE_ATOMIC_DECREMENT = os.environ.get('SALE_ATOMIC_DECREMENT', 'False') == 'True'
+    SALE_RETRY_ATTEMPTS = int(os.environ.get('SALE_RETRY_ATTEMPTS', 5))  # tries per sale on deadlock/lock wait timeout
+    SALE_RETRY_BACKOFF = float(os.environ.get('SALE_RETRY_BACKOFF', 0.02))  # base backoff in seconds, doubled per retry
+    SALE_JOURNAL_DIR = os.environ.get('SALE_JOURNAL_DIR', '')  # set to enable journaled sales with group commit
+    SALE_JOURNAL_BATCH_SIZE = int(os.environ.get('SALE_JOURNAL_BATCH_SIZE', 500))  # entries per group commit
+    SALE_JOURNAL_FLUSH_INTERVAL = float(os.environ.get('SALE_JOURNAL_FLUSH_INTERVAL', 0.05))  # seconds
+    SALE_JOURNAL_MAX_BYTES = int(os.environ.get('SALE_JOURNAL_MAX_BYTES', 64 * 1024 * 1024))  # truncated once fully applied
+
+    # Caching Configuration
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 10))
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 60))
+    CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', 256))
+    CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+
+    # Template Configuration
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'citystar-jinja'))  # compiled templates, shared by workers
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 5000))  # rendered rows kept per worker
+
+    # Live Dashboard Configuration
+    STREAM_HEARTBEAT = int(os.environ.get('STREAM_HEARTBEAT', 15))  # seconds between keepalives; also how often other workers' commits are probed
+    STREAM_HISTORY = int(os.environ.get('STREAM_HISTORY', 1000))  # events kept for reconnecting clients
+    STREAM_MAX_SUBSCRIBERS = int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 100))  # each stream holds a worker thread
+
+    # Leaderboard Configuration
+    LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 50))  # largest limit /api/top_products serves
+    LEADERBOARD_RECONCILE_INTERVAL = int(os.environ.get('LEADERBOARD_RECONCILE_INTERVAL', 60))  # seconds; also picks up other workers' sales
+
+    # Reorder Configuration
+    LOW_STOCK_REFRESH_INTERVAL = int(os.environ.get('LOW_STOCK_REFRESH_INTERVAL', 30))  # seconds between checks for other workers' stock changes
+    LOW_STOCK_RELOAD_INTERVAL = int(os.environ.get('LOW_STOCK_RELOAD_INTERVAL', 600))  # seconds between full reloads
+    FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', 730))  # demand history used per run
+    FORECAST_HALF_LIFE_DAYS = int(os.environ.get('FORECAST_HALF_LIFE_DAYS', 56))  # a day's demand counts half as much after this
+    FORECAST_MIN_HISTORY_DAYS = int(os.environ.get('FORECAST_MIN_HISTORY_DAYS', 28))  # newer products keep their levels
+    FORECAST_BATCH_SIZE = int(os.environ.get('FORECAST_BATCH_SIZE', 5000))  # products written per transaction
+    REORDER_SERVICE_LEVEL = float(os.environ.get('REORDER_SERVICE_LEVEL', 0.95))  # chance of not running out before a delivery
+    REORDER_LEAD_TIME_DAYS = float(os.environ.get('REORDER_LEAD_TIME_DAYS', 7))  # for suppliers without received orders
+    REORDER_REVIEW_DAYS = float(os.environ.get('REORDER_REVIEW_DAYS', 7))  # days between purchase order runs
+
+    # Response Configuration
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))  # bytes; smaller bodies are sent as is
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))  # gzip level
+    BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))  # used when the Brotli package is installed
+
+    # Analytics Configuration
+    ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR', '')  # memory-mapped sales columns shared by workers; empty keeps them per worker
+    ANALYTICS_REFRESH_INTERVAL = int(os.environ.get('ANALYTICS_REFRESH_INTERVAL', 5))  # seconds between loads of new sales
+    ANALYTICS_LOAD_BATCH = int(os.environ.get('ANALYTICS_LOAD_BATCH', 50000))  # rows per query while loading
+
+    # Search Configuration
+    SEARCH_INDEX_REFRESH = int(os.environ.get('SEARCH_INDEX_REFRESH', 30))
+    BARCODE_REFRESH_INTERVAL = int(os.environ.get('BARCODE_REFRESH_INTERVAL', 30))  # seconds between checks for other workers' changes
+
+    # Reporting Configuration
+    REPORT_PREVIEW_ROWS = int(os.environ.get('REPORT_PREVIEW_ROWS', 500))
+
+    # Document Configuration
+    STORE_NAME = os.environ.get('STORE_NAME', 'City Star Supermarket')  # printed on receipts and reports
+    CURRENCY = os.environ.get('CURRENCY', 'UGX')
+    DOCUMENT_CACHE_DIR = os.environ.get('DOCUMENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'citystar-documents'))  # rendered PDFs and job state, shared by workers
+    DOCUMENT_WORKERS = int(os.environ.get('DOCUMENT_WORKERS', 2))  # render processes per server worker
+    DOCUMENT_MAX_PENDING = int(os.environ.get('DOCUMENT_MAX_PENDING', 32))  # queued renders per server worker before requests get 503
+    DOCUMENT_CACHE_MAX_BYTES = int(os.environ.get('DOCUMENT_CACHE_MAX_BYTES', 256 * 1024 * 1024))  # least recently served PDFs are evicted past this
+    DOCUMENT_JOB_TIMEOUT = int(os.environ.get('DOCUMENT_JOB_TIMEOUT', 300))  # seconds before an unfinished render is considered lost
+
+    # Archival Configuration
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))  # history kept in the hot tables
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 5000))  # rows moved per transaction
+    ARCHIVE_BATCH_PAUSE = float(os.environ.get('ARCHIVE_BATCH_PAUSE', 0.05))  # seconds between batches
+
+    # Import Configuration
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))  # rows per upsert batch and commit
+    IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))  # rejected rows listed per upload
+
+    # Audit Configuration
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))  # events buffered before producers wait
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))  # rows per multi-row insert
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1.0))  # seconds
+    AUDIT_ENQUEUE_TIMEOUT = float(os.environ.get('AUDIT_ENQUEUE_TIMEOUT', 0.5))  # seconds before an event is dropped
+
+    # Instrumentation Configuration
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+    SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 100))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # if set, /metrics requires "Authorization: Bearer <token>"
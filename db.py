@@ -0,0 +1,358 @@
+import random
+import threading
+import time
+from collections import deque
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import g
+
+
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Errors after which the whole transaction can safely be run again
+def is_transient(error):
+    return isinstance(error, MySQLdb.OperationalError) and bool(error.args) \
+        and error.args[0] in (ER_LOCK_WAIT_TIMEOUT, ER_LOCK_DEADLOCK)
+
+# Exponential backoff with full jitter so retrying tills do not collide again
+def backoff_delay(attempt, base, cap=1.0):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Bounded pool of MySQL connections shared by all threads of a worker.
+# Connections idle for longer than pre_ping seconds are pinged before being
+# handed out, and connections older than recycle seconds are replaced, so
+# server-side wait_timeout disconnects never reach a request.
+class ConnectionPool:
+    def __init__(self, connect, min_size=2, max_size=20, timeout=5, recycle=3600, pre_ping=30):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._waiting = 0
+        self._stats = {
+            'created': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0
+        }
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn, time.monotonic()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def warm(self):
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn, created_at = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, created_at, time.monotonic()))
+                self._cond.notify()
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        with self._cond:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available within {self.timeout}s '
+                                      f'(pool size {self.max_size})')
+                if not waited:
+                    waited = True
+                    self._stats['waits'] += 1
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if waited:
+                wait_time = time.monotonic() - started
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+
+            if self._idle:
+                conn, created_at, last_used = self._idle.pop()
+            else:
+                conn = None
+                self._size += 1
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+
+        try:
+            if conn is None:
+                conn, created_at = self._open()
+            else:
+                conn, created_at = self._validate(conn, created_at, last_used)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return _PooledConnection(conn, created_at)
+
+    def _validate(self, conn, created_at, last_used):
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            self._discard(conn)
+            with self._cond:
+                self._stats['recycled'] += 1
+            return self._open()
+
+        if self.pre_ping is not None and now - last_used > self.pre_ping:
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                self._discard(conn)
+                with self._cond:
+                    self._stats['ping_failures'] += 1
+                return self._open()
+
+        return conn, created_at
+
+    def release(self, pooled, discard=False):
+        conn = pooled.raw
+        if not discard:
+            # Never hand an open transaction to the next request
+            try:
+                conn.rollback()
+            except MySQLdb.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, pooled.created_at, time.monotonic()))
+            self._cond.notify()
+
+        if discard:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size
+            })
+            stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+            return stats
+
+
+# A read replica with its own pool. Its replication lag is sampled at most
+# once per check_interval; a replica that lags by more than max_lag, has
+# replication stopped or cannot be reached is skipped until the next check.
+class Replica:
+    def __init__(self, name, pool, max_lag=5, check_interval=5):
+        self.name = name
+        self.pool = pool
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.usable = False
+        self.reads = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _replication_lag(self, conn):
+        cur = conn.cursor(MySQLdb.cursors.DictCursor)
+        try:
+            try:
+                cur.execute("SHOW REPLICA STATUS")
+                column = 'Seconds_Behind_Source'
+            except MySQLdb.ProgrammingError:
+                # MySQL before 8.0.22 and MariaDB
+                cur.execute("SHOW SLAVE STATUS")
+                column = 'Seconds_Behind_Master'
+            row = cur.fetchone()
+        finally:
+            cur.close()
+        # No row: not a replica at all; NULL: replication is not running
+        return None if row is None else row[column]
+
+    def check(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self.usable
+        # One thread samples; the others go on with the previous verdict
+        if not self._lock.acquire(blocking=False):
+            return self.usable
+        try:
+            self._checked_at = now
+            try:
+                conn = self.pool.acquire()
+            except (MySQLdb.Error, PoolTimeout):
+                self.lag, self.usable = None, False
+                return False
+            try:
+                self.lag = self._replication_lag(conn)
+                self.pool.release(conn)
+            except MySQLdb.Error:
+                self.pool.release(conn, discard=True)
+                self.lag = None
+            self.usable = self.lag is not None and self.lag <= self.max_lag
+            return self.usable
+        finally:
+            self._lock.release()
+
+    def mark_down(self):
+        self.usable = False
+        self._checked_at = time.monotonic()
+
+    def stats(self):
+        return {'name': self.name, 'lag': self.lag, 'usable': self.usable, 'reads': self.reads,
+                'pool': self.pool.stats()}
+
+
+class _PooledConnection:
+    def __init__(self, raw, created_at):
+        self.raw = raw
+        self.created_at = created_at
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+# Drop-in replacement for flask_mysqldb.MySQL: `mysql.connection` is a pooled
+# connection checked out once per application context and returned to the
+# pool when the context is torn down.
+class PooledMySQL:
+    def __init__(self, app=None):
+        self.pool = None
+        self._warmed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        cursorclass = getattr(MySQLdb.cursors, config.get('MYSQL_CURSORCLASS') or 'Cursor')
+        connect_args = {
+            'host': config['MYSQL_HOST'],
+            'user': config['MYSQL_USER'],
+            'passwd': config['MYSQL_PASSWORD'],
+            'db': config['MYSQL_DB'],
+            'port': config.get('MYSQL_PORT', 3306),
+            'charset': 'utf8mb4',
+            'cursorclass': cursorclass,
+            'connect_timeout': config.get('MYSQL_CONNECT_TIMEOUT', 10)
+        }
+
+        self.pool = ConnectionPool(
+            lambda: MySQLdb.connect(**connect_args),
+            min_size=config.get('MYSQL_POOL_MIN_SIZE', 2),
+            max_size=config.get('MYSQL_POOL_MAX_SIZE', 20),
+            timeout=config.get('MYSQL_POOL_TIMEOUT', 5),
+            recycle=config.get('MYSQL_POOL_RECYCLE', 3600),
+            pre_ping=config.get('MYSQL_POOL_PRE_PING', 30)
+        )
+
+        # Replicas are "host[:port]" entries and share the primary's
+        # credentials; their pools fail fast so a dead replica costs little
+        self.replicas = []
+        for name in filter(None, (entry.strip() for entry in (config.get('MYSQL_REPLICA_HOSTS') or '').split(','))):
+            host, _, port = name.partition(':')
+            replica_args = dict(connect_args, host=host, port=int(port or 3306),
+                                connect_timeout=config.get('MYSQL_REPLICA_CONNECT_TIMEOUT', 2))
+            pool = ConnectionPool(
+                lambda replica_args=replica_args: MySQLdb.connect(**replica_args),
+                min_size=0,
+                max_size=config.get('MYSQL_POOL_MAX_SIZE', 20),
+                timeout=config.get('MYSQL_REPLICA_POOL_TIMEOUT', 1),
+                recycle=config.get('MYSQL_POOL_RECYCLE', 3600),
+                pre_ping=config.get('MYSQL_POOL_PRE_PING', 30)
+            )
+            self.replicas.append(Replica(name, pool, config.get('MYSQL_REPLICA_MAX_LAG', 5),
+                                         config.get('MYSQL_REPLICA_CHECK_INTERVAL', 5)))
+        self._next_replica = 0
+        app.teardown_appcontext(self.teardown)
+
+    @property
+    def connection(self):
+        conn = g.get('_mysql_pooled_connection')
+        if conn is None:
+            if not self._warmed:
+                self.pool.warm()
+                self._warmed = True
+            conn = self.pool.acquire()
+            g._mysql_pooled_connection = conn
+        return conn
+
+    @property
+    def read_connection(self):
+        # A usable replica for read-only work, else the primary. Once the
+        # primary has been used in this context reads stay there, so a view
+        # never reads older data than it has already seen.
+        conn = g.get('_mysql_read_connection')
+        if conn is not None:
+            return conn
+        if g.get('_mysql_pooled_connection') is None:
+            for offset in range(len(self.replicas)):
+                replica = self.replicas[(self._next_replica + offset) % len(self.replicas)]
+                if not replica.check():
+                    continue
+                try:
+                    conn = replica.pool.acquire()
+                except (MySQLdb.Error, PoolTimeout):
+                    replica.mark_down()
+                    continue
+                self._next_replica = (self._next_replica + offset + 1) % len(self.replicas)
+                replica.reads += 1
+                g._mysql_read_connection = conn
+                g._mysql_read_replica = replica
+                return conn
+        return self.connection
+
+    def teardown(self, exception):
+        discard = isinstance(exception, MySQLdb.OperationalError)
+        conn = g.pop('_mysql_read_connection', None)
+        if conn is not None:
+            g.pop('_mysql_read_replica').pool.release(conn, discard=discard)
+        conn = g.pop('_mysql_pooled_connection', None)
+        if conn is not None:
+            self.pool.release(conn, discard=discard)
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+
+# Printable receipts and sales reports, rendered off the request path.
+# Views gather a document's data, which is cheap, and hand it to a bounded
+# process pool for the layout, which is not: reportlab is pure Python and
+# would hold a gunicorn worker, and the GIL, for the whole render. A job is
+# named by a hash of its kind and data, so a reprinted receipt or an
+# unchanged report is the same job, and a PDF already in the cache directory
+# is served without rendering again. Job state also lives in the cache
+# directory (a .pending marker or an .error file), so every worker can
+# answer polls and downloads for jobs another worker started.
+
+logger = logging.getLogger(__name__)
+
+RENDER_VERSION = 1  # bump when a layout changes so cached PDFs are rendered again
+
+JOB_ID_RE = re.compile(r'(receipt|report)-[0-9a-f]{40}')
+
+class RenderQueueFull(Exception):
+    pass
+
+def _money(value):
+    return f'{float(value):,.2f}'
+
+# Renderers run in the pool's processes: module-level functions of plain
+# JSON data, returning PDF bytes. invariant output keeps equal data
+# byte-identical.
+
+RECEIPT_WIDTH = 80 * mm
+RECEIPT_LINE = 4.5 * mm
+RECEIPT_MARGIN = 4 * mm
+
+def render_receipt(data):
+    height = (len(data['lines']) * 2 + 13) * RECEIPT_LINE
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(RECEIPT_WIDTH, height), invariant=1)
+    pdf.setTitle(f"Receipt {data['reference']}")
+    left, right = RECEIPT_MARGIN, RECEIPT_WIDTH - RECEIPT_MARGIN
+    y = height - 2 * RECEIPT_LINE
+
+    def rule():
+        nonlocal y
+        pdf.setDash(1, 2)
+        pdf.line(left, y + RECEIPT_LINE / 3, right, y + RECEIPT_LINE / 3)
+        pdf.setDash()
+        y -= RECEIPT_LINE
+
+    pdf.setFont('Helvetica-Bold', 11)
+    pdf.drawCentredString(RECEIPT_WIDTH / 2, y, data['store'])
+    y -= 1.5 * RECEIPT_LINE
+    pdf.setFont('Helvetica', 8)
+    for label, value in (('Receipt', data['reference']), ('Date', data['sale_time']), ('Cashier', data['cashier'])):
+        pdf.drawString(left, y, label)
+        pdf.drawRightString(right, y, value or '-')
+        y -= RECEIPT_LINE
+    rule()
+
+    for product_name, quantity, unit_price, total in data['lines']:
+        pdf.drawString(left, y, product_name[:42])
+        y -= RECEIPT_LINE
+        pdf.drawString(left + 3 * mm, y, f'{quantity} x {_money(unit_price)}')
+        pdf.drawRightString(right, y, _money(total))
+        y -= RECEIPT_LINE
+    rule()
+
+    pdf.setFont('Helvetica-Bold', 10)
+    pdf.drawString(left, y, f"TOTAL ({data['currency']})")
+    pdf.drawRightString(right, y, _money(data['total']))
+    y -= 2 * RECEIPT_LINE
+    pdf.setFont('Helvetica', 8)
+    pdf.drawCentredString(RECEIPT_WIDTH / 2, y, 'Thank you for shopping with us!')
+
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+def _table(rows, widths, numeric_from=1):
+    table = Table(rows, colWidths=widths, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FF8E53')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F5F5F5')]),
+        ('ALIGN', (numeric_from, 0), (-1, -1), 'RIGHT'),
+        ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.grey)
+    ]))
+    return table
+
+def render_report(data):
+    styles = getSampleStyleSheet()
+    buffer = BytesIO()
+    title = f"Sales Report {data['date_from']} to {data['date_to']}"
+    document = SimpleDocTemplate(buffer, pagesize=A4, title=title, invariant=1,
+                                 leftMargin=18 * mm, rightMargin=18 * mm, topMargin=18 * mm, bottomMargin=18 * mm)
+    summary = data['summary']
+    currency = data['currency']
+    story = [
+        Paragraph(data['store'], styles['Title']),
+        Paragraph(title, styles['Heading2']),
+        Spacer(1, 4 * mm),
+        _table([
+            ['Transactions', 'Items sold', f'Revenue ({currency})'],
+            [f"{summary['transactions']:,}", f"{summary['quantity']:,}", _money(summary['revenue'])]
+        ], [58 * mm] * 3, numeric_from=0),
+        Spacer(1, 8 * mm),
+        Paragraph('Daily totals', styles['Heading3']),
+        _table([['Date', f'Revenue ({currency})']] +
+               [[day, _money(total)] for day, total in data['days']] or [['-', '-']],
+               [87 * mm, 87 * mm])
+    ]
+    if data['products']:
+        story += [
+            Spacer(1, 8 * mm),
+            Paragraph('Sales by product', styles['Heading3']),
+            _table([['Product', 'Transactions', 'Items sold', f'Revenue ({currency})']] +
+                   [[Paragraph(escape(name), styles['BodyText']), f'{transactions:,}', f'{quantity:,}', _money(revenue)]
+                    for name, transactions, quantity, revenue in data['products']],
+                   [84 * mm, 30 * mm, 30 * mm, 30 * mm])
+        ]
+    document.build(story)
+    return buffer.getvalue()
+
+RENDERERS = {'receipt': render_receipt, 'report': render_report}
+
+class DocumentRenderer:
+    def __init__(self, cache_dir, workers=2, max_pending=32, max_bytes=256 * 1024 * 1024, job_timeout=300):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.job_timeout = job_timeout
+        self._executor = None
+        self._pid = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'cache_hits': 0, 'rendered': 0, 'failed': 0, 'rejected': 0, 'evicted': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def job_id(kind, data):
+        payload = json.dumps([RENDER_VERSION, kind, data], sort_keys=True, separators=(',', ':'), default=str)
+        return f"{kind}-{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+    def _path(self, job_id, suffix):
+        if not JOB_ID_RE.fullmatch(job_id):
+            raise ValueError(f'Invalid document job id: {job_id}')
+        return os.path.join(self.cache_dir, f'{job_id}.{suffix}')
+
+    def _pool(self):
+        # Pools do not survive fork(), so each server worker starts its own
+        # on first use. spawn, not fork: the parent is multi-threaded, and
+        # the children only need this module, not the app.
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self._pid = os.getpid()
+        return self._executor
+
+    def _pending_elsewhere(self, job_id):
+        try:
+            return time.time() - os.path.getmtime(self._path(job_id, 'pending')) < self.job_timeout
+        except FileNotFoundError:
+            return False
+
+    def submit(self, kind, data):
+        # Returns the job id; the PDF may already be cached, or be rendering
+        # for an earlier caller in this or another worker
+        if kind not in RENDERERS:
+            raise ValueError(f'Unknown document kind: {kind}')
+        job_id = self.job_id(kind, data)
+        if self.path(job_id):
+            self._stats['cache_hits'] += 1
+            return job_id
+
+        with self._lock:
+            if job_id in self._futures and self._pid == os.getpid() or self._pending_elsewhere(job_id):
+                return job_id
+            if self._pid != os.getpid():
+                self._futures = {}
+            if len(self._futures) >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise RenderQueueFull(f'{len(self._futures)} documents already queued')
+
+            with open(self._path(job_id, 'pending'), 'w'):
+                pass
+            try:
+                os.remove(self._path(job_id, 'error'))
+            except FileNotFoundError:
+                pass
+            try:
+                future = self._pool().submit(RENDERERS[kind], data)
+            except BrokenProcessPool:
+                # A child died (e.g. killed for memory); start a fresh pool
+                self._executor = None
+                future = self._pool().submit(RENDERERS[kind], data)
+            self._futures[job_id] = future
+            self._stats['submitted'] += 1
+        future.add_done_callback(lambda done: self._finished(job_id, done))
+        return job_id
+
+    def _finished(self, job_id, future):
+        try:
+            pdf = future.result()
+        except Exception as e:
+            logger.error(f'Rendering {job_id} failed: {e}')
+            if isinstance(e, BrokenProcessPool):
+                self._executor = None
+            with open(self._path(job_id, 'error'), 'w') as f:
+                f.write(str(e) or e.__class__.__name__)
+            self._stats['failed'] += 1
+        else:
+            temp_path = self._path(job_id, f'{os.getpid()}.tmp')
+            with open(temp_path, 'wb') as f:
+                f.write(pdf)
+            os.replace(temp_path, self._path(job_id, 'pdf'))
+            self._stats['rendered'] += 1
+            self._evict()
+        finally:
+            try:
+                os.remove(self._path(job_id, 'pending'))
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._futures.pop(job_id, None)
+
+    def _evict(self):
+        # Least recently served first; downloads touch their file
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self._stats['evicted'] += 1
+
+    def path(self, job_id):
+        # The cached PDF, or None if it is not (or no longer) rendered
+        path = self._path(job_id, 'pdf')
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def status(self, job_id):
+        # ('done' | 'pending' | 'failed', error) or (None, None) if unknown
+        if os.path.exists(self._path(job_id, 'pdf')):
+            return 'done', None
+        with self._lock:
+            pending = job_id in self._futures and self._pid == os.getpid()
+        if pending or self._pending_elsewhere(job_id):
+            return 'pending', None
+        try:
+            with open(self._path(job_id, 'error')) as f:
+                return 'failed', f.read()
+        except FileNotFoundError:
+            return None, None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._futures) if self._pid == os.getpid() else 0
+            return stats
+
+    def stop(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
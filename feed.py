@@ -0,0 +1,181 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+
+# In-process change feed delivered to dashboards as Server-Sent Events.
+# Views publish small deltas after their transaction commits; each open
+# stream waits on a condition variable and only wakes to send new events or
+# a keepalive comment, so an idle dashboard costs no queries at all.
+# Recent events are kept in a ring buffer so a reconnecting client resumes
+# from its Last-Event-ID; if it has fallen out of the buffer, or the id was
+# issued by another process, the client is told to reload instead.
+# Events are per process, so a stream only carries the deltas committed by
+# the worker serving it. For everyone else's, open streams share one cheap
+# probe per heartbeat (the data versions the ETags use); when it moves, a
+# refresh event sends dashboards back to the snapshot. Local commits move
+# it too, which costs at most one extra reload per heartbeat.
+
+logger = logging.getLogger(__name__)
+
+class FeedFull(Exception):
+    pass
+
+def format_event(event_id, event_type, payload):
+    return f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+
+class ChangeFeed:
+    def __init__(self, history=1000, heartbeat=15, max_subscribers=100, probe=None):
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        # probe() returns a value that changes whenever any process commits
+        self.probe = probe
+        # Event ids are "<epoch>-<sequence>"; the epoch changes on restart
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=history)
+        self._sequence = 0
+        self._subscribers = 0
+        self._published = 0
+        self._probe_version = None
+        self._probed_at = 0
+        self._probing = False
+        self._remote_refreshes = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event_type, data):
+        payload = json.dumps(data, default=str, separators=(',', ':'))
+        with self._cond:
+            self._sequence += 1
+            self._events.append((self._sequence, event_type, payload))
+            self._published += 1
+            self._cond.notify_all()
+
+    def last_event_id(self):
+        with self._cond:
+            return f'{self.epoch}-{self._sequence}'
+
+    def _parse(self, last_event_id):
+        epoch, _, sequence = (last_event_id or '').partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def _since(self, sequence):
+        # Sequences are contiguous, so the buffer offset is arithmetic
+        if not self._events:
+            return []
+        first = self._events[0][0]
+        start = max(sequence + 1 - first, 0)
+        return [self._events[i] for i in range(start, len(self._events))]
+
+    def subscribe(self, last_event_id=None):
+        # The slot is taken under the same lock as the check, so concurrent
+        # connections cannot all slip under the cap. It is given back when
+        # the stream ends or its response is closed, whichever comes first;
+        # a response closed before streaming never runs the generator.
+        with self._cond:
+            if self._subscribers >= self.max_subscribers:
+                raise FeedFull(f'{self._subscribers} dashboards already connected')
+            self._subscribers += 1
+            sequence = self._parse(last_event_id)
+            oldest = self._events[0][0] if self._events else self._sequence + 1
+            stale = sequence is None or sequence > self._sequence or sequence < oldest - 1
+        return Subscription(self, sequence, stale)
+
+    def _release(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def _check_remote(self):
+        # At most one probe per heartbeat for the whole process, run by
+        # whichever stream gets there first
+        with self._cond:
+            if self.probe is None or self._probing or time.monotonic() - self._probed_at < self.heartbeat:
+                return
+            self._probing = True
+        version = None
+        try:
+            version = self.probe()
+        except Exception as e:
+            logger.warning('Change feed probe failed: %s', str(e))
+        finally:
+            with self._cond:
+                self._probing = False
+                self._probed_at = time.monotonic()
+        if version is None:
+            return
+        with self._cond:
+            changed = self._probe_version is not None and version != self._probe_version
+            self._probe_version = version
+            if changed:
+                self._remote_refreshes += 1
+        if changed:
+            self.publish('refresh', {'reason': 'changed'})
+
+    def _stream(self, sequence, stale, release):
+        try:
+            yield 'retry: 5000\n\n'
+            if stale:
+                # The client's view cannot be patched; it reloads its snapshot
+                # and reconnects from the id that snapshot carries
+                yield format_event(self.last_event_id(), 'reset', '{}')
+                return
+
+            while True:
+                self._check_remote()
+                with self._cond:
+                    pending = self._since(sequence)
+                    if not pending:
+                        self._cond.wait(self.heartbeat)
+                        pending = self._since(sequence)
+                    # A slow client that lost events to the ring buffer
+                    lagged = bool(self._events) and sequence < self._events[0][0] - 1
+                if lagged:
+                    yield format_event(self.last_event_id(), 'reset', '{}')
+                    return
+                if not pending:
+                    # Comment line: keeps proxies from timing the stream out
+                    # and lets the server notice disconnected clients
+                    yield ': keepalive\n\n'
+                    continue
+                for event_sequence, event_type, payload in pending:
+                    yield format_event(f'{self.epoch}-{event_sequence}', event_type, payload)
+                sequence = pending[-1][0]
+        finally:
+            release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'subscribers': self._subscribers,
+                'published': self._published,
+                'buffered': len(self._events),
+                'remote_refreshes': self._remote_refreshes,
+                'last_event_id': f'{self.epoch}-{self._sequence}'
+            }
+
+class Subscription:
+    # The response body for one stream; WSGI servers call close() when the
+    # response ends, including when the client left before the first event
+    def __init__(self, feed, sequence, stale):
+        self._feed = feed
+        self._released = False
+        self._lock = threading.Lock()
+        self._events = feed._stream(sequence, stale, self._release)
+
+    def _release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._feed._release()
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        self._events.close()
+        self._release()
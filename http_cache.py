@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Conditional GET and response compression.
+# ETags are derived from per-table data versions instead of the response
+# body, so a request carrying a matching If-None-Match is answered with 304
+# after a single primary-key probe, before the view runs its queries. sales
+# is insert-only, so its newest id is a version on its own; other writes bump
+# a counter in data_versions after they commit. Compressed variants carry
+# the encoding as an ETag suffix so each representation has its own tag.
+
+VERSION_EXPRESSIONS = {
+    'products': "(SELECT version FROM data_versions WHERE table_name = 'products')",
+    'sales': "CONCAT_WS('.', (SELECT MAX(id) FROM sales), "
+             "(SELECT version FROM data_versions WHERE table_name = 'sales'))"
+}
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+ENCODING_SUFFIXES = ('-br', '-gzip')
+
+def data_versions(cur, tables):
+    columns = ', '.join(f'{VERSION_EXPRESSIONS[table]} as {table}' for table in tables)
+    cur.execute(f"SELECT {columns}")
+    row = cur.fetchone()
+    return tuple(str(row[table]) for table in tables)
+
+def bump_data_version(cur, table):
+    cur.execute("""
+        INSERT INTO data_versions (table_name, version)
+        VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, (table,))
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+def matching_etag(if_none_match, etag):
+    # Returns the tag to echo back in the 304, or None; clients send back
+    # whichever encoded variant they were given
+    if if_none_match.star_tag:
+        return etag
+    for value in if_none_match.as_set():
+        base = value
+        for suffix in ENCODING_SUFFIXES:
+            if value.endswith(suffix):
+                base = value[:-len(suffix)]
+                break
+        if base == etag:
+            return value
+    return None
+
+def compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress(body, encoding, gzip_level=6, brotli_quality=5):
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    # mtime=0 keeps the output, and so the ETag variant, deterministic
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
@@ -0,0 +1,486 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+
+import MySQLdb
+
+from db import PoolTimeout, backoff_delay
+
+
+# Optional write-ahead journal for sales.
+# An accepted basket is appended to a local journal file and fsynced, then
+# acknowledged; a background thread group-commits pending entries to MySQL,
+# many baskets per transaction. Every entry carries a sequence number, and
+# sale_journal_state records the highest one applied per journal in the same
+# transaction as the rows, so replaying a journal after a crash skips what
+# already reached the database.
+# Stock for pending entries is reserved in memory and checked against the
+# last known database quantity, so sales keep being accepted (and refused)
+# correctly while MySQL is slow or unreachable. Reservations are per
+# process, so two workers can accept the same last units; the flusher's
+# stock decrement is guarded, and a line whose stock another worker sold
+# first is not recorded but written to rejected.jsonl for follow-up.
+# Each process writes its own flock()ed journal file; on start a process
+# takes over files whose owner has died and replays them, then drops the
+# file's sale_journal_state row.
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.journal'
+
+class JournalEntry:
+    __slots__ = ('journal_id', 'seq', 'sale_rows')
+
+    def __init__(self, journal_id, seq, sale_rows):
+        self.journal_id = journal_id
+        self.seq = seq
+        self.sale_rows = sale_rows
+
+    def encode(self):
+        return json.dumps({
+            'seq': self.seq,
+            'rows': [[product_id, user_id, quantity, str(unit_price), str(total_amount), sale_time.isoformat()]
+                     for product_id, user_id, quantity, unit_price, total_amount, sale_time in self.sale_rows]
+        }, separators=(',', ':')) + '\n'
+
+    @classmethod
+    def decode(cls, journal_id, line):
+        data = json.loads(line)
+        return cls(journal_id, data['seq'], [
+            (product_id, user_id, quantity, Decimal(unit_price), Decimal(total_amount),
+             datetime.fromisoformat(sale_time))
+            for product_id, user_id, quantity, unit_price, total_amount, sale_time in data['rows']
+        ])
+
+def read_journal(path, journal_id):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    for number, line in enumerate(lines):
+        try:
+            entries.append(JournalEntry.decode(journal_id, line))
+        except ValueError:
+            # A crash mid-append leaves at most one torn line at the end;
+            # that entry was never acknowledged
+            if number == len(lines) - 1:
+                logger.warning('Ignoring incomplete last entry in %s', path)
+                break
+            raise
+    return entries
+
+class SaleJournal:
+    def __init__(self, directory, pool, write_rows, on_commit=None, batch_size=500, flush_interval=0.05,
+                 max_bytes=64 * 1024 * 1024, retry_backoff=0.5):
+        self.directory = directory
+        self.pool = pool
+        self.write_rows = write_rows
+        self.on_commit = on_commit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.retry_backoff = retry_backoff
+        self.journal_id = None
+        self._file = None
+        self._pid = None
+        self._thread = None
+        self._stopping = False
+        self._seq = 0
+        self._synced_seq = 0
+        self._pending = deque()
+        self._reserved = {}
+        self._known_stock = {}
+        self._generation = 0
+        self._db_down_until = 0
+        self._lock = threading.Condition()
+        self._sync_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stats = {
+            'appended': 0,
+            'applied': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'replayed': 0,
+            'rejected': 0,
+            'out_of_stock': 0
+        }
+
+    def _ensure_started(self):
+        # Like the audit writer: one journal and flusher per worker, opened
+        # after fork on first use
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._stopping = False
+            self._pending = deque()
+            self._reserved = {}
+            self.journal_id = uuid.uuid4().hex
+            self._file = open(os.path.join(self.directory, self.journal_id + JOURNAL_SUFFIX), 'a', encoding='utf-8')
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._seq = self._synced_seq = 0
+            self._adopt_orphans()
+            self._thread = threading.Thread(target=self._run, name='sale-journal', daemon=True)
+            self._thread.start()
+
+    def _adopt_orphans(self):
+        # Journals left by dead processes are queued ahead of new sales, and
+        # their quantities reserved until they are applied
+        for name in sorted(os.listdir(self.directory)):
+            journal_id = name[:-len(JOURNAL_SUFFIX)]
+            if not name.endswith(JOURNAL_SUFFIX) or journal_id == self.journal_id:
+                continue
+            path = os.path.join(self.directory, name)
+            f = open(path, 'a', encoding='utf-8')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            entries = read_journal(path, journal_id)
+            self._pending.append(('adopt', journal_id, path, f, entries))
+            for entry in entries:
+                self._reserve(entry.sale_rows)
+            self._stats['replayed'] += len(entries)
+            logger.warning('Replaying %d journaled sale entries from %s', len(entries), name)
+
+    def _reserve(self, sale_rows, sign=1):
+        for row in sale_rows:
+            self._reserved[row[0]] = self._reserved.get(row[0], 0) + sign * row[2]
+            if not self._reserved[row[0]]:
+                del self._reserved[row[0]]
+
+    def submit(self, user_id, lines, load_products, allocate):
+        # load_products(lines) reads current stock from the database;
+        # allocate(products, user_id, lines) is the till's allocation
+        # against the stock it is given. Returns (results, sale_rows) once
+        # the accepted rows are durable in the journal.
+        self._ensure_started()
+        products = self._current_products(lines, load_products)
+
+        with self._lock:
+            available = {product_id: dict(product, stock=product['stock'] - self._reserved.get(product_id, 0))
+                         for product_id, product in products.items()}
+            results, sale_rows, _decrements = allocate(available, user_id, lines)
+            if not sale_rows:
+                return results, sale_rows
+            self._seq += 1
+            entry = JournalEntry(self.journal_id, self._seq, sale_rows)
+            self._file.write(entry.encode())
+            self._file.flush()
+            self._reserve(sale_rows)
+            self._pending.append(entry)
+            self._stats['appended'] += 1
+            self._lock.notify()
+
+        self._sync(entry.seq)
+        return results, sale_rows
+
+    def _current_products(self, lines, load_products):
+        # Stock read from the database is only trusted if no batch was
+        # applied meanwhile; otherwise the read may predate the batch while
+        # its reservations are already gone
+        if time.monotonic() >= self._db_down_until:
+            for _ in range(3):
+                generation = self._generation
+                try:
+                    products = load_products(lines)
+                except (MySQLdb.OperationalError, PoolTimeout) as e:
+                    # Skip the database for a while rather than make every
+                    # till wait out a connect timeout
+                    logger.warning('Stock read failed, using last known stock: %s', str(e))
+                    self._db_down_until = time.monotonic() + self.retry_backoff * 10
+                    break
+                with self._lock:
+                    if generation == self._generation:
+                        self._known_stock.update(products)
+                        return products
+
+        with self._lock:
+            wanted = {line['product_id'] for line in lines}
+            return {product_id: dict(product) for product_id, product in self._known_stock.items()
+                    if product_id in wanted}
+
+    def _sync(self, seq):
+        # Group fsync: one call covers every entry written before it
+        with self._sync_lock:
+            if self._synced_seq >= seq:
+                return
+            with self._lock:
+                target = self._seq
+            os.fsync(self._file.fileno())
+            self._synced_seq = target
+
+    def _next_batch(self):
+        with self._lock:
+            while not self._pending and not self._stopping:
+                self._lock.wait(self.flush_interval)
+            if not self._pending:
+                return None
+            if isinstance(self._pending[0], tuple):
+                return self._pending[0]
+            batch = []
+            for entry in self._pending:
+                if isinstance(entry, tuple) or len(batch) >= self.batch_size:
+                    break
+                batch.append(entry)
+            return batch
+
+    def _run(self):
+        attempt = 0
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                if isinstance(batch, tuple):
+                    self._replay(batch)
+                else:
+                    self._commit(batch)
+                    with self._lock:
+                        for _ in batch:
+                            self._pending.popleft()
+                    self._compact()
+                attempt = 0
+            except (MySQLdb.OperationalError, PoolTimeout) as e:
+                self._db_down_until = time.monotonic() + self.retry_backoff * 10
+                with self._lock:
+                    self._stats['failed_batches'] += 1
+                if self._stopping and attempt >= 3:
+                    logger.error('Database unavailable at shutdown; %d journal entries left for replay',
+                                 len(self._pending))
+                    return
+                logger.warning('Journal flush failed, retrying: %s', str(e))
+                time.sleep(backoff_delay(attempt, self.retry_backoff, cap=10.0))
+                attempt += 1
+            except Exception as e:
+                # The server rejected the batch itself; isolate the bad entry
+                logger.error('Journal batch rejected, applying entries one at a time: %s', str(e))
+                with self._lock:
+                    self._stats['failed_batches'] += 1
+                self._commit_individually(batch if isinstance(batch, list) else batch[4])
+                if isinstance(batch, tuple):
+                    self._finish_replay(batch)
+                else:
+                    with self._lock:
+                        for _ in batch:
+                            self._pending.popleft()
+
+    def _commit(self, entries):
+        conn = self.pool.acquire()
+        discard = False
+        try:
+            applied_rows, short_rows = self._apply(conn, entries)
+        except Exception as e:
+            discard = isinstance(e, MySQLdb.OperationalError)
+            raise
+        finally:
+            self.pool.release(conn, discard=discard)
+        self._db_down_until = 0
+
+        with self._lock:
+            for entry in entries:
+                self._reserve(entry.sale_rows, -1)
+            for row in applied_rows:
+                known = self._known_stock.get(row[0])
+                if known is not None:
+                    known['stock'] -= row[2]
+            for _entry, row in short_rows:
+                # Another worker sold it; the next read has the real figure
+                self._known_stock.pop(row[0], None)
+            self._generation += 1
+            self._stats['applied'] += len(entries)
+            self._stats['out_of_stock'] += len(short_rows)
+            self._stats['batches'] += 1
+
+        for entry, row in short_rows:
+            self._write_rejected(JournalEntry(entry.journal_id, entry.seq, [row]), 'insufficient stock')
+            logger.error('Journaled sale %s/%d: product %s was sold out by another worker; %d units not recorded',
+                         entry.journal_id, entry.seq, row[0], row[2])
+
+        if applied_rows and self.on_commit is not None:
+            try:
+                self.on_commit(applied_rows)
+            except Exception as e:
+                logger.error('Post-commit hook failed for journaled sales: %s', str(e))
+
+    def _apply(self, conn, entries):
+        cur = conn.cursor()
+        try:
+            journal_ids = sorted({entry.journal_id for entry in entries})
+            placeholders = ', '.join(['%s'] * len(journal_ids))
+            cur.execute(f"""
+                SELECT journal_id, applied_seq
+                FROM sale_journal_state
+                WHERE journal_id IN ({placeholders})
+                FOR UPDATE
+            """, tuple(journal_ids))
+            applied = {row['journal_id']: row['applied_seq'] for row in cur.fetchall()}
+
+            fresh = [entry for entry in entries if entry.seq > applied.get(entry.journal_id, 0)]
+            decrements = {}
+            for entry in fresh:
+                for row in entry.sale_rows:
+                    decrements[row[0]] = decrements.get(row[0], 0) + row[2]
+
+            # One guarded decrement per product; only a product that falls
+            # short is taken again line by line, in journal order, so the
+            # earliest sales keep the stock that is there
+            short = set()
+            for product_id, quantity in sorted(decrements.items()):
+                if not self._decrement(cur, product_id, quantity):
+                    short.add(product_id)
+            sale_rows, short_rows = [], []
+            for entry in fresh:
+                for row in entry.sale_rows:
+                    if row[0] in short and not self._decrement(cur, row[0], row[2]):
+                        short_rows.append((entry, row))
+                    else:
+                        sale_rows.append(row)
+            if sale_rows:
+                self.write_rows(cur, sale_rows)
+
+            last_seq = {}
+            for entry in entries:
+                last_seq[entry.journal_id] = max(last_seq.get(entry.journal_id, 0), entry.seq)
+            cur.executemany("""
+                INSERT INTO sale_journal_state (journal_id, applied_seq)
+                VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE applied_seq = GREATEST(applied_seq, VALUES(applied_seq))
+            """, sorted(last_seq.items()))
+            conn.commit()
+            return sale_rows, short_rows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    @staticmethod
+    def _decrement(cur, product_id, quantity):
+        cur.execute("""
+            UPDATE products
+            SET quantity = quantity - %s
+            WHERE id = %s AND quantity >= %s
+        """, (quantity, product_id, quantity))
+        return cur.rowcount == 1
+
+    def _commit_individually(self, entries):
+        for entry in entries:
+            while True:
+                try:
+                    self._commit([entry])
+                    break
+                except (MySQLdb.OperationalError, PoolTimeout) as e:
+                    logger.warning('Journal flush failed, retrying: %s', str(e))
+                    time.sleep(self.retry_backoff)
+                except Exception as e:
+                    self._reject(entry, e)
+                    break
+
+    def _write_rejected(self, entry, error):
+        # Kept for manual repair instead of being retried forever
+        with open(os.path.join(self.directory, 'rejected.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'journal_id': entry.journal_id, 'error': error,
+                                'entry': json.loads(entry.encode())}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _reject(self, entry, error):
+        self._write_rejected(entry, str(error))
+        conn = self.pool.acquire()
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    INSERT INTO sale_journal_state (journal_id, applied_seq)
+                    VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE applied_seq = GREATEST(applied_seq, VALUES(applied_seq))
+                """, (entry.journal_id, entry.seq))
+                conn.commit()
+            finally:
+                cur.close()
+        finally:
+            self.pool.release(conn)
+        with self._lock:
+            self._reserve(entry.sale_rows, -1)
+            self._stats['rejected'] += 1
+        logger.error('Journaled sale %s/%d rejected by the database: %s', entry.journal_id, entry.seq, str(error))
+
+    def _replay(self, adopted):
+        _kind, _journal_id, _path, _f, entries = adopted
+        while entries:
+            batch = entries[:self.batch_size]
+            self._commit(batch)
+            del entries[:len(batch)]
+        self._finish_replay(adopted)
+
+    def _finish_replay(self, adopted):
+        _kind, journal_id, path, f, _entries = adopted
+        os.remove(path)
+        f.close()
+        with self._lock:
+            self._pending.popleft()
+        logger.info('Finished replaying journal %s', journal_id)
+        self._forget(journal_id)
+
+    def _forget(self, journal_id):
+        # Only once the file is gone: without it nothing can replay the
+        # journal, so its applied_seq is no longer needed. A failure just
+        # leaves the row behind.
+        try:
+            conn = self.pool.acquire()
+            try:
+                cur = conn.cursor()
+                try:
+                    cur.execute("DELETE FROM sale_journal_state WHERE journal_id = %s", (journal_id,))
+                    conn.commit()
+                finally:
+                    cur.close()
+            finally:
+                self.pool.release(conn)
+        except Exception as e:
+            logger.warning('Could not drop sale_journal_state for %s: %s', journal_id, str(e))
+
+    def _compact(self):
+        # Once everything written has been applied the file holds nothing
+        # that still matters; sequence numbers keep counting up
+        with self._lock:
+            if self._pending or self._file.tell() < self.max_bytes:
+                return
+            self._file.truncate(0)
+            self._file.seek(0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = sum(len(item[4]) if isinstance(item, tuple) else 1 for item in self._pending)
+            stats['reserved_products'] = len(self._reserved)
+            stats['database_available'] = time.monotonic() >= self._db_down_until
+        return stats
+
+    def stop(self, timeout=30.0):
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        with self._lock:
+            self._stopping = True
+            self._lock.notify()
+        thread.join(timeout)
+        if thread.is_alive() or self._pending:
+            logger.error('Sale journal did not drain within %ss; %d entries left for replay',
+                         timeout, len(self._pending))
+            return
+        # Fully applied: nothing to replay, so the file and its state can go
+        self._file.close()
+        os.remove(self._file.name)
+        self._forget(self.journal_id)
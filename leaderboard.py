@@ -0,0 +1,165 @@
+import heapq
+import threading
+import time
+from datetime import date, timedelta
+
+
+# Top-selling products by units over today, 7 days, 30 days and all time.
+# Counters are kept per day bucket (for the last 30 days) and per window;
+# each window also keeps a sorted top-k list. Within a day counts only grow,
+# so a sale updates the list in O(k); the lists are rebuilt with a heap
+# when the day rolls over and windows shed their oldest bucket, and the
+# whole structure is reloaded from the daily rollup on first use and every
+# reconcile_interval seconds, which also picks up sales made by other
+# worker processes.
+
+WINDOWS = {'today': 1, '7d': 7, '30d': 30, 'all': None}
+BUCKET_DAYS = max(days for days in WINDOWS.values() if days)
+
+def _sort_key(entry):
+    return (-entry[0], entry[1])
+
+class Leaderboard:
+    def __init__(self, size=50, reconcile_interval=60):
+        self.size = size
+        self.reconcile_interval = reconcile_interval
+        self.names = {}
+        self._buckets = {}
+        self._counts = {window: {} for window in WINDOWS}
+        self._tops = {window: [] for window in WINDOWS}
+        self._today = None
+        self._loaded_at = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._stats = {'reconciles': 0, 'last_drift': 0}
+
+    def _in_window(self, window, sale_date):
+        days = WINDOWS[window]
+        return days is None or 0 <= (self._today - sale_date).days < days
+
+    def _rank(self, window):
+        self._tops[window] = sorted(
+            heapq.nsmallest(self.size, ((count, pid) for pid, count in self._counts[window].items()),
+                            key=_sort_key), key=_sort_key)
+
+    def _bump_top(self, window, product_id, count):
+        top = self._tops[window]
+        for index, (_count, pid) in enumerate(top):
+            if pid == product_id:
+                top[index] = (count, product_id)
+                break
+        else:
+            if len(top) < self.size:
+                top.append((count, product_id))
+            elif _sort_key((count, product_id)) < _sort_key(top[-1]):
+                top[-1] = (count, product_id)
+            else:
+                return
+        top.sort(key=_sort_key)
+
+    def _roll(self, today):
+        # Rebuild the day windows from the buckets once the date changes
+        if today == self._today:
+            return
+        self._today = today
+        oldest = today - timedelta(days=BUCKET_DAYS - 1)
+        self._buckets = {day: bucket for day, bucket in self._buckets.items() if day >= oldest}
+        for window, days in WINDOWS.items():
+            if days is None:
+                continue
+            counts = {}
+            for day, bucket in self._buckets.items():
+                if self._in_window(window, day):
+                    for product_id, quantity in bucket.items():
+                        counts[product_id] = counts.get(product_id, 0) + quantity
+            self._counts[window] = counts
+            self._rank(window)
+
+    def record(self, sale_rows):
+        # sale_rows are (product_id, user_id, quantity, unit_price, total_amount, sale_time)
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._roll(date.today())
+            for product_id, _user_id, quantity, _unit_price, _total_amount, sale_time in sale_rows:
+                sale_date = sale_time.date()
+                if 0 <= (self._today - sale_date).days < BUCKET_DAYS:
+                    bucket = self._buckets.setdefault(sale_date, {})
+                    bucket[product_id] = bucket.get(product_id, 0) + quantity
+                for window in WINDOWS:
+                    if self._in_window(window, sale_date):
+                        counts = self._counts[window]
+                        counts[product_id] = counts.get(product_id, 0) + quantity
+                        self._bump_top(window, product_id, counts[product_id])
+
+    def needs_refresh(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reconcile_interval
+
+    def refresh(self, cur, force=False):
+        if not force and not self.needs_refresh():
+            return
+        # One reload at a time; other callers keep serving the current data
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None or force):
+            return
+        try:
+            today = date.today()
+            cur.execute("""
+                SELECT sale_date, product_id, SUM(quantity_sold) as quantity
+                FROM sales_daily_rollup
+                WHERE sale_date BETWEEN %s AND %s
+                GROUP BY sale_date, product_id
+            """, (today - timedelta(days=BUCKET_DAYS - 1), today))
+            buckets = {}
+            for row in cur.fetchall():
+                buckets.setdefault(row['sale_date'], {})[row['product_id']] = int(row['quantity'])
+
+            cur.execute("""
+                SELECT r.product_id, p.product_name, SUM(r.quantity_sold) as quantity
+                FROM sales_daily_rollup r
+                JOIN products p ON p.id = r.product_id
+                GROUP BY r.product_id, p.product_name
+            """)
+            totals = {}
+            names = {}
+            for row in cur.fetchall():
+                totals[row['product_id']] = int(row['quantity'])
+                names[row['product_id']] = row['product_name']
+
+            with self._lock:
+                if self._loaded_at is not None:
+                    previous = self._counts['all']
+                    self._stats['last_drift'] = sum(abs(totals.get(pid, 0) - previous.get(pid, 0))
+                                                    for pid in set(totals) | set(previous))
+                    self._stats['reconciles'] += 1
+                self.names = names
+                self._buckets = buckets
+                self._counts['all'] = totals
+                self._rank('all')
+                self._today = None
+                self._roll(today)
+                self._loaded_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def top(self, window, limit):
+        with self._lock:
+            self._roll(date.today())
+            return [(product_id, count) for count, product_id in self._tops[window][:limit]]
+
+    def forget_name(self, product_id):
+        with self._lock:
+            self.names.pop(product_id, None)
+
+    def set_names(self, names):
+        with self._lock:
+            self.names.update(names)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'products': len(self._counts['all']),
+                'buckets': len(self._buckets),
+                'age': None if self._loaded_at is None else time.monotonic() - self._loaded_at
+            })
+            return stats
@@ -0,0 +1,197 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+
+# Lightweight in-process metrics with Prometheus text exposition.
+# Recording is a perf_counter() pair plus one bucket increment under a lock,
+# cheap enough to leave on for every request and statement.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STATEMENT_RE = re.compile(r'^\s*(\w+)')
+TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)', re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'\s+')
+
+logger = logging.getLogger(__name__)
+
+def statement_labels(query):
+    match = STATEMENT_RE.match(query)
+    operation = match.group(1).upper() if match else 'UNKNOWN'
+    table = TABLE_RE.search(query)
+    return operation, table.group(1) if table else ''
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.label_names, labels)} {count}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{format_labels(self.label_names, labels)} {value}')
+        return lines
+
+def gauge_lines(name, help_text, values, label_name=None, metric_type='gauge'):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+    for label, value in values:
+        labels = f'{{{label_name}="{escape_label(label)}"}}' if label_name else ''
+        lines.append(f'{name}{labels} {value}')
+    return lines
+
+class Metrics:
+    def __init__(self, slow_query_threshold=0.2, slow_query_log_size=100):
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_queries = deque(maxlen=slow_query_log_size)
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency by endpoint.',
+            ('endpoint', 'method', 'status'))
+        self.query_duration = Histogram(
+            'db_query_duration_seconds', 'SQL statement latency by endpoint, operation and table.',
+            ('endpoint', 'operation', 'table'))
+        self.query_rows = Counter(
+            'db_query_rows_total', 'Rows returned or affected by SQL statements.',
+            ('endpoint', 'operation', 'table'))
+        self.slow_query_count = Counter(
+            'db_slow_queries_total', 'SQL statements slower than the slow query threshold.',
+            ('endpoint', 'operation', 'table'))
+        self.transaction_retries = Counter(
+            'db_transaction_retries_total', 'Transactions run again after a deadlock, lock wait timeout or conflict.',
+            ('operation', 'reason'))
+        self.render_duration = Histogram(
+            'template_render_duration_seconds', 'Template render time by template.', ('template',))
+        self.compression_bytes = Counter(
+            'http_compression_bytes_total', 'Compressed response body bytes before and after encoding.',
+            ('encoding', 'stage'))
+        self._collectors = []
+
+    def add_collector(self, collector):
+        # collector() returns extra exposition lines, e.g. pool or cache gauges
+        self._collectors.append(collector)
+
+    def observe_request(self, endpoint, method, status, duration):
+        self.request_duration.observe((endpoint or 'unknown', method, str(status)), duration)
+
+    def observe_retry(self, operation, reason):
+        self.transaction_retries.inc((operation, reason))
+
+    def observe_render(self, template, duration):
+        self.render_duration.observe((template or 'string',), duration)
+
+    def observe_compression(self, encoding, original, compressed):
+        # original - compressed per encoding is the bandwidth saved
+        self.compression_bytes.inc((encoding, 'original'), original)
+        self.compression_bytes.inc((encoding, 'compressed'), compressed)
+
+    def observe_query(self, endpoint, query, duration, rows, many=False):
+        operation, table = statement_labels(query)
+        labels = (endpoint or 'unknown', operation, table)
+        self.query_duration.observe(labels, duration)
+        # Unbuffered cursors report -1 (or its unsigned form) until fetched
+        if rows is not None and 0 < rows < 1 << 62:
+            self.query_rows.inc(labels, rows)
+
+        if duration >= self.slow_query_threshold:
+            self.slow_query_count.inc(labels)
+            statement = WHITESPACE_RE.sub(' ', query).strip()
+            self.slow_queries.append({
+                'endpoint': labels[0],
+                'statement': statement,
+                'executemany': many,
+                'duration_ms': round(duration * 1000, 2),
+                'rows': rows,
+                'at': time.time()
+            })
+            logger.warning('Slow query (%.1f ms, endpoint %s): %s', duration * 1000, labels[0], statement)
+
+    def expose(self):
+        lines = []
+        for metric in (self.request_duration, self.render_duration, self.query_duration, self.query_rows,
+                       self.slow_query_count, self.transaction_retries, self.compression_bytes):
+            lines.extend(metric.expose())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+# Cursor proxy that times every statement and records its row count.
+class InstrumentedCursor:
+    def __init__(self, cursor, metrics, endpoint):
+        self._cursor = cursor
+        self._metrics = metrics
+        self._endpoint = endpoint
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, args)
+        finally:
+            self._metrics.observe_query(self._endpoint, query, time.perf_counter() - started,
+                                        self._cursor.rowcount)
+
+    def executemany(self, query, args):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, args)
+        finally:
+            self._metrics.observe_query(self._endpoint, query, time.perf_counter() - started,
+                                        self._cursor.rowcount, many=True)
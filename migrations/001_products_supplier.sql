@@ -0,0 +1,37 @@
+-- products.supplier_id (reorder.py) and idx_updated_at (barcodes.py, search.py)
+-- for databases created before mysql_database_script.txt declared them.
+-- Every step checks information_schema first, so the file can be applied
+-- any number of times.
+
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND COLUMN_NAME = 'supplier_id') = 0,
+              'ALTER TABLE products ADD COLUMN supplier_id INT AFTER max_stock_level',
+              'DO 0');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND INDEX_NAME = 'idx_supplier_id') = 0,
+              'ALTER TABLE products ADD INDEX idx_supplier_id (supplier_id)',
+              'DO 0');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.TABLE_CONSTRAINTS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products'
+                 AND CONSTRAINT_NAME = 'fk_products_supplier') = 0,
+              'ALTER TABLE products ADD CONSTRAINT fk_products_supplier FOREIGN KEY (supplier_id) REFERENCES suppliers(id) ON DELETE SET NULL',
+              'DO 0');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
+
+SET @ddl = IF((SELECT COUNT(*) FROM information_schema.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND INDEX_NAME = 'idx_updated_at') = 0,
+              'ALTER TABLE products ADD INDEX idx_updated_at (updated_at)',
+              'DO 0');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
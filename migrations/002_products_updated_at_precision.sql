@@ -0,0 +1,12 @@
+-- products.updated_at with microseconds, so two writes in the same second
+-- still move it (templates/stock.html and sales.html key cached rows on it).
+-- Checks information_schema first, so the file can be applied any number of
+-- times.
+
+SET @ddl = IF((SELECT DATETIME_PRECISION FROM information_schema.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND COLUMN_NAME = 'updated_at') = 0,
+              'ALTER TABLE products MODIFY updated_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)',
+              'DO 0');
+PREPARE migration FROM @ddl;
+EXECUTE migration;
+DEALLOCATE PREPARE migration;
@@ -0,0 +1,67 @@
+import base64
+import json
+
+
+# Keyset (cursor) pagination.
+# Pages are addressed by the (sort value, id) of the row at the page edge
+# rather than an OFFSET, so every page costs one index range scan no matter
+# how deep it is. Tokens are opaque to clients.
+
+def encode_cursor(value, row_id, direction, page):
+    payload = json.dumps({'v': value, 'id': row_id, 'd': direction, 'p': page},
+                         default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        cursor = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if cursor['d'] not in ('next', 'prev'):
+            return None
+        cursor['p'] = max(int(cursor['p']), 1)
+        return cursor
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def keyset_page(cur, query, params, sort_column, id_column, order, cursor, per_page):
+    # query must end with its WHERE clause; ordering and limits are added here
+    descending = order == 'desc'
+    backwards = cursor is not None and cursor['d'] == 'prev'
+
+    if cursor is not None:
+        # Walking forward on an ascending sort (or backward on a descending
+        # one) means looking for rows after the cursor, otherwise before it
+        after = descending == backwards
+        op = '>' if after else '<'
+        query += f" AND ({sort_column} {op} %s OR ({sort_column} = %s AND {id_column} {op} %s))"
+        params = list(params) + [cursor['v'], cursor['v'], cursor['id']]
+
+    scan_descending = descending != backwards
+    direction = 'DESC' if scan_descending else 'ASC'
+    query += f" ORDER BY {sort_column} {direction}, {id_column} {direction} LIMIT %s"
+    params = list(params) + [per_page + 1]
+
+    cur.execute(query, tuple(params))
+    rows = list(cur.fetchall())
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    page = cursor['p'] if cursor else 1
+    has_next = has_more if not backwards else True
+    has_prev = has_more if backwards else cursor is not None
+    if not has_prev:
+        page = 1
+
+    return rows, page, has_prev, has_next
+
+def page_tokens(rows, page, has_prev, has_next, sort_key, id_key='id'):
+    if not rows:
+        return None, None
+    first, last = rows[0], rows[-1]
+    prev_token = encode_cursor(first[sort_key], first[id_key], 'prev', page - 1) if has_prev else None
+    next_token = encode_cursor(last[sort_key], last[id_key], 'next', page + 1) if has_next else None
+    return prev_token, next_token
@@ -0,0 +1,341 @@
+import csv
+import io
+import os
+import re
+import unicodedata
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import MySQLdb
+
+
+# Bulk product import from CSV or XLSX uploads.
+# Rows are parsed lazily and written in chunks: one multi-row upsert keyed on
+# barcode and one multi-row stock_movements insert per chunk, committed
+# together, so a 100k-row file costs a few hundred statements rather than
+# 100k form posts. Invalid rows are skipped and reported by line number.
+
+HEADER_ALIASES = {
+    'product_name': 'product_name',
+    'name': 'product_name',
+    'product': 'product_name',
+    'description': 'description',
+    'price': 'price',
+    'unit_price': 'price',
+    'quantity': 'quantity',
+    'qty': 'quantity',
+    'stock': 'quantity',
+    'opening_stock': 'quantity',
+    'category': 'category',
+    'barcode': 'barcode',
+    'sku': 'barcode',
+    'min_stock_level': 'min_stock_level',
+    'max_stock_level': 'max_stock_level'
+}
+REQUIRED_COLUMNS = ('product_name', 'price', 'barcode')
+OPTIONAL_COLUMNS = ('description', 'category', 'min_stock_level', 'max_stock_level')
+AUDITED_COLUMNS = ('product_name', 'price', 'quantity') + OPTIONAL_COLUMNS
+DEFAULT_STOCK_LEVELS = {'min_stock_level': 10, 'max_stock_level': 100}
+MAX_PRICE = Decimal('99999999.99')
+
+
+class ImportFileError(Exception):
+    pass
+
+
+class ImportResult:
+    def __init__(self, max_errors=None):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.movements = 0
+        self.error_count = 0
+        self.errors = []
+        self.aborted = None
+
+    def add_error(self, line, barcode, message):
+        self.error_count += 1
+        if self.max_errors is None or len(self.errors) < self.max_errors:
+            self.errors.append({'row': line, 'barcode': barcode, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'stock_movements': self.movements,
+            'failed': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+            'aborted': self.aborted
+        }
+
+def normalize_header(value):
+    key = re.sub(r'[\s\-]+', '_', str(value or '').strip().lower())
+    return HEADER_ALIASES.get(key)
+
+def read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        # Leave the underlying upload open for its owner to close
+        text.detach()
+
+def read_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError('Excel import requires the openpyxl package; upload a CSV file instead.')
+
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFileError(f'Could not open the Excel file: {str(e)}')
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def read_rows(stream, filename):
+    # Yields (line number, {column: value}) for every non-blank data row
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        rows = read_csv(stream)
+    elif extension in ('.xlsx', '.xlsm'):
+        rows = read_xlsx(stream)
+    else:
+        raise ImportFileError('Unsupported file type; upload a .csv or .xlsx file.')
+
+    line = 1
+    try:
+        header = next(rows, None)
+        if header is None:
+            raise ImportFileError('The file is empty.')
+        columns = [normalize_header(name) for name in header]
+        missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+        if missing:
+            raise ImportFileError('Missing required columns: ' + ', '.join(missing))
+
+        for line, values in enumerate(rows, start=2):
+            if all(value is None or str(value).strip() == '' for value in values):
+                continue
+            record = {}
+            for column, value in zip(columns, values):
+                if column and column not in record:
+                    record[column] = value
+            yield line, record
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFileError(f'Could not read row {line + 1}: {str(e)}')
+
+def _text(value):
+    # Spreadsheet cells holding barcodes or ids often come back as floats
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return '' if value is None else str(value).strip()
+
+def _whole_number(value, field):
+    text = _text(value)
+    if text == '':
+        return None
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f'{field} must be a whole number')
+    if not number.is_finite() or number != number.to_integral_value() or number < 0:
+        raise ValueError(f'{field} must be a whole number of at least 0')
+    return int(number)
+
+def parse_record(record, categories):
+    product_name = _text(record.get('product_name'))
+    if not product_name:
+        raise ValueError('product_name is required')
+    if len(product_name) > 255:
+        raise ValueError('product_name is longer than 255 characters')
+
+    barcode = _text(record.get('barcode'))
+    if not barcode:
+        raise ValueError('barcode is required')
+    if len(barcode) > 50:
+        raise ValueError('barcode is longer than 50 characters')
+
+    try:
+        price = Decimal(_text(record.get('price'))).quantize(Decimal('0.01'))
+        if not price.is_finite():
+            raise ValueError('price must be a number')
+    except InvalidOperation:
+        raise ValueError('price must be a number')
+    if price < 0 or price > MAX_PRICE:
+        raise ValueError(f'price must be between 0 and {MAX_PRICE}')
+
+    category = _text(record.get('category'))
+    if category:
+        # Categories may be given by id or by name
+        category_id = categories.get(category.casefold())
+        if category_id is None:
+            raise ValueError(f'unknown category "{category}"')
+        category = str(category_id)
+
+    parsed = {
+        'product_name': product_name,
+        'description': _text(record.get('description')) or None,
+        'price': price,
+        'quantity': _whole_number(record.get('quantity'), 'quantity'),
+        'category': category or None,
+        'barcode': barcode,
+        'min_stock_level': _whole_number(record.get('min_stock_level'), 'min_stock_level'),
+        'max_stock_level': _whole_number(record.get('max_stock_level'), 'max_stock_level')
+    }
+    levels = [parsed[key] for key in DEFAULT_STOCK_LEVELS]
+    if None not in levels and levels[0] > levels[1]:
+        raise ValueError('min_stock_level is greater than max_stock_level')
+    return parsed
+
+def category_lookup(categories):
+    lookup = {}
+    for category in categories:
+        lookup[str(category['id'])] = category['id']
+        lookup[category['name'].casefold()] = category['id']
+    return lookup
+
+def barcode_key(barcode):
+    # products.barcode compares under utf8mb4_unicode_ci, which ignores case,
+    # accents and trailing spaces; rows are matched up the same way
+    decomposed = unicodedata.normalize('NFKD', barcode.rstrip(' '))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+def write_chunk(cur, chunk, user_id, now):
+    barcodes = [row['barcode'] for _line, row in chunk]
+    placeholders = ', '.join(['%s'] * len(barcodes))
+
+    # Lock the existing rows in id order so concurrent imports and sales
+    # queue behind each other instead of deadlocking
+    cur.execute(f"""
+        SELECT id, barcode, product_name, price, quantity, description, category, min_stock_level, max_stock_level
+        FROM products
+        WHERE barcode IN ({placeholders})
+        ORDER BY id
+        FOR UPDATE
+    """, tuple(barcodes))
+    existing = {barcode_key(row['barcode']): row for row in cur.fetchall()}
+
+    # Blank optional cells keep the stored value on update and fall back to
+    # the table defaults on insert
+    values = []
+    for _line, row in chunk:
+        current = existing.get(barcode_key(row['barcode']))
+        for column in ('quantity',) + OPTIONAL_COLUMNS:
+            if row[column] is None:
+                if current is not None:
+                    row[column] = current[column]
+                else:
+                    row[column] = DEFAULT_STOCK_LEVELS.get(column, 0 if column == 'quantity' else None)
+        values.append((row['product_name'], row['description'], row['price'], row['quantity'],
+                       row['category'], row['barcode'], user_id, row['min_stock_level'],
+                       row['max_stock_level']))
+
+    cur.executemany("""
+        INSERT INTO products
+        (product_name, description, price, quantity, category, barcode, user_id,
+         min_stock_level, max_stock_level)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            product_name = VALUES(product_name),
+            description = VALUES(description),
+            price = VALUES(price),
+            quantity = VALUES(quantity),
+            category = VALUES(category),
+            min_stock_level = VALUES(min_stock_level),
+            max_stock_level = VALUES(max_stock_level)
+    """, values)
+
+    new_barcodes = [barcode for barcode in barcodes if barcode_key(barcode) not in existing]
+    new_ids = {}
+    if new_barcodes:
+        placeholders = ', '.join(['%s'] * len(new_barcodes))
+        cur.execute(f"SELECT id, barcode FROM products WHERE barcode IN ({placeholders})",
+                    tuple(new_barcodes))
+        new_ids = {barcode_key(row['barcode']): row['id'] for row in cur.fetchall()}
+
+    # Opening stock for new products, and the difference from the stored
+    # count for existing ones, mirroring sp_update_stock. changes holds
+    # (product id, old values, new values) for the audit trail.
+    movements = []
+    changes = []
+    for _line, row in chunk:
+        current = existing.get(barcode_key(row['barcode']))
+        new_values = {column: row[column] for column in AUDITED_COLUMNS}
+        if current is None:
+            product_id = new_ids[barcode_key(row['barcode'])]
+            changes.append((product_id, None, new_values))
+            if row['quantity'] > 0:
+                movements.append((product_id, user_id, 'in', row['quantity'], 'Opening stock (import)', now))
+            continue
+        changes.append((current['id'], {column: current[column] for column in AUDITED_COLUMNS}, new_values))
+        if row['quantity'] != current['quantity']:
+            movements.append((current['id'], user_id, 'adjustment', row['quantity'] - current['quantity'],
+                              'Stock count (import)', now))
+    if movements:
+        cur.executemany("""
+            INSERT INTO stock_movements
+            (product_id, user_id, movement_type, quantity, reason, movement_time)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, movements)
+
+    return len(new_barcodes), len(chunk) - len(new_barcodes), len(movements), changes
+
+def import_products(conn, cur, rows, user_id, categories, chunk_size=1000, max_errors=None, on_commit=None):
+    # on_commit(changes) runs after each chunk commits, with that chunk's
+    # (product id, old values, new values); old values are None for inserts
+    result = ImportResult(max_errors)
+    categories = category_lookup(categories)
+    seen = {}
+    chunk = []
+    now = datetime.now()
+
+    def flush():
+        try:
+            inserted, updated, movements, changes = write_chunk(cur, chunk, user_id, now)
+            conn.commit()
+        except MySQLdb.Error as e:
+            conn.rollback()
+            for line, row in chunk:
+                result.add_error(line, row['barcode'], f'Database error: {str(e)}')
+            return
+        result.inserted += inserted
+        result.updated += updated
+        result.movements += movements
+        if on_commit is not None:
+            on_commit(changes)
+
+    try:
+        for line, record in rows:
+            result.rows += 1
+            try:
+                row = parse_record(record, categories)
+            except ValueError as e:
+                result.add_error(line, _text(record.get('barcode')) or None, str(e))
+                continue
+
+            key = barcode_key(row['barcode'])
+            first_line = seen.get(key)
+            if first_line is not None:
+                result.add_error(line, row['barcode'], f'duplicate barcode (first seen on row {first_line})')
+                continue
+            seen[key] = line
+
+            chunk.append((line, row))
+            if len(chunk) >= chunk_size:
+                flush()
+                chunk = []
+    except ImportFileError as e:
+        # Rows read before the failure are still imported; report where
+        # reading stopped
+        if not result.rows:
+            raise
+        result.aborted = str(e)
+
+    if chunk:
+        flush()
+    return result
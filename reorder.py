@@ -0,0 +1,334 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from statistics import NormalDist
+
+import numpy as np
+
+import archive
+
+
+# Low stock tracking and reorder drafts.
+# A product needs reordering when it is active and its quantity has fallen
+# to its own min_stock_level (the vw_low_stock_products definition). The
+# tracker holds just that set in memory; post-commit hooks feed it the rows
+# a sale or edit touched, and a periodic probe on products.updated_at pulls
+# in changes made by other workers, so the dashboard and /api/low_stock never
+# scan the catalog. draft_purchase_orders() tops products up to
+# max_stock_level with one pending order per supplier.
+# forecast_reorder_levels() derives both levels from demand history instead
+# of the static defaults; see the comment above it.
+
+LOW_STOCK_COLUMNS = "id, product_name, quantity, min_stock_level, is_active"
+
+def needs_reorder(row):
+    return bool(row['is_active']) and row['min_stock_level'] is not None \
+        and row['quantity'] <= row['min_stock_level']
+
+class LowStockTracker:
+    def __init__(self, refresh_interval=30, reload_interval=600):
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self._items = {}
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._last_check = 0
+        self._last_updated_at = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def update(self, rows):
+        # rows carry LOW_STOCK_COLUMNS; returns the ones that just crossed
+        # into low stock
+        entered = []
+        with self._lock:
+            for row in rows:
+                if needs_reorder(row):
+                    if row['id'] not in self._items:
+                        entered.append(row)
+                    self._items[row['id']] = (row['quantity'], row['product_name'], row['min_stock_level'])
+                else:
+                    self._items.pop(row['id'], None)
+        return entered
+
+    def remove(self, product_id):
+        with self._lock:
+            self._items.pop(product_id, None)
+
+    def lowest(self, limit=5):
+        with self._lock:
+            items = heapq.nsmallest(limit, self._items.items(), key=lambda item: (item[1][0], item[0]))
+        return [{
+            'id': product_id,
+            'product_name': product_name,
+            'quantity': quantity,
+            'min_stock_level': min_stock_level
+        } for product_id, (quantity, product_name, min_stock_level) in items]
+
+    def expire(self):
+        # Force a full reload on the next refresh(), e.g. after a bulk import
+        self._loaded_at = None
+
+    def refresh(self, cur, force=False):
+        now = time.monotonic()
+        reload = force or self._loaded_at is None or now - self._loaded_at >= self.reload_interval
+        if not reload and now - self._last_check < self.refresh_interval:
+            return
+
+        with self._lock:
+            self._last_check = now
+            cur.execute("SELECT MAX(updated_at) as last_update FROM products")
+            last_update = cur.fetchone()['last_update']
+
+            if reload:
+                cur.execute(f"""
+                    SELECT {LOW_STOCK_COLUMNS}
+                    FROM products
+                    WHERE is_active = TRUE AND quantity <= min_stock_level
+                """)
+                self._items = {}
+                self.update(cur.fetchall())
+                self._loaded_at = now
+            elif last_update != self._last_updated_at and self._last_updated_at is not None:
+                # updated_at moves with every stock change, so the delta
+                # covers sales and edits committed by other workers too
+                cur.execute(f"SELECT {LOW_STOCK_COLUMNS} FROM products WHERE updated_at >= %s",
+                            (self._last_updated_at,))
+                self.update(cur.fetchall())
+
+            self._last_updated_at = last_update
+
+def draft_purchase_orders(cur, user_id=None, now=None):
+    # One pass over the catalog: quantities already on pending or ordered
+    # purchase orders count towards stock, so running the job again does not
+    # duplicate drafts. The caller owns the transaction.
+    now = now or datetime.now()
+    cur.execute("""
+        SELECT p.id, p.supplier_id, p.quantity, p.max_stock_level, p.price,
+               COALESCE(o.on_order, 0) as on_order
+        FROM products p
+        LEFT JOIN (
+            SELECT i.product_id, SUM(i.quantity) as on_order
+            FROM purchase_order_items i
+            JOIN purchase_orders po ON po.id = i.purchase_order_id
+            WHERE po.status IN ('pending', 'ordered')
+            GROUP BY i.product_id
+        ) o ON o.product_id = p.id
+        WHERE p.is_active = TRUE
+        AND p.quantity + COALESCE(o.on_order, 0) <= p.min_stock_level
+    """)
+
+    by_supplier = defaultdict(list)
+    unassigned = []
+    for row in cur.fetchall():
+        quantity = row['max_stock_level'] - row['quantity'] - int(row['on_order'])
+        if quantity <= 0:
+            continue
+        if row['supplier_id'] is None:
+            unassigned.append(row['id'])
+            continue
+        by_supplier[row['supplier_id']].append((row['id'], quantity, Decimal(row['price'])))
+
+    orders = []
+    items = []
+    for supplier_id, lines in sorted(by_supplier.items()):
+        total = sum(quantity * price for _product_id, quantity, price in lines)
+        cur.execute("""
+            INSERT INTO purchase_orders (supplier_id, user_id, order_date, status, total_amount, notes)
+            VALUES (%s, %s, %s, 'pending', %s, %s)
+        """, (supplier_id, user_id, now, total, 'Draft generated from stock levels'))
+        order_id = cur.lastrowid
+        orders.append({'id': order_id, 'supplier_id': supplier_id, 'items': len(lines), 'total_amount': total})
+        items.extend((order_id, product_id, quantity, price, quantity * price)
+                     for product_id, quantity, price in lines)
+
+    if items:
+        cur.executemany("""
+            INSERT INTO purchase_order_items (purchase_order_id, product_id, quantity, unit_price, total_price)
+            VALUES (%s, %s, %s, %s, %s)
+        """, items)
+
+    return orders, unassigned
+
+# Demand forecasting for reorder levels.
+# Daily demand is sales (from the daily rollup) plus other stock taken out
+# (waste, breakage), exponentially weighted towards recent days. MySQL
+# reduces the history to a weighted sum and sum of squares per product in
+# one pass over the rollup, so only one row per product crosses the wire;
+# the model itself is a handful of NumPy operations over the whole catalog:
+#   reorder point = rate * lead time + z * sqrt(lead * var + rate^2 * lead_var)
+#   order-up-to   = rate * (lead time + review period) + safety stock
+# Lead times are measured per supplier from received purchase orders, taking
+# the last update of a received order as its delivery date.
+
+FORECAST_COLUMNS = ('product_id', 'history_days', 'demand_rate', 'demand_std', 'lead_time_days',
+                    'lead_time_std', 'safety_stock', 'reorder_point', 'order_up_to', 'days_of_cover',
+                    'applied', 'computed_at')
+
+# Products in an id range whose levels differ from an applied forecast
+CHANGED_LEVELS = """
+    WHERE p.id BETWEEN %s AND %s
+    AND p.is_active = TRUE AND f.applied = TRUE
+    AND NOT (p.min_stock_level <=> f.reorder_point AND p.max_stock_level <=> f.order_up_to)
+"""
+
+def supplier_lead_times(cur, since, min_orders=3):
+    cur.execute("""
+        SELECT supplier_id, COUNT(*) as orders,
+               AVG(DATEDIFF(updated_at, order_date)) as mean_days,
+               COALESCE(STDDEV_SAMP(DATEDIFF(updated_at, order_date)), 0) as std_days
+        FROM purchase_orders
+        WHERE status = 'received' AND order_date >= %s
+        GROUP BY supplier_id
+        HAVING COUNT(*) >= %s
+    """, (since, min_orders))
+    return {row['supplier_id']: (float(row['mean_days']), float(row['std_days'])) for row in cur.fetchall()}
+
+def _demand_sums(cur, start, end, ratio):
+    # Weighted sums of daily demand per product over [start, end); a day's
+    # weight is ratio ** its age in days, counted back from the day before end
+    last_day = end - timedelta(days=1)
+    cur.execute("""
+        SELECT product_id, MIN(sale_date) as first_day,
+               SUM(POW(%s, DATEDIFF(%s, sale_date)) * quantity_sold) as weighted_sum,
+               SUM(POW(%s, DATEDIFF(%s, sale_date)) * quantity_sold * quantity_sold) as weighted_squares
+        FROM sales_daily_rollup
+        WHERE sale_date >= %s AND sale_date < %s
+        GROUP BY product_id
+    """, (ratio, last_day, ratio, last_day, start, end))
+    sums = {row['product_id']: [row['first_day'], float(row['weighted_sum']), float(row['weighted_squares'])]
+            for row in cur.fetchall()}
+
+    # Stock taken out other than by a sale is rare, so it is fetched per day
+    # alongside that day's sales and folded in here: (a + b)^2 needs the
+    # cross term, which separate sums would lose
+    query, params = archive.union_all("""
+        SELECT product_id, DATE(movement_time) as day, quantity
+        FROM {table}
+        WHERE movement_type = 'out' AND (reason IS NULL OR reason <> 'Sale')
+        AND movement_time >= %s AND movement_time < %s
+    """, archive.tables_for_range(cur, 'stock_movements', start), (start, end))
+    cur.execute(f"""
+        SELECT other.product_id, other.day, other.quantity, COALESCE(r.quantity_sold, 0) as sold
+        FROM (
+            SELECT product_id, day, SUM(quantity) as quantity
+            FROM ({query}) movements
+            GROUP BY product_id, day
+        ) other
+        LEFT JOIN sales_daily_rollup r ON r.sale_date = other.day AND r.product_id = other.product_id
+    """, params)
+    for row in cur.fetchall():
+        weight = ratio ** (last_day - row['day']).days
+        quantity = float(row['quantity'])
+        entry = sums.setdefault(row['product_id'], [row['day'], 0.0, 0.0])
+        entry[0] = min(entry[0], row['day'])
+        entry[1] += weight * quantity
+        entry[2] += weight * (quantity * quantity + 2 * quantity * row['sold'])
+    return sums
+
+def forecast_reorder_levels(cur, today=None, history_days=730, half_life_days=56, min_history_days=28,
+                            service_level=0.95, lead_time_days=7, review_days=7):
+    # Returns one tuple of FORECAST_COLUMNS per active product. Levels are
+    # only marked applied once a product has min_history_days of history;
+    # newer products keep the levels they were given.
+    today = today or date.today()
+    start = today - timedelta(days=history_days)
+    ratio = 0.5 ** (1 / half_life_days)
+
+    cur.execute("""
+        SELECT id, supplier_id, quantity, DATE(created_at) as created
+        FROM products
+        WHERE is_active = TRUE
+        ORDER BY id
+    """)
+    products = cur.fetchall()
+    if not products:
+        return []
+    sums = _demand_sums(cur, start, today, ratio)
+    lead_times = supplier_lead_times(cur, start)
+
+    count = len(products)
+    ids = np.array([row['id'] for row in products], np.int64)
+    quantity = np.array([row['quantity'] for row in products], np.float64)
+    first_day = np.array([(row['created'] or today).toordinal() for row in products], np.int64)
+    weighted_sum = np.zeros(count)
+    weighted_squares = np.zeros(count)
+    lead = np.full(count, float(lead_time_days))
+    lead_std = np.zeros(count)
+
+    if sums:
+        demand_ids = np.fromiter(sums, np.int64, len(sums))
+        positions = np.searchsorted(ids, demand_ids).clip(max=count - 1)
+        active = ids[positions] == demand_ids
+        values = list(sums.values())
+        positions = positions[active]
+        weighted_sum[positions] = np.array([value[1] for value in values])[active]
+        weighted_squares[positions] = np.array([value[2] for value in values])[active]
+        first_sale = np.array([value[0].toordinal() for value in values], np.int64)[active]
+        first_day[positions] = np.minimum(first_day[positions], first_sale)
+
+    for index, row in enumerate(products):
+        if row['supplier_id'] in lead_times:
+            lead[index], lead_std[index] = lead_times[row['supplier_id']]
+
+    # Days of history, and the total weight they carry: sum of ratio ** age
+    history = np.clip(today.toordinal() - first_day, 1, history_days)
+    total_weight = (1 - ratio ** history) / (1 - ratio)
+    rate = weighted_sum / total_weight
+    variance = np.maximum(weighted_squares / total_weight - rate ** 2, 0)
+
+    z = NormalDist().inv_cdf(service_level)
+    safety = z * np.sqrt(lead * variance + rate ** 2 * lead_std ** 2)
+    # Rounded first so float noise in the sums cannot push 21.0 up to 22
+    reorder_point = np.ceil(np.round(rate * lead + safety, 6)).astype(np.int64)
+    order_up_to = np.maximum(np.ceil(np.round(rate * (lead + review_days) + safety, 6)).astype(np.int64),
+                             reorder_point)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(rate > 0, quantity / rate, np.nan)
+    applied = history >= min_history_days
+
+    computed_at = datetime.now()
+    return [(
+        int(ids[i]), int(history[i]), round(float(rate[i]), 4), round(float(np.sqrt(variance[i])), 4),
+        round(float(lead[i]), 2), round(float(lead_std[i]), 2), round(float(safety[i]), 2),
+        int(reorder_point[i]), int(order_up_to[i]), None if np.isnan(cover[i]) else round(float(cover[i]), 1),
+        bool(applied[i]), computed_at
+    ) for i in range(count)]
+
+def save_forecasts(cur, forecasts, batch_size=5000):
+    # Yields (forecasts written, level changes) per batch, each change a row
+    # of the product's old and new min/max_stock_level for the audit trail;
+    # the caller commits between batches so no statement holds product row
+    # locks for long
+    columns = ', '.join(FORECAST_COLUMNS)
+    updates = ', '.join(f'{column} = VALUES({column})' for column in FORECAST_COLUMNS[1:])
+    for offset in range(0, len(forecasts), batch_size):
+        batch = forecasts[offset:offset + batch_size]
+        cur.executemany(f"""
+            INSERT INTO product_forecasts ({columns})
+            VALUES ({', '.join(['%s'] * len(FORECAST_COLUMNS))})
+            ON DUPLICATE KEY UPDATE {updates}
+        """, batch)
+        id_range = (batch[0][0], batch[-1][0])
+        # Locked, so the update below changes exactly these rows
+        cur.execute(f"""
+            SELECT p.id, p.min_stock_level, p.max_stock_level, f.reorder_point, f.order_up_to
+            FROM products p
+            JOIN product_forecasts f ON f.product_id = p.id
+            {CHANGED_LEVELS}
+            ORDER BY p.id
+            FOR UPDATE
+        """, id_range)
+        changes = cur.fetchall()
+        if changes:
+            cur.execute(f"""
+                UPDATE products p
+                JOIN product_forecasts f ON f.product_id = p.id
+                SET p.min_stock_level = f.reorder_point, p.max_stock_level = f.order_up_to
+                {CHANGED_LEVELS}
+            """, id_range)
+        yield len(batch), changes
@@ -0,0 +1,135 @@
+from datetime import date, datetime, timedelta
+
+
+# Per-day and per-hour sales totals per product.
+# Rows are folded into the rollup tables inside the same transaction that
+# writes the sales, so the totals are exactly as current as the sales table.
+
+def _hour(sale_time):
+    return sale_time.replace(minute=0, second=0, microsecond=0)
+
+def apply_sales(cur, sale_rows):
+    # sale_rows are (product_id, user_id, quantity, unit_price, total_amount, sale_time)
+    daily = {}
+    hourly = {}
+    for product_id, _user_id, quantity, _unit_price, total_amount, sale_time in sale_rows:
+        for buckets, key in ((daily, (sale_time.date(), product_id)),
+                             (hourly, (_hour(sale_time), product_id))):
+            transactions, quantity_sold, amount = buckets.get(key, (0, 0, 0))
+            buckets[key] = (transactions + 1, quantity_sold + quantity, amount + total_amount)
+
+    # Sorted keys keep the upsert lock order stable across concurrent tills
+    cur.executemany("""
+        INSERT INTO sales_daily_rollup
+        (sale_date, product_id, transactions, quantity_sold, total_amount)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            transactions = transactions + VALUES(transactions),
+            quantity_sold = quantity_sold + VALUES(quantity_sold),
+            total_amount = total_amount + VALUES(total_amount)
+    """, [key + value for key, value in sorted(daily.items())])
+
+    cur.executemany("""
+        INSERT INTO sales_hourly_rollup
+        (sale_hour, product_id, transactions, quantity_sold, total_amount)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            transactions = transactions + VALUES(transactions),
+            quantity_sold = quantity_sold + VALUES(quantity_sold),
+            total_amount = total_amount + VALUES(total_amount)
+    """, [key + value for key, value in sorted(hourly.items())])
+
+def _source(tables, columns):
+    # One day of sales from each table (the hot table and, for archived
+    # days, its archive) as a single derived table
+    return '\nUNION ALL\n'.join(f"""
+        SELECT {columns} FROM {table}
+        WHERE sale_time >= %s AND sale_time < %s
+    """ for table in tables)
+
+def rebuild(cur, date_from, date_to, tables=('sales',)):
+    # Recompute one day at a time so each statement only touches a bounded
+    # slice of sales through idx_sale_time
+    day = date_from
+    while day <= date_to:
+        start = datetime.combine(day, datetime.min.time())
+        end = start + timedelta(days=1)
+        source_params = (start, end) * len(tables)
+
+        cur.execute("DELETE FROM sales_daily_rollup WHERE sale_date = %s", (day,))
+        cur.execute("""
+            DELETE FROM sales_hourly_rollup
+            WHERE sale_hour >= %s AND sale_hour < %s
+        """, (start, end))
+
+        cur.execute(f"""
+            INSERT INTO sales_daily_rollup
+            (sale_date, product_id, transactions, quantity_sold, total_amount)
+            SELECT %s, product_id, COUNT(*), SUM(quantity_sold), SUM(total_amount)
+            FROM ({_source(tables, 'product_id, quantity_sold, total_amount')}) s
+            GROUP BY product_id
+        """, (day,) + source_params)
+
+        cur.execute(f"""
+            INSERT INTO sales_hourly_rollup
+            (sale_hour, product_id, transactions, quantity_sold, total_amount)
+            SELECT DATE_FORMAT(sale_time, '%%Y-%%m-%%d %%H:00:00'), product_id,
+                   COUNT(*), SUM(quantity_sold), SUM(total_amount)
+            FROM ({_source(tables, 'product_id, quantity_sold, total_amount, sale_time')}) s
+            GROUP BY DATE_FORMAT(sale_time, '%%Y-%%m-%%d %%H:00:00'), product_id
+        """, source_params)
+
+        yield day
+        day += timedelta(days=1)
+
+def sales_history_bounds(cur, tables=('sales',)):
+    bounds = '\nUNION ALL\n'.join(
+        f"SELECT MIN(sale_time) as first_sale, MAX(sale_time) as last_sale FROM {table}" for table in tables)
+    cur.execute(f"""
+        SELECT MIN(first_sale) as first_sale, MAX(last_sale) as last_sale
+        FROM ({bounds}) b
+    """)
+    row = cur.fetchone()
+    if not row['first_sale']:
+        return None, None
+    return row['first_sale'].date(), row['last_sale'].date()
+
+def daily_totals(cur, date_from, date_to):
+    cur.execute("""
+        SELECT sale_date as date,
+               SUM(total_amount) as total
+        FROM sales_daily_rollup
+        WHERE sale_date BETWEEN %s AND %s
+        GROUP BY sale_date
+        ORDER BY sale_date
+    """, (date_from, date_to))
+    return cur.fetchall()
+
+def hourly_totals(cur, day):
+    start = datetime.combine(day, datetime.min.time())
+    cur.execute("""
+        SELECT sale_hour as hour,
+               SUM(total_amount) as total
+        FROM sales_hourly_rollup
+        WHERE sale_hour >= %s AND sale_hour < %s
+        GROUP BY sale_hour
+        ORDER BY sale_hour
+    """, (start, start + timedelta(days=1)))
+    return cur.fetchall()
+
+def range_summary(cur, date_from, date_to):
+    cur.execute("""
+        SELECT COALESCE(SUM(transactions), 0) as count,
+               COALESCE(SUM(total_amount), 0) as total_amount,
+               COALESCE(SUM(quantity_sold), 0) as total_quantity
+        FROM sales_daily_rollup
+        WHERE sale_date BETWEEN %s AND %s
+    """, (date_from, date_to))
+    return cur.fetchone()
+
+def parse_date(value, default=None):
+    if not value:
+        return default
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
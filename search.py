@@ -0,0 +1,343 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from itertools import islice
+
+
+# In-process trigram index over product name, barcode and category name.
+# Posting lists are compact append-only int arrays over name and barcode;
+# candidates from the rarest trigram are verified against the current
+# document text, so edits and deletes only need to touch the document table
+# and stale postings are filtered out until the next full reload compacts
+# them.
+# Category text is shared by thousands of products, so it is matched once
+# per category and its members are taken wholesale instead of being verified
+# one product at a time.
+# Ranked results for recent queries are memoised until the index changes, so
+# paging through or re-typing a query does not rescan its candidates.
+
+WORD_RE = re.compile(r'\w+')
+
+def normalize(text):
+    return (text or '').casefold().strip()
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def word_starts(text):
+    # Leading-space joined words let word-prefix checks run as a single
+    # substring test: ' ' + term in word_starts(text)
+    return ' ' + ' '.join(WORD_RE.findall(text))
+
+class ProductSearchIndex:
+    def __init__(self, refresh_interval=30, result_cache_size=256, result_cache_depth=100):
+        self.refresh_interval = refresh_interval
+        self.result_cache_size = result_cache_size
+        self.result_cache_depth = result_cache_depth
+        self._results = OrderedDict()
+        self._docs = {}
+        self._grams = {}
+        self._prefixes = {}
+        self._categories = {}
+        self._category_order = {}
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_check = 0
+        self._last_updated_at = None
+        self._categories_state = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _add_postings(self, index, keys, product_id):
+        for key in keys:
+            postings = index.get(key)
+            if postings is None:
+                postings = index[key] = array('i')
+            postings.append(product_id)
+
+    def add_or_update(self, product_id, product_name, barcode=None, category_name=None):
+        name = normalize(product_name)
+        code = normalize(barcode)
+        category = normalize(category_name)
+        text = ' '.join(part for part in (name, code) if part)
+        words = WORD_RE.findall(text)
+
+        with self._lock:
+            self._results.clear()
+            previous = self._docs.get(product_id)
+            # Documents start with (name, id) so they double as the sort key
+            self._docs[product_id] = (name, product_id, code, text, category,
+                                      word_starts(name), ' ' + ' '.join(words))
+            if previous is None or previous[0] != name or previous[4] != category:
+                self._category_order.pop(category, None)
+                if previous is not None:
+                    self._category_order.pop(previous[4], None)
+            if previous is None or previous[4] != category:
+                if previous is not None and previous[4]:
+                    self._categories[previous[4]].discard(product_id)
+                if category:
+                    self._categories.setdefault(category, set()).add(product_id)
+            if previous is not None and previous[3] == text:
+                return
+
+            self._add_postings(self._grams, trigrams(text), product_id)
+            self._add_postings(self._prefixes,
+                               {word[:n] for word in words for n in (1, 2)},
+                               product_id)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._results.clear()
+            doc = self._docs.pop(product_id, None)
+            if doc is not None and doc[4]:
+                self._categories[doc[4]].discard(product_id)
+                self._category_order.pop(doc[4], None)
+
+    def load(self, rows):
+        with self._lock:
+            self._results.clear()
+            self._docs = {}
+            self._grams = {}
+            self._prefixes = {}
+            self._categories = {}
+            self._category_order = {}
+            for row in rows:
+                self.add_or_update(row['id'], row['product_name'], row['barcode'], row['category_name'])
+            self._loaded = True
+
+    def expire(self):
+        # Make the next refresh() probe the database straight away, e.g.
+        # after a bulk write that touched too many rows to apply one by one
+        self._last_check = 0
+
+    def refresh(self, cur, force=False):
+        # Cheap staleness probe so changes made by other workers show up
+        # within refresh_interval seconds
+        now = time.monotonic()
+        if self._loaded and not force and now - self._last_check < self.refresh_interval:
+            return
+
+        with self._lock:
+            self._last_check = now
+            cur.execute(INDEX_STATE_QUERY)
+            state = cur.fetchone()
+            # Renaming or deleting a category does not touch products.updated_at
+            categories_state = (state['category_count'], state['category_update'])
+            if categories_state != self._categories_state:
+                force = True
+
+            if self._loaded and not force and state['last_update'] == self._last_updated_at \
+                    and state['count'] == len(self._docs):
+                return
+
+            if self._loaded and not force and self._last_updated_at is not None:
+                cur.execute(PRODUCT_DOCUMENT_QUERY + " WHERE p.updated_at >= %s",
+                            (self._last_updated_at,))
+                for row in cur.fetchall():
+                    self.add_or_update(row['id'], row['product_name'], row['barcode'], row['category_name'])
+
+            # Deleted rows do not show up in the delta, so fall back to a
+            # full reload whenever the counts disagree
+            if force or not self._loaded or state['count'] != len(self._docs):
+                cur.execute(PRODUCT_DOCUMENT_QUERY)
+                self.load(cur.fetchall())
+
+            self._last_updated_at = state['last_update']
+            self._categories_state = categories_state
+
+    def _term_sources(self, term, prefix_only):
+        # Postings that cover every name/barcode match of term, and every
+        # category it matches
+        if len(term) >= 3:
+            postings = min((self._grams.get(gram, ()) for gram in trigrams(term)), key=len)
+        else:
+            postings = self._prefixes.get(term, ())
+
+        if prefix_only:
+            prefix = ' ' + term
+            categories = [category for category in self._categories if prefix in word_starts(category)]
+        else:
+            categories = [category for category in self._categories if term in category]
+        return postings, categories
+
+    def _source_size(self, sources):
+        postings, categories = sources
+        return len(postings) + sum(len(self._categories[category]) for category in categories)
+
+    def _ordered_members(self, category):
+        # Members sorted by name, rebuilt only after a product joins, leaves
+        # or is renamed within the category
+        ordered = self._category_order.get(category)
+        if ordered is None:
+            ordered = self._category_order[category] = sorted(self._categories[category],
+                                                              key=self._docs.__getitem__)
+        return ordered
+
+    def _rank(self, query, terms):
+        # Lower scores rank first: exact barcode, name prefix, name word
+        # prefixes, name substring, then matches on barcode/category only.
+        # Matches are bucketed by score so only the buckets a page reaches
+        # need ordering by name. Single-term category matches are returned
+        # as the categories themselves plus the ids already bucketed.
+        buckets = ([], [], [], [], [])
+        exact, name_prefix, word_prefix, substring, other = (bucket.append for bucket in buckets)
+        prefixes = [' ' + term for term in terms]
+        # Short queries only match the start of a word
+        prefix_only = len(query) < 3 and len(terms) == 1
+        matched = set()
+        docs = self._docs
+
+        if len(terms) == 1:
+            term, prefix = terms[0], prefixes[0]
+            postings, categories = self._term_sources(term, prefix_only)
+            for product_id in set(postings):
+                doc = docs.get(product_id)
+                if doc is None:
+                    continue
+                if prefix_only:
+                    if prefix not in doc[6]:
+                        continue
+                    in_name = prefix in doc[5]
+                else:
+                    if term not in doc[3]:
+                        continue
+                    in_name = term in doc[0]
+                matched.add(product_id)
+
+                # Every name score implies the term occurs in the name, so
+                # barcode-only matches skip the name checks
+                if doc[2] == query:
+                    exact(product_id)
+                elif not in_name:
+                    other(product_id)
+                elif doc[0].startswith(query):
+                    name_prefix(product_id)
+                elif prefix in doc[5]:
+                    word_prefix(product_id)
+                elif query in doc[0]:
+                    substring(product_id)
+                else:
+                    other(product_id)
+            return buckets, categories, matched
+
+        # Every match contains every term, so the cheapest term's sources
+        # cover all of them
+        postings, categories = min((self._term_sources(term, False) for term in terms),
+                                   key=self._source_size)
+        candidates = set(postings)
+        for category in categories:
+            candidates.update(self._categories[category])
+
+        for product_id in candidates:
+            doc = docs.get(product_id)
+            if doc is None:
+                continue
+            text, category = doc[3], doc[4]
+            for term in terms:
+                if term not in text and term not in category:
+                    break
+            else:
+                name_words = doc[5]
+                if doc[2] == query:
+                    exact(product_id)
+                elif doc[0].startswith(query):
+                    name_prefix(product_id)
+                else:
+                    for prefix in prefixes:
+                        if prefix not in name_words:
+                            break
+                    else:
+                        word_prefix(product_id)
+                        continue
+                    if query in doc[0]:
+                        substring(product_id)
+                    else:
+                        other(product_id)
+        return buckets, [], matched
+
+    def _count(self, buckets, categories, matched):
+        # Products belong to one category, so the category matches beyond
+        # the bucketed ids never overlap
+        return sum(len(bucket) for bucket in buckets) + sum(
+            len(self._categories[category]) - len(matched.intersection(self._categories[category]))
+            for category in categories)
+
+    def _order(self, buckets, categories, matched, depth):
+        key = self._docs.__getitem__
+        ranked = []
+        for bucket in buckets[:-1]:
+            need = depth - len(ranked)
+            if need <= 0:
+                return ranked
+            if len(bucket) <= need:
+                ranked.extend(sorted(bucket, key=key))
+            else:
+                ranked.extend(heapq.nsmallest(need, bucket, key=key))
+
+        # The last bucket merges with the category matches, which are walked
+        # in name order only as far as the page needs
+        need = depth - len(ranked)
+        if need > 0:
+            streams = [heapq.nsmallest(need, buckets[-1], key=key)]
+            streams.extend((product_id for product_id in self._ordered_members(category)
+                            if product_id not in matched)
+                           for category in categories)
+            ranked.extend(islice(heapq.merge(*streams, key=key), need))
+        return ranked
+
+    def matches(self, query):
+        # Every matching id, unordered, for callers that apply their own
+        # ordering (e.g. sorting search results by a column)
+        query = normalize(query)
+        terms = WORD_RE.findall(query)
+        if not terms:
+            return []
+        with self._lock:
+            buckets, categories, matched = self._rank(query, terms)
+            ids = [product_id for bucket in buckets for product_id in bucket]
+            for category in categories:
+                ids.extend(self._categories[category].difference(matched))
+            return ids
+
+    def search(self, query, page=1, per_page=10):
+        query = normalize(query)
+        terms = WORD_RE.findall(query)
+        if not terms:
+            return [], 0
+
+        offset = (page - 1) * per_page
+        with self._lock:
+            cached = self._results.get(query)
+            # A memoised ranking serves any page it covers, or every page
+            # once it holds all matches
+            if cached is not None and (offset + per_page <= len(cached[0]) or len(cached[0]) == cached[1]):
+                self._results.move_to_end(query)
+                ranked, total = cached
+            else:
+                buckets, categories, matched = self._rank(query, terms)
+                total = self._count(buckets, categories, matched)
+                # Only the rows up to the requested page need to be ordered
+                ranked = self._order(buckets, categories, matched,
+                                     max(offset + per_page, self.result_cache_depth))
+                self._results[query] = (ranked, total)
+                if len(self._results) > self.result_cache_size:
+                    self._results.popitem(last=False)
+
+        return ranked[offset:offset + per_page], total
+
+INDEX_STATE_QUERY = """
+    SELECT COUNT(*) as count, MAX(updated_at) as last_update,
+           (SELECT COUNT(*) FROM categories) as category_count,
+           (SELECT MAX(updated_at) FROM categories) as category_update
+    FROM products
+"""
+
+PRODUCT_DOCUMENT_QUERY = """
+    SELECT p.id, p.product_name, p.barcode, c.name as category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category = c.id
+"""
@@ -0,0 +1,64 @@
+// Receipts and report PDFs are rendered by background jobs: submit one (or
+// start from a job the server already queued), poll it until it is done,
+// then open the download. The window is opened up front, while the click
+// still counts as a user gesture, so popup blockers let it through.
+
+function waitForDocument(job, interval) {
+    interval = interval || 500;
+    return new Promise(function(resolve, reject) {
+        function check(body) {
+            if (body.status === 'done') {
+                resolve(body.download_url);
+            } else if (body.status === 'pending') {
+                setTimeout(function() {
+                    fetch(body.status_url, {credentials: 'same-origin'})
+                        .then(response => response.json())
+                        .then(check, reject);
+                }, interval);
+            } else {
+                reject(new Error(body.error || 'The document is no longer available.'));
+            }
+        }
+        check(job);
+    });
+}
+
+function requestDocument(url, payload) {
+    return fetch(url, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(payload)
+    }).then(response => response.json().then(body => {
+        if (!response.ok) {
+            throw new Error(body.error || 'The document could not be requested.');
+        }
+        return body;
+    }));
+}
+
+function openDocument(button, pending) {
+    const target = window.open('', '_blank');
+    const label = button.innerHTML;
+    button.disabled = true;
+    button.innerHTML = '<i class="fas fa-spinner fa-spin mr-1"></i>Preparing...';
+
+    return pending
+        .then(waitForDocument)
+        .then(downloadUrl => {
+            target.location = downloadUrl;
+        })
+        .catch(error => {
+            target.close();
+            Swal.fire({
+                icon: 'error',
+                title: 'Document Unavailable',
+                text: error.message,
+                confirmButtonColor: '#FF6B6B'
+            });
+        })
+        .finally(() => {
+            button.disabled = false;
+            button.innerHTML = label;
+        });
+}
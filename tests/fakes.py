@@ -0,0 +1,64 @@
+# Test doubles for the database cursor and connection pool.
+# FakeCursor answers each query with the rows of the first handler whose
+# pattern appears in the SQL, and keeps every statement it was given.
+
+class FakeCursor:
+    def __init__(self, handlers=()):
+        # handlers: (pattern, rows) pairs; rows may be a callable of params
+        self.handlers = list(handlers)
+        self.executed = []
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.executed.append((' '.join(query.split()), params))
+        self._rows = []
+        for pattern, rows in self.handlers:
+            if pattern in query:
+                self._rows = list(rows(params) if callable(rows) else rows)
+                break
+        self.rowcount = len(self._rows)
+
+    def executemany(self, query, seq_of_params):
+        self.executed.append((' '.join(query.split()), list(seq_of_params)))
+        self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
+
+    def statements(self, pattern):
+        return [(query, params) for query, params in self.executed if pattern in query]
+
+class FakeConnection:
+    def __init__(self, handlers=()):
+        self.handlers = handlers
+        self.cursors = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        cur = FakeCursor(self.handlers)
+        self.cursors.append(cur)
+        return cur
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+class FakePool:
+    def __init__(self, handlers=()):
+        self.connection = FakeConnection(handlers)
+
+    def acquire(self):
+        return self.connection
+
+    def release(self, conn, discard=False):
+        pass
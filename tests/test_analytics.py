@@ -0,0 +1,114 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from analytics import SalesColumns, percent_change
+from tests.fakes import FakeCursor
+
+MONDAY = date(2024, 3, 4)
+SUNDAY = date(2024, 3, 10)
+
+CATEGORIES = [
+    {'id': 1, 'category_name': 'Dairy'},
+    {'id': 2, 'category_name': 'Bakery'},
+    {'id': 3, 'category_name': None}
+]
+
+def sale(sale_id, product_id, user_id, quantity, amount, sale_time):
+    return {'id': sale_id, 'product_id': product_id, 'user_id': user_id, 'quantity_sold': quantity,
+            'total_amount': Decimal(amount), 'sale_time': sale_time}
+
+def week_of_sales():
+    return [
+        sale(1, 1, 1, 2, '5.00', datetime(2024, 3, 4, 0, 15)),
+        sale(2, 2, 2, 1, '3.00', datetime(2024, 3, 10, 23, 45)),
+        sale(3, 1, 1, 1, '2.50', datetime(2024, 3, 4, 10, 5)),
+        sale(4, 3, None, 1, '1.00', datetime(2024, 2, 28, 12, 0))
+    ]
+
+def database(sales):
+    return FakeCursor([
+        ('archive_state', []),
+        ('data_versions', [{'products': 1}]),
+        ('LEFT JOIN categories', CATEGORIES),
+        ('FROM sales', lambda params: [row for row in sales if row['id'] > params[0]][:params[1]])
+    ])
+
+def loaded(sales, directory=None):
+    columns = SalesColumns(directory)
+    columns.refresh(database(sales), force=True)
+    return columns
+
+def test_percent_change():
+    assert percent_change(15, 10) == 50.0
+    assert percent_change(5, 0) is None
+
+def test_hour_of_week_starts_on_monday_midnight():
+    result = loaded(week_of_sales()).hour_of_week(MONDAY, SUNDAY)
+
+    assert result['revenue'][0][0] == 5.0
+    assert result['revenue'][0][10] == 2.5
+    assert result['revenue'][6][23] == 3.0
+    assert sum(map(sum, result['transactions'])) == 3
+
+def test_category_trend_buckets_by_days():
+    result = loaded(week_of_sales()).category_trend(date(2024, 2, 26), SUNDAY, bucket_days=7)
+
+    assert result['labels'] == [date(2024, 2, 26), MONDAY]
+    assert result['series'] == [
+        {'category': 'Dairy', 'total': 7.5, 'revenue': [0.0, 7.5]},
+        {'category': 'Bakery', 'total': 3.0, 'revenue': [0.0, 3.0]},
+        {'category': 'Uncategorised', 'total': 1.0, 'revenue': [1.0, 0.0]}
+    ]
+
+def test_compare_against_the_previous_period():
+    result = loaded(week_of_sales()).compare(MONDAY, SUNDAY)
+
+    assert (result['current']['transactions'], result['current']['units'], result['current']['revenue']) == (3, 4, 10.5)
+    assert (result['previous']['transactions'], result['previous']['revenue']) == (1, 1.0)
+    assert result['change'] == {'transactions': 200.0, 'units': 300.0, 'revenue': 950.0}
+    assert [(row['category'], row['change']) for row in result['categories']] == \
+        [('Dairy', None), ('Bakery', None), ('Uncategorised', -100.0)]
+
+def test_cashiers_count_active_clock_hours():
+    result = loaded(week_of_sales()).cashiers(date(2024, 2, 26), SUNDAY)
+
+    assert [(row['user_id'], row['sales'], row['units'], row['revenue'], row['active_hours'])
+            for row in result] == [(1, 2, 3, 7.5, 2), (2, 1, 1, 3.0, 1), (None, 1, 1, 1.0, 1)]
+    assert result[0]['sales_per_hour'] == 1.0
+
+def test_new_rows_are_appended_even_out_of_time_order():
+    sales = week_of_sales()
+    columns = loaded(sales)
+    sales.append(sale(5, 2, 2, 1, '4.00', datetime(2024, 3, 5, 8, 30)))
+
+    columns.refresh(database(sales), force=True)
+
+    assert columns.stats()['rows'] == 5
+    assert columns.stats()['lag_seconds'] > 0
+    assert columns.hour_of_week(MONDAY, SUNDAY)['revenue'][1][8] == 4.0
+    assert columns.hour_of_week(date(2024, 3, 5), date(2024, 3, 5))['transactions'][1][8] == 1
+
+def test_gap_rows_archived_before_the_recheck_are_found():
+    sales = week_of_sales()
+    late = sales.pop(2)
+    columns = loaded(sales)
+    assert columns.stats()['rows'] == 3
+
+    cur = FakeCursor([
+        ('archive_state', [{'archived_before': datetime(2024, 3, 1)}]),
+        ('data_versions', [{'products': 1}]),
+        ('LEFT JOIN categories', CATEGORIES),
+        ('WHERE id IN', [late]),
+        ('FROM sales', [])
+    ])
+    columns.refresh(cur, force=True)
+
+    assert columns.stats()['rows'] == 4
+    assert cur.statements('FROM sales_archive WHERE id IN')
+
+def test_shared_columns_are_seen_by_other_workers(tmp_path):
+    writer = loaded(week_of_sales(), str(tmp_path))
+    reader = loaded([], str(tmp_path))
+
+    assert reader.stats()['rows'] == writer.stats()['rows'] == 4
+    assert reader.hour_of_week(MONDAY, SUNDAY) == writer.hour_of_week(MONDAY, SUNDAY)
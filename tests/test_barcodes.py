@@ -0,0 +1,121 @@
+from datetime import datetime
+from decimal import Decimal
+
+from barcodes import BarcodeMap, _entry_bytes
+from tests.fakes import FakeCursor
+
+EARLIER = datetime(2024, 3, 4, 9, 0)
+LATER = datetime(2024, 3, 4, 9, 5)
+
+def product(product_id, barcode, quantity=10, is_active=1, name=None, updated_at=EARLIER):
+    return {'id': product_id, 'barcode': barcode, 'product_name': name or f'Product {product_id}',
+            'price': Decimal('1.50'), 'quantity': quantity, 'is_active': is_active, 'updated_at': updated_at}
+
+def database(products):
+    # products: product_id -> row, edited in place by the tests
+    return FakeCursor([
+        ('COUNT(*)', lambda params: [{'count': len(products),
+                                      'last_update': max(row['updated_at'] for row in products.values())}]),
+        ('WHERE updated_at >=', lambda params: [row for row in products.values() if row['updated_at'] >= params[0]]),
+        ('FROM products', lambda params: list(products.values()))
+    ])
+
+def test_lookup_normalizes_the_scanned_code():
+    barcodes = BarcodeMap()
+    barcodes.add_or_update(product(1, ' 6001 '))
+
+    assert barcodes.lookup('6001\n') == (1, 'Product 1', Decimal('1.50'), 10)
+    assert barcodes.lookup('6002') is None
+    assert (barcodes.stats()['hits'], barcodes.stats()['misses']) == (1, 1)
+
+def test_inactive_and_barcodeless_products_are_not_scannable():
+    barcodes = BarcodeMap()
+    barcodes.add_or_update(product(1, '6001'))
+    barcodes.add_or_update(product(1, '6001', is_active=0))
+    barcodes.add_or_update(product(2, ''))
+
+    assert barcodes.lookup('6001') is None
+    assert barcodes.stats()['unscannable'] == 2
+    assert len(barcodes) == 0
+
+def test_a_reassigned_barcode_survives_removal_of_its_old_product():
+    barcodes = BarcodeMap()
+    barcodes.add_or_update(product(1, '6001'))
+    barcodes.add_or_update(product(2, '6001'))
+
+    barcodes.remove(1)
+
+    assert barcodes.lookup('6001')[0] == 2
+
+def test_changing_a_barcode_drops_the_old_one():
+    barcodes = BarcodeMap()
+    barcodes.add_or_update(product(1, '6001'))
+    barcodes.add_or_update(product(1, '6009'))
+
+    assert barcodes.lookup('6001') is None
+    assert barcodes.lookup('6009')[0] == 1
+
+def test_update_stock_changes_only_the_quantity():
+    barcodes = BarcodeMap()
+    barcodes.add_or_update(product(1, '6001'))
+
+    barcodes.update_stock([{'id': 1, 'quantity': 7}, {'id': 99, 'quantity': 1}])
+
+    assert barcodes.lookup('6001') == (1, 'Product 1', Decimal('1.50'), 7)
+
+def test_entry_bytes_return_to_baseline():
+    barcodes = BarcodeMap()
+    barcodes.add_or_update(product(1, '6001'))
+    barcodes.update_stock([{'id': 1, 'quantity': 123456789}])
+    entry = barcodes.lookup('6001')
+
+    assert barcodes._bytes == _entry_bytes('6001', entry)
+    barcodes.remove(1)
+    assert barcodes._bytes == 0
+
+def test_load_replaces_the_map():
+    barcodes = BarcodeMap()
+    barcodes.add_or_update(product(1, '6001'))
+
+    barcodes.load([product(2, '6002'), product(3, None)])
+
+    assert barcodes.lookup('6001') is None
+    assert barcodes.lookup('6002')[0] == 2
+    assert barcodes.stats()['loaded'] and barcodes.stats()['reloads'] == 1
+
+def test_refresh_applies_the_updated_at_delta():
+    products = {1: product(1, '6001'), 2: product(2, '6002')}
+    barcodes = BarcodeMap()
+    barcodes.refresh(database(products))
+
+    products[2] = product(2, '6002', quantity=3, updated_at=LATER)
+    cur = database(products)
+    barcodes.expire()
+    barcodes.refresh(cur)
+
+    assert barcodes.lookup('6002')[3] == 3
+    assert barcodes.stats()['reloads'] == 1
+    assert [params for _query, params in cur.executed] == [None, (EARLIER,)]
+
+def test_refresh_reloads_when_a_product_was_deleted():
+    products = {1: product(1, '6001'), 2: product(2, '6002')}
+    barcodes = BarcodeMap()
+    barcodes.refresh(database(products))
+
+    del products[1]
+    barcodes.expire()
+    barcodes.refresh(database(products))
+
+    assert barcodes.lookup('6001') is None
+    assert barcodes.stats()['reloads'] == 2
+
+def test_refresh_skips_work_when_nothing_changed():
+    products = {1: product(1, '6001')}
+    barcodes = BarcodeMap()
+    barcodes.refresh(database(products))
+
+    cur = database(products)
+    barcodes.expire()
+    barcodes.refresh(cur)
+
+    assert len(cur.executed) == 1
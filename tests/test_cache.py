@@ -0,0 +1,82 @@
+import time
+
+from cache import TTLCache, VersionedCache
+
+def test_ttl_cache_computes_once():
+    cache = TTLCache(60)
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return 'value'
+
+    assert cache.get_or_set('key', factory) == 'value'
+    assert cache.get_or_set('key', factory) == 'value'
+    assert len(calls) == 1
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(0.01)
+    cache.set('key', 'value')
+    time.sleep(0.02)
+    assert cache.get('key') is None
+
+def test_ttl_cache_clear_drops_entries():
+    cache = TTLCache(60)
+    cache.set('key', 'value')
+    cache.clear()
+    assert cache.get('key') is None
+
+def test_ttl_cache_discards_value_computed_across_clear():
+    # An invalidation that lands while a value is computed must win
+    cache = TTLCache(60)
+
+    def factory():
+        cache.clear()
+        return 'stale'
+
+    assert cache.get_or_set('key', factory) == 'stale'
+    assert cache.get('key') is None
+
+def test_versioned_cache_bump_invalidates_namespace():
+    cache = VersionedCache()
+    cache.set('products', 'sellable', 'old', cache.version('products'))
+    cache.set('categories', 'all', 'categories', cache.version('categories'))
+
+    cache.bump('products')
+
+    assert cache.get('products', 'sellable') is None
+    assert cache.get('categories', 'all') == 'categories'
+
+def test_versioned_cache_ignores_values_from_older_versions():
+    cache = VersionedCache()
+    version = cache.version('products')
+    cache.bump('products')
+    cache.set('products', 'sellable', 'stale', version)
+    assert cache.get('products', 'sellable') is None
+
+def test_versioned_cache_evicts_least_recently_used():
+    cache = VersionedCache(maxsize=2)
+    for key in ('a', 'b'):
+        cache.set('ns', key, key, 0)
+    cache.get('ns', 'a')
+    cache.set('ns', 'c', 'c', 0)
+
+    assert cache.get('ns', 'b') is None
+    assert cache.get('ns', 'a') == 'a'
+    assert cache.get('ns', 'c') == 'c'
+    assert cache.stats()['evictions'] == 1
+
+def test_versioned_cache_max_age():
+    cache = VersionedCache(max_age=0.01)
+    cache.set('ns', 'key', 'value', 0)
+    time.sleep(0.02)
+    assert cache.get('ns', 'key') is None
+
+def test_versioned_cache_stats():
+    cache = VersionedCache()
+    cache.get_or_set('ns', 'key', lambda: 'value')
+    cache.get_or_set('ns', 'key', lambda: 'other')
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+    assert stats['hit_ratio'] == 0.5
@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+
+import documents
+from documents import JOB_ID_RE, DocumentRenderer, render_receipt
+
+RECEIPT = {
+    'store': 'Corner Shop',
+    'reference': 'S-1042',
+    'sale_time': '2024-03-04 09:30',
+    'cashier': 'alice',
+    'currency': 'USD',
+    'lines': [['Milk', 2, '2.50', '5.00'], ['Bread', 1, '1.20', '1.20']],
+    'total': '6.20'
+}
+
+@pytest.fixture
+def renderer(tmp_path):
+    renderer = DocumentRenderer(str(tmp_path), workers=1, max_bytes=1024)
+    yield renderer
+    renderer.stop()
+
+def test_job_ids_name_the_kind_and_data():
+    job_id = DocumentRenderer.job_id('receipt', RECEIPT)
+
+    assert JOB_ID_RE.fullmatch(job_id)
+    assert job_id == DocumentRenderer.job_id('receipt', dict(reversed(list(RECEIPT.items()))))
+    assert job_id != DocumentRenderer.job_id('receipt', dict(RECEIPT, total='6.21'))
+    assert DocumentRenderer.job_id('report', RECEIPT).startswith('report-')
+
+def test_job_ids_change_with_the_render_version(monkeypatch):
+    job_id = DocumentRenderer.job_id('receipt', RECEIPT)
+    monkeypatch.setattr(documents, 'RENDER_VERSION', documents.RENDER_VERSION + 1)
+
+    assert DocumentRenderer.job_id('receipt', RECEIPT) != job_id
+
+@pytest.mark.parametrize('job_id', ['../receipt-' + '0' * 40, 'receipt-' + 'g' * 40, 'invoice-' + '0' * 40])
+def test_paths_reject_foreign_job_ids(renderer, job_id):
+    with pytest.raises(ValueError):
+        renderer.path(job_id)
+
+def test_unknown_kinds_are_refused(renderer):
+    with pytest.raises(ValueError):
+        renderer.submit('invoice', RECEIPT)
+
+def test_cached_pdfs_are_served_without_rendering(renderer, tmp_path):
+    job_id = DocumentRenderer.job_id('receipt', RECEIPT)
+    (tmp_path / f'{job_id}.pdf').write_bytes(b'%PDF-cached')
+
+    assert renderer.submit('receipt', RECEIPT) == job_id
+    assert renderer.status(job_id) == ('done', None)
+    assert renderer.stats()['cache_hits'] == 1
+    assert renderer.stats()['submitted'] == 0
+
+def test_status_of_unknown_and_failed_jobs(renderer, tmp_path):
+    job_id = DocumentRenderer.job_id('receipt', RECEIPT)
+    assert renderer.status(job_id) == (None, None)
+
+    (tmp_path / f'{job_id}.error').write_text('out of paper')
+    assert renderer.status(job_id) == ('failed', 'out of paper')
+
+def test_eviction_removes_the_least_recently_served(renderer, tmp_path):
+    now = time.time()
+    for age, name in enumerate(('new', 'middle', 'old')):
+        path = tmp_path / f'{name}.pdf'
+        path.write_bytes(b'x' * 400)
+        os.utime(path, (now - age * 60, now - age * 60))
+
+    renderer._evict()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['middle.pdf', 'new.pdf']
+    assert renderer.stats()['evicted'] == 1
+
+def test_receipts_render_byte_identical():
+    pdf = render_receipt(RECEIPT)
+
+    assert pdf.startswith(b'%PDF')
+    assert pdf == render_receipt(RECEIPT)
+
+def test_a_submitted_job_renders_in_the_pool(tmp_path):
+    renderer = DocumentRenderer(str(tmp_path), workers=1)
+    try:
+        job_id = renderer.submit('receipt', RECEIPT)
+        deadline = time.monotonic() + 60
+        # The job leaves the queue once its PDF is written and counted
+        while renderer.stats()['pending']:
+            assert time.monotonic() < deadline, 'timed out'
+            time.sleep(0.05)
+
+        assert renderer.status(job_id) == ('done', None)
+        with open(renderer.path(job_id), 'rb') as f:
+            assert f.read() == render_receipt(RECEIPT)
+        assert not os.path.exists(os.path.join(str(tmp_path), f'{job_id}.pending'))
+        assert renderer.stats()['rendered'] == 1
+    finally:
+        renderer.stop()
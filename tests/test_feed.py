@@ -0,0 +1,62 @@
+import pytest
+
+from feed import ChangeFeed, FeedFull
+
+def events(subscription, count):
+    # The first `count` chunks after the retry hint, keepalives included
+    chunks = iter(subscription)
+    assert next(chunks) == 'retry: 5000\n\n'
+    return [next(chunks) for _ in range(count)]
+
+def test_published_events_are_streamed_from_the_last_event_id():
+    feed = ChangeFeed(heartbeat=0.01)
+    start = feed.last_event_id()
+    feed.publish('sale', {'product_id': 1})
+
+    subscription = feed.subscribe(start)
+    chunk, = events(subscription, 1)
+    subscription.close()
+
+    assert chunk == f'id: {feed.epoch}-1\nevent: sale\ndata: {{"product_id":1}}\n\n'
+
+def test_unknown_ids_get_a_reset():
+    feed = ChangeFeed(heartbeat=0.01)
+
+    subscription = feed.subscribe('elsewhere-3')
+    chunk, = events(subscription, 1)
+    subscription.close()
+
+    assert 'event: reset' in chunk
+
+def test_other_workers_commits_send_a_refresh():
+    versions = iter(['1.1', '1.1', '1.2'])
+    feed = ChangeFeed(heartbeat=0, probe=lambda: next(versions, '1.2'))
+
+    subscription = feed.subscribe(feed.last_event_id())
+    chunks = events(subscription, 3)
+    subscription.close()
+
+    assert chunks[:2] == [': keepalive\n\n', ': keepalive\n\n']
+    assert 'event: refresh' in chunks[2]
+    assert feed.stats()['remote_refreshes'] == 1
+
+def test_a_failing_probe_only_skips_the_check():
+    def probe():
+        raise OSError('database unavailable')
+    feed = ChangeFeed(heartbeat=0, probe=probe)
+
+    subscription = feed.subscribe(feed.last_event_id())
+    assert events(subscription, 2) == [': keepalive\n\n', ': keepalive\n\n']
+    subscription.close()
+
+def test_subscribers_are_capped_and_released():
+    feed = ChangeFeed(max_subscribers=1)
+    subscription = feed.subscribe()
+    with pytest.raises(FeedFull):
+        feed.subscribe()
+
+    subscription.close()
+    subscription.close()
+
+    assert feed.stats()['subscribers'] == 0
+    feed.subscribe().close()
@@ -0,0 +1,146 @@
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+MySQLdb = pytest.importorskip('MySQLdb')
+
+from journal import JOURNAL_SUFFIX, JournalEntry, SaleJournal, read_journal
+from tests.fakes import FakePool
+
+SOLD_AT = datetime(2024, 3, 4, 9, 30, 15)
+
+def row(product_id, quantity, price='2.50'):
+    return (product_id, 1, quantity, Decimal(price), Decimal(price) * quantity, SOLD_AT)
+
+def write_journal(path, entries, tail=''):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(entry.encode() for entry in entries) + tail)
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def test_entries_survive_a_round_trip():
+    entry = JournalEntry('a', 7, [row(1, 2), row(5, 1, '0.99')])
+    line = entry.encode()
+
+    decoded = JournalEntry.decode('a', line)
+
+    assert line.endswith('\n') and line.count('\n') == 1
+    assert (decoded.journal_id, decoded.seq, decoded.sale_rows) == ('a', 7, entry.sale_rows)
+    assert isinstance(decoded.sale_rows[0][3], Decimal)
+
+def test_a_torn_last_line_is_ignored(tmp_path):
+    path = tmp_path / ('a' + JOURNAL_SUFFIX)
+    write_journal(path, [JournalEntry('a', 1, [row(1, 1)]), JournalEntry('a', 2, [row(2, 1)])], '{"seq":3,"ro')
+
+    assert [entry.seq for entry in read_journal(path, 'a')] == [1, 2]
+
+def test_a_corrupt_line_before_the_end_is_an_error(tmp_path):
+    path = tmp_path / ('a' + JOURNAL_SUFFIX)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(JournalEntry('a', 1, [row(1, 1)]).encode() + 'garbage\n' + JournalEntry('a', 3, [row(2, 1)]).encode())
+
+    with pytest.raises(ValueError):
+        read_journal(path, 'a')
+
+def stocked_pool(stock, applied=()):
+    # stock: product_id -> quantity, decremented by the guarded UPDATEs
+    def decrement(params):
+        quantity, product_id, _minimum = params
+        if stock.get(product_id, 0) < quantity:
+            return []
+        stock[product_id] -= quantity
+        return [{}]
+    return FakePool([
+        ('quantity >= %s', decrement),
+        ('SELECT journal_id, applied_seq', [{'journal_id': journal_id, 'applied_seq': seq}
+                                            for journal_id, seq in applied])
+    ])
+
+def test_orphaned_journals_replay_only_unapplied_entries(tmp_path):
+    orphan = tmp_path / ('dead' + JOURNAL_SUFFIX)
+    write_journal(orphan, [JournalEntry('dead', 1, [row(1, 2)]), JournalEntry('dead', 2, [row(2, 3)]),
+                           JournalEntry('dead', 3, [row(1, 1)])])
+    written, committed = [], []
+    stock = {1: 10, 2: 10}
+    pool = stocked_pool(stock, [('dead', 1)])
+    journal = SaleJournal(str(tmp_path), pool, lambda cur, rows: written.extend(rows), committed.extend)
+
+    journal._ensure_started()
+    wait_until(lambda: journal.stats()['pending'] == 0)
+    journal.stop()
+
+    assert written == [row(2, 3), row(1, 1)]
+    assert committed == written
+    assert stock == {1: 9, 2: 7}
+    assert not orphan.exists()
+    replay = pool.connection.cursors[0]
+    _query, applied = replay.statements('INSERT INTO sale_journal_state')[0]
+    assert applied == [('dead', 3)]
+    assert journal.stats()['replayed'] == 3
+
+    # Neither the replayed journal nor the stopped one can be replayed again
+    forgotten = [params for cur in pool.connection.cursors
+                 for _query, params in cur.statements('DELETE FROM sale_journal_state')]
+    assert forgotten == [('dead',), (journal.journal_id,)]
+    assert not list(tmp_path.glob('*' + JOURNAL_SUFFIX))
+
+def test_stock_sold_by_another_worker_is_not_oversold(tmp_path):
+    orphan = tmp_path / ('dead' + JOURNAL_SUFFIX)
+    write_journal(orphan, [JournalEntry('dead', 1, [row(1, 4), row(2, 1)]), JournalEntry('dead', 2, [row(1, 3)]),
+                           JournalEntry('dead', 3, [row(1, 1)])])
+    written = []
+    stock = {1: 5, 2: 1}
+    journal = SaleJournal(str(tmp_path), stocked_pool(stock), lambda cur, rows: written.extend(rows))
+
+    journal._ensure_started()
+    wait_until(lambda: journal.stats()['pending'] == 0)
+    journal.stop()
+
+    # The earliest sales keep the stock; the line that no longer fits is set aside
+    assert written == [row(1, 4), row(2, 1), row(1, 1)]
+    assert stock == {1: 0, 2: 0}
+    assert journal.stats()['out_of_stock'] == 1
+    rejected = [json.loads(line) for line in (tmp_path / 'rejected.jsonl').read_text().splitlines()]
+    assert [(record['error'], record['entry']['seq'], record['entry']['rows'][0][2]) for record in rejected] == \
+        [('insufficient stock', 2, 3)]
+
+def allocate(products, user_id, lines):
+    results, sale_rows = [], []
+    for line in lines:
+        product = products[line['product_id']]
+        if product['stock'] < line['quantity']:
+            results.append({'product_id': line['product_id'], 'status': 'insufficient_stock'})
+        else:
+            results.append({'product_id': line['product_id'], 'status': 'ok'})
+            sale_rows.append(row(line['product_id'], line['quantity']))
+    return results, sale_rows, {}
+
+class DownPool:
+    def acquire(self):
+        raise MySQLdb.OperationalError(2003, "Can't connect to MySQL server")
+
+    def release(self, conn, discard=False):
+        pass
+
+def test_pending_sales_reserve_stock_while_the_database_is_down(tmp_path):
+    journal = SaleJournal(str(tmp_path), DownPool(), lambda cur, rows: None, retry_backoff=0.01)
+    stock = {7: {'stock': 5}}
+
+    results, sale_rows = journal.submit(1, [{'product_id': 7, 'quantity': 4}], lambda lines: stock, allocate)
+    assert results[0]['status'] == 'ok' and sale_rows == [row(7, 4)]
+
+    # The database still says 5, but 4 of those are already sold
+    results, sale_rows = journal.submit(1, [{'product_id': 7, 'quantity': 2}], lambda lines: stock, allocate)
+    assert results[0]['status'] == 'insufficient_stock' and sale_rows == []
+
+    entries = read_journal(tmp_path / (journal.journal_id + JOURNAL_SUFFIX), journal.journal_id)
+    assert [(entry.seq, entry.sale_rows) for entry in entries] == [(1, [row(7, 4)])]
+    assert journal.stats()['pending'] == 1
+    journal.stop(timeout=0.5)
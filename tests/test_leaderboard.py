@@ -0,0 +1,62 @@
+from datetime import date, datetime, timedelta
+
+from leaderboard import Leaderboard
+from tests.fakes import FakeCursor
+
+TODAY = date.today()
+
+def loaded(buckets, totals, size=50):
+    # buckets: (days ago, product_id, quantity); totals: product_id -> all-time units
+    board = Leaderboard(size=size)
+    board.refresh(FakeCursor([
+        ('WHERE sale_date BETWEEN', [{'sale_date': TODAY - timedelta(days=days_ago), 'product_id': product_id,
+                                      'quantity': quantity} for days_ago, product_id, quantity in buckets]),
+        ('JOIN products', [{'product_id': product_id, 'product_name': f'Product {product_id}', 'quantity': quantity}
+                           for product_id, quantity in totals.items()])
+    ]))
+    return board
+
+def sale(product_id, quantity, days_ago=0):
+    return (product_id, 1, quantity, 1, quantity, datetime.combine(TODAY - timedelta(days=days_ago),
+                                                                   datetime.min.time()))
+
+def test_windows_count_only_their_days():
+    board = loaded([(0, 1, 5), (3, 2, 8), (20, 3, 30)], {1: 5, 2: 8, 3: 30, 4: 100})
+
+    assert board.top('today', 10) == [(1, 5)]
+    assert board.top('7d', 10) == [(2, 8), (1, 5)]
+    assert board.top('30d', 10) == [(3, 30), (2, 8), (1, 5)]
+    assert board.top('all', 10) == [(4, 100), (3, 30), (2, 8), (1, 5)]
+    assert board.names[4] == 'Product 4'
+
+def test_recorded_sales_move_products_up():
+    board = loaded([(0, 1, 5), (0, 2, 4)], {1: 5, 2: 4})
+    board.record([sale(2, 3)])
+
+    assert board.top('today', 10) == [(2, 7), (1, 5)]
+    assert board.top('all', 10) == [(2, 7), (1, 5)]
+
+def test_new_product_enters_a_full_list():
+    board = loaded([(0, 1, 5), (0, 2, 4)], {1: 5, 2: 4}, size=2)
+    board.record([sale(3, 6)])
+    assert board.top('today', 10) == [(3, 6), (1, 5)]
+
+def test_ties_break_on_product_id():
+    board = loaded([(0, 2, 5), (0, 1, 5)], {1: 5, 2: 5})
+    assert board.top('today', 10) == [(1, 5), (2, 5)]
+
+def test_sales_before_first_load_are_left_to_the_load():
+    board = Leaderboard()
+    board.record([sale(1, 5)])
+    assert board.needs_refresh()
+
+def test_reconcile_reports_drift():
+    board = loaded([], {1: 10})
+    board.record([sale(1, 2)])
+    board.refresh(FakeCursor([
+        ('WHERE sale_date BETWEEN', []),
+        ('JOIN products', [{'product_id': 1, 'product_name': 'Product 1', 'quantity': 15}])
+    ]), force=True)
+    # 12 counted in memory, 15 in the rollup: another worker sold 3
+    assert board.stats()['last_drift'] == 3
+    assert board.top('all', 1) == [(1, 15)]
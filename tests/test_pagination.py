@@ -0,0 +1,73 @@
+from pagination import decode_cursor, encode_cursor, keyset_page, page_tokens
+from tests.fakes import FakeCursor
+
+QUERY = "SELECT * FROM products p WHERE 1=1"
+
+def rows(*ids):
+    return [{'id': row_id, 'price': row_id * 10} for row_id in ids]
+
+def test_cursor_round_trip():
+    token = encode_cursor('Milk', 42, 'next', 3)
+    assert '=' not in token
+    assert decode_cursor(token) == {'v': 'Milk', 'id': 42, 'd': 'next', 'p': 3}
+
+def test_decode_rejects_bad_tokens():
+    assert decode_cursor(None) is None
+    assert decode_cursor('') is None
+    assert decode_cursor('not a cursor') is None
+    assert decode_cursor(encode_cursor(1, 1, 'sideways', 2)) is None
+
+def test_decode_clamps_page():
+    assert decode_cursor(encode_cursor(1, 1, 'next', -5))['p'] == 1
+
+def test_first_page():
+    cur = FakeCursor([('SELECT', rows(*range(1, 12)))])
+    page_rows, page, has_prev, has_next = keyset_page(cur, QUERY, [], 'p.price', 'p.id', 'asc', None, 10)
+
+    assert [row['id'] for row in page_rows] == list(range(1, 11))
+    assert (page, has_prev, has_next) == (1, False, True)
+    query, params = cur.executed[0]
+    assert query.endswith('ORDER BY p.price ASC, p.id ASC LIMIT %s')
+    assert params == (11,)
+
+def test_next_page_seeks_past_cursor():
+    cur = FakeCursor([('SELECT', rows(11, 12))])
+    cursor = {'v': 100, 'id': 10, 'd': 'next', 'p': 2}
+    page_rows, page, has_prev, has_next = keyset_page(cur, QUERY, [], 'p.price', 'p.id', 'asc', cursor, 10)
+
+    assert [row['id'] for row in page_rows] == [11, 12]
+    assert (page, has_prev, has_next) == (2, True, False)
+    query, params = cur.executed[0]
+    assert 'AND (p.price > %s OR (p.price = %s AND p.id > %s))' in query
+    assert params == (100, 100, 10, 11)
+
+def test_previous_page_scans_backwards_and_restores_order():
+    # Walking back on an ascending sort reads descending, then reverses
+    cur = FakeCursor([('SELECT', rows(20, 19, 18))])
+    cursor = {'v': 210, 'id': 21, 'd': 'prev', 'p': 2}
+    page_rows, page, has_prev, has_next = keyset_page(cur, QUERY, [], 'p.price', 'p.id', 'asc', cursor, 3)
+
+    assert [row['id'] for row in page_rows] == [18, 19, 20]
+    assert has_next
+    # No row beyond the page, so this is the first page whatever the token said
+    assert (page, has_prev) == (1, False)
+    query, _params = cur.executed[0]
+    assert 'p.price < %s' in query
+    assert 'ORDER BY p.price DESC, p.id DESC' in query
+
+def test_descending_next_page_seeks_below_cursor():
+    cur = FakeCursor([('SELECT', rows(5))])
+    cursor = {'v': 60, 'id': 6, 'd': 'next', 'p': 2}
+    keyset_page(cur, QUERY, [], 'p.price', 'p.id', 'desc', cursor, 10)
+
+    query, _params = cur.executed[0]
+    assert 'p.price < %s' in query
+    assert 'ORDER BY p.price DESC, p.id DESC' in query
+
+def test_page_tokens_point_at_page_edges():
+    prev_token, next_token = page_tokens(rows(4, 5, 6), 2, True, True, 'price')
+
+    assert decode_cursor(prev_token) == {'v': 40, 'id': 4, 'd': 'prev', 'p': 1}
+    assert decode_cursor(next_token) == {'v': 60, 'id': 6, 'd': 'next', 'p': 3}
+    assert page_tokens([], 1, False, False, 'price') == (None, None)
+    assert page_tokens(rows(1), 1, False, False, 'price') == (None, None)
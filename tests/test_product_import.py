@@ -0,0 +1,144 @@
+import io
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('MySQLdb')
+
+from product_import import ImportFileError, barcode_key, import_products, parse_record, read_rows
+from tests.fakes import FakeConnection, FakeCursor
+
+CATEGORIES = {'7': 7, 'dairy': 7}
+
+def record(**values):
+    base = {'product_name': 'Milk', 'barcode': '6001', 'price': '2.50'}
+    base.update(values)
+    return base
+
+def error_for(**values):
+    with pytest.raises(ValueError) as excinfo:
+        parse_record(record(**values), CATEGORIES)
+    return str(excinfo.value)
+
+def test_parses_a_full_row():
+    row = parse_record(record(quantity='12', category='Dairy', min_stock_level='5', max_stock_level='50',
+                              description=' Full cream '), CATEGORIES)
+    assert row == {
+        'product_name': 'Milk',
+        'description': 'Full cream',
+        'price': Decimal('2.50'),
+        'quantity': 12,
+        'category': '7',
+        'barcode': '6001',
+        'min_stock_level': 5,
+        'max_stock_level': 50
+    }
+
+def test_blank_optional_cells_are_none():
+    row = parse_record(record(quantity='', description=None), CATEGORIES)
+    assert row['quantity'] is None
+    assert row['description'] is None
+    assert row['min_stock_level'] is None
+
+def test_spreadsheet_floats_are_read_as_integers():
+    row = parse_record(record(barcode=6001.0, quantity=3.0, price=2.5), CATEGORIES)
+    assert (row['barcode'], row['quantity'], row['price']) == ('6001', 3, Decimal('2.50'))
+
+def test_categories_by_id_or_name():
+    assert parse_record(record(category='7'), CATEGORIES)['category'] == '7'
+    assert parse_record(record(category='DAIRY'), CATEGORIES)['category'] == '7'
+    assert error_for(category='Toys') == 'unknown category "Toys"'
+
+def test_required_fields():
+    assert error_for(product_name=' ') == 'product_name is required'
+    assert error_for(barcode='') == 'barcode is required'
+    assert error_for(barcode='9' * 51) == 'barcode is longer than 50 characters'
+
+@pytest.mark.parametrize('price', ['', 'abc', 'NaN', 'nan', '-NaN', 'sNaN', 'Infinity', '-inf'])
+def test_prices_that_are_not_numbers(price):
+    assert error_for(price=price) == 'price must be a number'
+
+@pytest.mark.parametrize('price', ['-0.01', '100000000'])
+def test_prices_out_of_range(price):
+    assert error_for(price=price).startswith('price must be between 0 and')
+
+@pytest.mark.parametrize('quantity', ['-1', '1.5', 'lots', 'NaN'])
+def test_quantities_must_be_whole_numbers(quantity):
+    assert error_for(quantity=quantity).startswith('quantity must be a whole number')
+
+def test_min_level_above_max_level():
+    assert error_for(min_stock_level='20', max_stock_level='10') == \
+        'min_stock_level is greater than max_stock_level'
+
+def test_read_rows_maps_header_aliases_and_skips_blank_rows():
+    data = b'Name,SKU,Unit Price,Qty\r\nMilk,6001,2.50,3\r\n,,,\r\nBread,6002,1.20,\r\n'
+    rows = list(read_rows(io.BytesIO(data), 'products.csv'))
+    assert rows == [
+        (2, {'product_name': 'Milk', 'barcode': '6001', 'price': '2.50', 'quantity': '3'}),
+        (4, {'product_name': 'Bread', 'barcode': '6002', 'price': '1.20', 'quantity': ''})
+    ]
+
+def test_read_rows_rejects_missing_columns_and_file_types():
+    with pytest.raises(ImportFileError, match='Missing required columns: barcode'):
+        list(read_rows(io.BytesIO(b'name,price\r\nMilk,2\r\n'), 'products.csv'))
+    with pytest.raises(ImportFileError, match='Unsupported file type'):
+        list(read_rows(io.BytesIO(b''), 'products.txt'))
+
+def test_bad_rows_are_reported_and_the_rest_imported():
+    cur = FakeCursor([
+        ('FOR UPDATE', [{'id': 1, 'barcode': '6001', 'product_name': 'Milk', 'price': Decimal('2.40'),
+                         'quantity': 5, 'description': None, 'category': None,
+                         'min_stock_level': 10, 'max_stock_level': 100}]),
+        ('SELECT id, barcode FROM products', lambda params: [{'id': 100 + index, 'barcode': barcode}
+                                                             for index, barcode in enumerate(params)])
+    ])
+    conn = FakeConnection()
+    rows = [
+        (2, record(quantity='8')),
+        (3, record(barcode='6002', price='NaN')),
+        (4, record(barcode='6003', quantity='4')),
+        (5, record(barcode='6003', quantity='1'))
+    ]
+
+    changes = []
+    result = import_products(conn, cur, rows, 1, [{'id': 7, 'name': 'Dairy'}], on_commit=changes.extend).as_dict()
+
+    assert (result['rows'], result['inserted'], result['updated'], result['failed']) == (4, 1, 1, 2)
+    assert result['errors'] == [
+        {'row': 3, 'barcode': '6002', 'error': 'price must be a number'},
+        {'row': 5, 'barcode': '6003', 'error': 'duplicate barcode (first seen on row 4)'}
+    ]
+    _query, movements = cur.statements('INSERT INTO stock_movements')[0]
+    # An adjustment for the recount of 6001, opening stock for 6003
+    assert [(movement[0], movement[2], movement[3]) for movement in movements] == \
+        [(1, 'adjustment', 3), (100, 'in', 4)]
+    assert conn.commits == 1
+    # Old and new values per product for the audit trail
+    assert [(product_id, old and old['price'], new['price'], new['quantity'])
+            for product_id, old, new in changes] == \
+        [(1, Decimal('2.40'), Decimal('2.50'), 8), (100, None, Decimal('2.50'), 4)]
+
+def test_barcodes_match_the_way_the_column_collation_does():
+    assert barcode_key('SKU-001') == barcode_key('sku-001 ') == barcode_key('ｓｋｕ-001')
+    assert barcode_key('CAFÉ') == barcode_key('cafe')
+    assert barcode_key('6001') != barcode_key('6002')
+
+def test_barcodes_differing_in_case_update_the_stored_product():
+    cur = FakeCursor([
+        ('FOR UPDATE', [{'id': 1, 'barcode': 'SKU-001', 'product_name': 'Milk', 'price': Decimal('2.50'),
+                         'quantity': 5, 'description': None, 'category': None,
+                         'min_stock_level': 10, 'max_stock_level': 100}]),
+        ('SELECT id, barcode FROM products', lambda params: [{'id': 100, 'barcode': 'SKU-002'}])
+    ])
+    rows = [
+        (2, record(barcode='sku-001', quantity='5')),
+        (3, record(barcode='sku-002', quantity='2')),
+        (4, record(barcode='SKU-002', quantity='1'))
+    ]
+
+    result = import_products(FakeConnection(), cur, rows, 1, []).as_dict()
+
+    assert (result['inserted'], result['updated'], result['failed']) == (1, 1, 1)
+    assert result['errors'] == [{'row': 4, 'barcode': 'SKU-002', 'error': 'duplicate barcode (first seen on row 3)'}]
+    _query, movements = cur.statements('INSERT INTO stock_movements')[0]
+    assert [(movement[0], movement[2], movement[3]) for movement in movements] == [(100, 'in', 2)]
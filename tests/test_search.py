@@ -0,0 +1,133 @@
+from search import ProductSearchIndex
+from tests.fakes import FakeCursor
+
+PRODUCTS = [
+    {'id': 1, 'product_name': 'Fresh Milk 1L', 'barcode': '6001', 'category_name': 'Dairy'},
+    {'id': 2, 'product_name': 'Milk Chocolate', 'barcode': '6002', 'category_name': 'Snacks'},
+    {'id': 3, 'product_name': 'Buttermilk', 'barcode': '6003', 'category_name': 'Dairy'},
+    {'id': 4, 'product_name': 'Orange Juice', 'barcode': '7001', 'category_name': 'Beverages'},
+    {'id': 5, 'product_name': 'Mango Juice', 'barcode': '7002', 'category_name': 'Beverages'}
+]
+
+def state(count, last_update, category_update=1):
+    return {'count': count, 'last_update': last_update,
+            'category_count': 4, 'category_update': category_update}
+
+def loaded_index():
+    index = ProductSearchIndex()
+    index.load(PRODUCTS)
+    return index
+
+def test_name_prefix_ranks_before_word_prefix_and_substring():
+    ids, total = loaded_index().search('milk')
+    assert total == 3
+    # "Milk Chocolate" starts with the query, "Fresh Milk" has it as a
+    # word, "Buttermilk" only contains it
+    assert ids == [2, 1, 3]
+
+def test_exact_barcode_ranks_first():
+    ids, _total = loaded_index().search('6003')
+    assert ids == [3]
+
+def test_category_matches_rank_after_name_matches():
+    index = loaded_index()
+    index.add_or_update(6, 'Dairy Cream', '6004', 'Dairy')
+    ids, total = index.search('dairy')
+    assert total == 3
+    assert ids[0] == 6
+
+def test_short_queries_match_word_starts_only():
+    ids, _total = loaded_index().search('ju')
+    assert sorted(ids) == [4, 5]
+    assert loaded_index().search('ui') == ([], 0)
+
+def test_category_only_matches_rank_last_by_name():
+    index = loaded_index()
+    ids, total = index.search('beverages')
+    assert (ids, total) == ([5, 4], 2)
+    assert index.search('beverages', page=2, per_page=1) == ([4], 2)
+    # Terms can be split between name and category
+    assert index.search('dairy fresh') == ([1], 1)
+    assert index.search('be') == ([5, 4], 2)
+
+def test_category_changes_move_products_between_categories():
+    index = loaded_index()
+    index.add_or_update(4, 'Orange Juice', '7001', 'Dairy')
+    assert index.search('beverages') == ([5], 1)
+    assert index.search('dairy')[1] == 3
+    index.remove(1)
+    assert index.search('dairy')[1] == 2
+
+def test_matches_returns_every_match():
+    assert sorted(loaded_index().matches('milk')) == [1, 2, 3]
+    assert loaded_index().matches('  ') == []
+
+def test_every_term_must_match():
+    ids, total = loaded_index().search('juice mango')
+    assert (ids, total) == ([5], 1)
+
+def test_case_and_whitespace_are_ignored():
+    assert loaded_index().search('  ORANGE ')[0] == [4]
+
+def test_paging():
+    index = loaded_index()
+    first, total = index.search('juice', page=1, per_page=1)
+    second, _total = index.search('juice', page=2, per_page=1)
+    assert total == 2
+    assert first + second == [5, 4]
+
+def test_updates_and_removals_apply_to_cached_results():
+    index = loaded_index()
+    assert index.search('juice')[1] == 2
+
+    index.add_or_update(4, 'Orange Squash', '7001', 'Beverages')
+    assert index.search('juice') == ([5], 1)
+    assert index.search('squash') == ([4], 1)
+
+    index.remove(5)
+    assert index.search('juice') == ([], 0)
+
+def test_refresh_applies_delta_and_reloads_after_deletes():
+    index = ProductSearchIndex(refresh_interval=0)
+    cur = FakeCursor([
+        ('COUNT(*)', [state(5, 1)]),
+        ('LEFT JOIN categories', PRODUCTS)
+    ])
+    index.refresh(cur)
+    assert len(index) == 5
+
+    # A product was deleted elsewhere: the count no longer matches
+    cur = FakeCursor([
+        ('COUNT(*)', [state(4, 1)]),
+        ('WHERE p.updated_at', []),
+        ('LEFT JOIN categories', PRODUCTS[:4])
+    ])
+    index.refresh(cur)
+    assert len(index) == 4
+    assert index.search('mango') == ([], 0)
+
+def test_refresh_skips_work_when_nothing_changed():
+    index = ProductSearchIndex(refresh_interval=0)
+    index.refresh(FakeCursor([
+        ('COUNT(*)', [state(5, 1)]),
+        ('LEFT JOIN categories', PRODUCTS)
+    ]))
+    cur = FakeCursor([('COUNT(*)', [state(5, 1)])])
+    index.refresh(cur)
+    assert len(cur.executed) == 1
+
+def test_refresh_reloads_after_a_category_rename():
+    index = ProductSearchIndex(refresh_interval=0)
+    index.refresh(FakeCursor([
+        ('COUNT(*)', [state(5, 1)]),
+        ('LEFT JOIN categories', PRODUCTS)
+    ]))
+
+    renamed = [dict(row, category_name='Drinks') if row['category_name'] == 'Beverages' else row
+               for row in PRODUCTS]
+    index.refresh(FakeCursor([
+        ('COUNT(*)', [state(5, 1, category_update=2)]),
+        ('LEFT JOIN categories', renamed)
+    ]))
+    assert index.search('beverages') == ([], 0)
+    assert index.search('drinks')[1] == 2